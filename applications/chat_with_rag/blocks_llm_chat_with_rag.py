@@ -1,14 +1,24 @@
+import hashlib
 import json
 import os
 import sys
+import threading
 import time
+from collections import OrderedDict
 
-import tiktoken
+import gradio as gr
 from dotenv import load_dotenv
-from openai import AzureOpenAI
+from openai import APIError, AzureOpenAI, NotFoundError
 
 sys.path.append('../../')
 
+from demos.components.log_writer import get_log_writer, read_last_record
+from demos.components.metrics import track_tool_call, count_tool_error
+from demos.components.stream_aggregator import StreamAggregator
+from demos.components.token_counter import TokenTally
+from demos.components.tracing import get_tracer, current_span
+from demos.components.tool_cache import ToolCache
+from demos.components.usage_ledger import UsageLedger
 from demos.tool_calling.tool_descriptors import tools_rag_descriptor
 # noinspection PyUnresolvedReferences
 from fn_rag import lookup_in_documentation, list_documents
@@ -17,7 +27,7 @@ load_dotenv()
 
 client = AzureOpenAI(
     api_key=os.getenv("AOA_API_KEY"),
-    api_version="2024-02-15-preview",
+    api_version="2024-05-01-preview",  # the first version that streams Assistants runs
     azure_endpoint=os.getenv("AOA_ENDPOINT"),
 )
 
@@ -32,39 +42,116 @@ general_instructions = ("I would like you to take a deep breath before respondin
 tools = tools_rag_descriptor
 tools.append({"type": "code_interpreter"})
 
-assistant = client.beta.assistants.create(
-    name="Professional Assistant",
-    description="You support a team of applied researchers operating in Western Europe.",
-    instructions=general_instructions,
-    model="gpt-4o-mini",
-    tools=tools,
-)
+assistant_config = {
+    "name": "Professional Assistant",
+    "description": "You support a team of applied researchers operating in Western Europe.",
+    "instructions": general_instructions,
+    "model": "gpt-4o-mini",
+    "tools": tools,
+}
+
+# the id of the assistant created for every configuration, so a restart re-uses it instead of creating a new one
+ASSISTANT_CACHE_FILE = "./cache/assistants.json"
+assistant = None  # retrieved (or created) on the first message
+assistant_lock = threading.Lock()
+
+tool_cache = ToolCache()
+usage_ledger = UsageLedger()
+log_writer = get_log_writer()
+
+# id of the last logged message per thread, so only newer messages are fetched (the log file knows it as well)
+MAX_REMEMBERED_THREADS = 1024
+last_logged_messages = OrderedDict()
+last_logged_lock = threading.Lock()
+
+# stream the runs of the assistant (text appears while it is generated), poll the run status when this is off
+# or when the API doesn't accept a streaming run
+USE_RUN_STREAMING = True
+FINAL_RUN_STATES = ["completed", "cancelled", "expired", "failed", "incomplete"]
+RUN_END_EVENTS = [f"thread.run.{state}" for state in FINAL_RUN_STATES]
 
 
 def clear_chat():
-    """Reset the chat by creating a new thread and clearing chat state."""
-    thread = client.beta.threads.create()
-    return ["", "", thread]
+    """Reset the chat and clear the chat state, the next message starts a new thread."""
+    return ["", "", None]
+
+
+def get_assistant():
+    global assistant
+    if assistant is None:
+        with assistant_lock:
+            if assistant is None:
+                assistant = load_or_create_assistant(assistant_config)
+    return assistant
+
+
+def load_or_create_assistant(config):
+    """Retrieve the assistant created earlier for this configuration, or create (and remember) a new one."""
+    config_json = json.dumps({"endpoint": os.getenv("AOA_ENDPOINT"), **config}, sort_keys=True)
+    config_hash = hashlib.sha256(config_json.encode("utf-8")).hexdigest()[:16]
+
+    assistant_ids = {}
+    if os.path.exists(ASSISTANT_CACHE_FILE):
+        try:
+            with open(ASSISTANT_CACHE_FILE, "r") as cache_file:
+                assistant_ids = json.load(cache_file)
+        except (OSError, ValueError) as e:
+            print(f"Ignoring the assistant cache file: {e}")
+
+    if config_hash in assistant_ids:
+        try:
+            return client.beta.assistants.retrieve(assistant_ids[config_hash])
+        except NotFoundError:
+            print(f"Assistant {assistant_ids[config_hash]} no longer exists, creating a new one")
+
+    new_assistant = client.beta.assistants.create(**config)
+    print(f"Created assistant {new_assistant.id}")
+    assistant_ids[config_hash] = new_assistant.id
+
+    cache_folder = os.path.dirname(ASSISTANT_CACHE_FILE)
+    if cache_folder and not os.path.exists(cache_folder):
+        os.makedirs(cache_folder)
+    try:
+        with open(ASSISTANT_CACHE_FILE, "w") as cache_file:
+            json.dump(assistant_ids, cache_file, indent=2)
+    except OSError as e:
+        print(e)
+    return new_assistant
 
 
 def store_thread(thread, log_folder):
-    """Persist the thread's messages to a log file in the specified folder."""
+    """Append the thread's new messages to its log file in the specified folder (one JSON line per message)."""
+    log_path = os.path.join(log_folder, f"{thread.id}.jsonl")
+    last_message_id = get_last_logged_message_id(thread.id, log_path)
+
+    list_args = {"after": last_message_id} if last_message_id is not None else {}
     messages = client.beta.threads.messages.list(
         thread_id=thread.id,
-        order="asc"
+        order="asc",
+        limit=100,
+        **list_args
     )
-    log_string = messages.model_dump_json(indent=2)
+    new_messages = [message.model_dump(mode="json") for message in messages]  # follows the next pages as well
+    if len(new_messages) == 0:
+        return
 
-    if not os.path.exists(log_folder):
-        os.makedirs(log_folder)
+    log_writer.append(log_path, new_messages)
+    with last_logged_lock:
+        last_logged_messages[thread.id] = new_messages[-1]["id"]
+        last_logged_messages.move_to_end(thread.id)
+        if len(last_logged_messages) > MAX_REMEMBERED_THREADS:
+            last_logged_messages.popitem(last=False)
 
-    log_path = os.path.join(log_folder, f"{thread.id}.json")
-    try:
-        with open(log_path, "w") as log_file:
-            log_file.write(log_string)
-    except OSError as e:
-        print(e)
-        pass
+
+def get_last_logged_message_id(thread_id, log_path):
+    with last_logged_lock:
+        last_message_id = last_logged_messages.get(thread_id)
+    if last_message_id is None and os.path.exists(log_path):
+        log_writer.flush()  # e.g. a thread of before a restart
+        last_message = read_last_record(log_path)
+        if last_message is not None:
+            last_message_id = last_message.get("id")
+    return last_message_id
 
 
 def append_user(message, chat_history):
@@ -74,7 +161,17 @@ def append_user(message, chat_history):
     return chat_history
 
 
-def call_to_action(run, thread):
+def call_to_action(run, thread, stream=False):
+    """Execute the tool calls a run is waiting for and submit their results (returns the event stream if stream)."""
+    return client.beta.threads.runs.submit_tool_outputs(
+        thread_id=thread.id,
+        run_id=run.id,
+        tool_outputs=get_tool_outputs(run, thread),
+        stream=stream,
+    )
+
+
+def get_tool_outputs(run, thread):
     function_calls = run.required_action.submit_tool_outputs.tool_calls
     function_results = {}
     for function_call in function_calls:
@@ -84,16 +181,23 @@ def call_to_action(run, thread):
 
         if fn_pointer is not None:
             arguments = json.loads(function_call.function.arguments)
-            if 'query' in arguments:
-                query = arguments["query"]
-                result = fn_pointer(query)
-            else:
-                result = fn_pointer()
+            with track_tool_call(function_name), \
+                    get_tracer().start_span("tool_call", attributes={"tool": function_name,
+                                                                      "thread": thread.id}) as tool_span:
+                span_token = current_span.set(tool_span)  # parent for the spans in query_store
+                try:
+                    if 'query' in arguments:
+                        result = tool_cache.call(function_name, fn_pointer, {"query": arguments["query"]})
+                    else:
+                        result = tool_cache.call(function_name, fn_pointer, {})
+                finally:
+                    current_span.reset(span_token)
             function_results[function_call.id] = result
         else:
             print(f"Unknown function name: {function_name}")
+            count_tool_error(function_name)
 
-    # submit function responses
+    # function responses
     outputs = []
     for function_call in function_calls:
         if function_call.id in function_results:
@@ -103,29 +207,102 @@ def call_to_action(run, thread):
             })
         else:
             print(f"Function result not found: {function_call.id}")
+    return outputs
 
-    client.beta.threads.runs.submit_tool_outputs(
-        thread_id=thread.id,
-        run_id=run.id,
-        tool_outputs=outputs,
-    )
 
+def append_ai(thread, message, chat_history, log_folder, token_tally, request: gr.Request):
+    if thread is None:
+        thread = client.beta.threads.create()  # only for users that actually chat
+        print(f"Created a thread with id: {thread.id}")
 
-def append_ai(thread, message, chat_history, log_folder):
     client.beta.threads.messages.create(
         thread_id=thread.id,
         role="user",
         content=message
     )
 
+    run = None
+    if USE_RUN_STREAMING:
+        run = yield from stream_run(thread, chat_history)
+    if run is None:
+        run = poll_run(thread)
+        append_last_message(thread, chat_history)
+
+    # exact usage of the run (all steps, tool calls included), estimate only when the run doesn't report it
+    if run.usage is not None:
+        usage_ledger.record(run.usage, model=get_assistant().model, user=request.username, session=request.session_hash)
+        debug = (f"Token usage: {run.usage.prompt_tokens} input tokens "
+                 f"and {run.usage.completion_tokens} output tokens.")
+    else:
+        (token_count_prompts, token_count_responses) = estimate_token_count(chat_history, token_tally)
+        debug = f"Token estimate:  {token_count_prompts} input tokens and {token_count_responses} output tokens."
+
+    store_thread(thread, log_folder)
+    yield "", chat_history, debug, thread
+
+
+def stream_run(thread, chat_history):
+    """
+    Generator that runs the assistant on the thread, and shows its answer in the chat history while it arrives.
+    Tool calls are executed as soon as the run asks for them. Returns the finished run,
+    or None when the run could not be streamed (the caller polls it instead).
+    """
+    start_time = time.time()
+    try:
+        event_stream = client.beta.threads.runs.create(
+            thread_id=thread.id,
+            assistant_id=get_assistant().id,
+            stream=True,
+        )
+    except APIError as e:
+        print(f"Could not stream the run, polling it instead: {e}")
+        return None
+
+    aggregator = StreamAggregator()
+    chat_history.append({"role": "assistant", "content": ""})  # filled in while the answer streams
+    run = None
+    while event_stream is not None:
+        next_stream = None
+        with event_stream:
+            for event in event_stream:
+                if event.event == "thread.message.created" and (aggregator.text or aggregator.has_pending()):
+                    aggregator.add("\n\n")  # the next message of the run (e.g. after a tool call)
+                elif event.event == "thread.message.delta":
+                    for content in event.data.delta.content or []:
+                        if content.type == "text" and content.text is not None and aggregator.add(content.text.value):
+                            chat_history[-1]["content"] = aggregator.flush()
+                            yield "", chat_history, "", thread
+                elif event.event == "thread.run.requires_action":
+                    run = event.data
+                    print(f"Elapsed time: {round(time.time() - start_time, 1)} seconds, Status: {run.status}")
+                    next_stream = call_to_action(run, thread, stream=True)  # the run continues in a new stream
+                    break
+                elif event.event in RUN_END_EVENTS:
+                    run = event.data
+                elif event.event == "error":
+                    print(f"Run failed: {event.data}")
+        event_stream = next_stream
+
+    chat_history[-1]["content"] = aggregator.flush()
+    if run is None:
+        raise gr.Error("The assistant run ended without a status")
+    print(f"Elapsed time: {round(time.time() - start_time, 1)} seconds, Status: {run.status}")
+
+    if not chat_history[-1]["content"]:
+        chat_history.pop()  # e.g. no text in the answer, show the last message of the thread instead
+        append_last_message(thread, chat_history)
+    return run
+
+
+def poll_run(thread):
     run = client.beta.threads.runs.create(
         thread_id=thread.id,
-        assistant_id=assistant.id,
+        assistant_id=get_assistant().id,
     )
 
     start_time = time.time()
     status = run.status
-    while status not in ["completed", "cancelled", "expired", "failed"]:
+    while status not in FINAL_RUN_STATES:
         time.sleep(0.33)
         run = client.beta.threads.runs.retrieve(thread_id=thread.id, run_id=run.id)
         time_diff = round((time.time() - start_time), 1)
@@ -133,7 +310,10 @@ def append_ai(thread, message, chat_history, log_folder):
         print(f"Elapsed time: {time_diff} seconds, Status: {status}")
         if run.status == "requires_action":
             call_to_action(run, thread)
+    return run
 
+
+def append_last_message(thread, chat_history):
     messages = client.beta.threads.messages.list(
         thread_id=thread.id,
         order="desc",
@@ -148,25 +328,9 @@ def append_ai(thread, message, chat_history, log_folder):
             bot_message = msg_data.content[0].text.value
             chat_history.append({"role": msg_data.role, "content": bot_message})
 
-    # cost estimate
-    (token_count_prompts, token_count_responses) = estimate_token_count(chat_history)
-    debug = f"Token estimate:  {token_count_prompts} input tokens and {token_count_responses} output tokens."
-
-    store_thread(thread, log_folder)
-    return "", chat_history, debug
-
-
-def estimate_token_count(chat_history):
-    prompt_log = ""
-    response_log = ""
-    for msg in chat_history:
-        if msg.get("role") == "user":
-            prompt_log += msg["content"]
-        elif msg.get("role") == "assistant":
-            response_log += msg["content"]
-
-    tokeniser = tiktoken.encoding_for_model("gpt-4")
-    token_count_prompts = len(tokeniser.encode(prompt_log))
-    token_count_responses = len(tokeniser.encode(response_log))
 
-    return token_count_prompts, token_count_responses
+def estimate_token_count(chat_history, token_tally=None):
+    # the tally of the session only counts the messages added since the previous turn
+    token_tally = token_tally if token_tally is not None else TokenTally()
+    token_tally.update(chat_history)
+    return token_tally.get_count("user"), token_tally.get_count("assistant")
@@ -1,13 +1,25 @@
 import json
 import os
+import sys
 from datetime import datetime
 
 import gradio as gr
 
-dropdown_entries = []
-file_contents = {}
+sys.path.append('../../')
+
+from demos.components.conversation_search import get_conversation_search, read_conversation
+from demos.components.log_archive import read_log_text, split_archived_path
+from demos.components.log_catalog import get_log_catalog
+from demos.components.log_writer import get_log_writer
+
 default_folder = "logs/"
 
+# full-text search over the logs of the user, and the (anonymous) logs of the FAQ tool
+SEARCH_PAGE_SIZE = 10
+SEARCH_RESCAN_INTERVAL = 30  # seconds, how often a search checks the log folders for logs it has missed
+FAQ_OWNER = "faq tool"  # can't collide with a user folder, those have no spaces
+search_index = get_conversation_search(os.path.join(default_folder, ".search_index.sqlite"))
+
 
 def set_folder(user_folder):
     log_folder = f"{default_folder}{user_folder}/"
@@ -19,52 +31,67 @@ def set_folder(user_folder):
 
 
 def load_files(log_folder):
-    log_folder = os.path.normpath(os.path.abspath(log_folder))
-    try:
-        files = os.listdir(log_folder)
-    except OSError:
-        return gr.Dropdown(choices=[])
-    files.sort(key=lambda f: os.path.getmtime(os.path.join(log_folder, f)), reverse=True)
-    entries = []
-    for file in files:
-        file_path = os.path.normpath(os.path.join(log_folder, file))
-        try:
-            with open(file_path, "r") as log_file:
-                log_content = log_file.read()
-        except (OSError, IOError):
-            continue
-        file_contents[file] = log_content
-        title = get_title(log_content, file)
-        entries.append((title, file))
+    # only the logs that changed since the previous scan are read, the dropdown comes from the catalog
+    catalog = get_log_catalog(log_folder, describe_log)
+    catalog.scan()
+    entries = [(entry["title"], entry["file_name"]) for entry in catalog.list_logs()]
     return gr.Dropdown(choices=entries)
 
 
-def get_title(log_content, default_title=""):
+def describe_log(log_path):
+    """Title and creation time of a log (archived or not), from its first message."""
+    archived = split_archived_path(log_path)
+    if archived is not None:
+        first_messages = parse_messages(read_log_text(log_path), log_path)
+    elif log_path.endswith(".jsonl"):
+        with open(log_path, "r") as log_file:
+            first_messages = parse_messages(log_file.readline(), log_path)  # appended logs: no need to read on
+    else:
+        with open(log_path, "r") as log_file:
+            first_messages = parse_messages(log_file.read(), log_path)
+    file_name = archived[1] if archived is not None else os.path.basename(log_path)
+    if len(first_messages) == 0:
+        return file_name, None
+    return get_title(first_messages[0], file_name), first_messages[0].get("created_at")
+
+
+def get_title(first_message, default_title=""):
     title = default_title
-    messages = json.loads(log_content)
-    if messages["data"] and len(messages["data"]) > 0:
-        first_message = messages["data"][0]
-        if first_message["created_at"]:
-            date_obj = datetime.fromtimestamp(first_message["created_at"])
-            title = f"[{date_obj}]"
-        if first_message["content"] and len(first_message["content"]) > 0:
-            first_content = first_message["content"][0]
-            if first_content["type"] == "text":
-                first_text = first_content['text']['value'][:100]
-                title = f"{title} {first_text}..."
+    if first_message["created_at"]:
+        date_obj = datetime.fromtimestamp(first_message["created_at"])
+        title = f"[{date_obj}]"
+    if first_message["content"] and len(first_message["content"]) > 0:
+        first_content = first_message["content"][0]
+        if first_content["type"] == "text":
+            first_text = first_content['text']['value'][:100]
+            title = f"{title} {first_text}..."
     return title
 
 
-def file_selected(chosen_file):
-    log_content = file_contents.get(chosen_file)
-    if log_content is None:
+def parse_messages(log_content, file_name=""):
+    """The thread messages of a log: one JSON line per message (.jsonl), or a full message list (older .json logs)."""
+    if file_name.endswith(".jsonl"):
+        messages = []
+        for line in log_content.splitlines():
+            try:
+                messages.append(json.loads(line))
+            except ValueError:
+                continue  # e.g. a line that is still being written
+        return messages
+    return json.loads(log_content).get("data") or []
+
+
+def file_selected(chosen_file, log_folder):
+    # only files of the user's own catalog can be opened
+    log_path = get_log_catalog(log_folder, describe_log).get_path(chosen_file) if chosen_file else None
+    if log_path is None:
         return []
     try:
-        messages = json.loads(log_content)
-    except (json.JSONDecodeError, TypeError):
+        messages = parse_messages(read_log_text(log_path), log_path)  # only this log is read from an archive
+    except (OSError, json.JSONDecodeError, TypeError, AttributeError):
         return []
     chat_history = []
-    for message in messages.get("data", []):
+    for message in messages:
         if message.get("role") == "user":
             chat_history.append({"role": "user", "content": message["content"][0]["text"]["value"]})
         elif message.get("role") == "assistant":
@@ -73,8 +100,72 @@ def file_selected(chosen_file):
 
 
 def remove_file(chosen_file, log_folder):
-    full_path = os.path.normpath(f"{log_folder}{chosen_file}")
-    print(full_path)
-    if os.path.exists(full_path):
-        os.remove(full_path)
+    if chosen_file:
+        catalog = get_log_catalog(log_folder, describe_log)
+        log_path = catalog.get_path(chosen_file)
+        catalog.remove(chosen_file)
+        if log_path is not None:
+            search_index.remove_log(log_path)
     return load_files(log_folder)
+
+
+def index_written_logs(log_paths):
+    """Keeps the search index up to date while the logs are written (called from the log writer thread)."""
+    logs_root = os.path.join(os.path.abspath(default_folder), "")
+    for log_path in log_paths:
+        if os.path.abspath(log_path).startswith(logs_root):
+            search_index.update_log(log_path, owner=get_owner(os.path.dirname(log_path)), source="chat")
+
+
+def search_logs(query, log_folder, page=0):
+    # logs written before the index existed, or by the FAQ tool (another process) are picked up here
+    owner = get_owner(log_folder)
+    search_index.update_folder(log_folder, owner=owner, source="chat", min_interval=SEARCH_RESCAN_INTERVAL)
+    faq_log_folder = os.getenv("FAQ_LOG_FOLDER", "../faq_tool/logs/")
+    if os.path.isdir(faq_log_folder):
+        search_index.update_folder(faq_log_folder, owner=FAQ_OWNER, source="faq",
+                                   min_interval=SEARCH_RESCAN_INTERVAL)
+
+    page = max(page, 0)
+    results, total = search_index.search(query, owners=[owner, FAQ_OWNER], page=page, page_size=SEARCH_PAGE_SIZE)
+    if len(results) == 0 and total > 0:  # past the last page
+        page = (total - 1) // SEARCH_PAGE_SIZE
+        results, total = search_index.search(query, owners=[owner, FAQ_OWNER], page=page,
+                                             page_size=SEARCH_PAGE_SIZE)
+    rows = [[result["title"],
+             result["source"],
+             datetime.fromtimestamp(result["created_at"]).strftime("%Y-%m-%d %H:%M") if result["created_at"] else "",
+             f"{result['role']}: {result['snippet']}"]
+            for result in results]
+    log_paths = [result["log_path"] for result in results]
+
+    if total == 0:
+        summary = "No conversations found." if query and query.strip() else ""
+    else:
+        first = page * SEARCH_PAGE_SIZE + 1
+        summary = f"Conversations {first} to {first + len(results) - 1} of {total}"
+    return rows, log_paths, page, summary
+
+
+def search_next_page(query, log_folder, page):
+    return search_logs(query, log_folder, page + 1)
+
+
+def search_previous_page(query, log_folder, page):
+    return search_logs(query, log_folder, page - 1)
+
+
+def search_result_selected(log_paths, select_data: gr.SelectData):
+    if select_data is None or not log_paths or select_data.index[0] >= len(log_paths):
+        return []
+    try:
+        return read_conversation(log_paths[select_data.index[0]])
+    except (OSError, ValueError):
+        return []
+
+
+def get_owner(log_folder):
+    return os.path.basename(os.path.normpath(log_folder))
+
+
+get_log_writer().add_listener(index_written_logs)
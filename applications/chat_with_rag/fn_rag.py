@@ -19,7 +19,7 @@ def list_documents():
         return cdb_store.list_documents()
     except Exception as e:
         print(e)
-        return []
+        return {'error': f'Could not list the documents: {e}'}  # not cached, unlike an empty list
 
 
 def lookup_in_documentation(query):
@@ -28,4 +28,4 @@ def lookup_in_documentation(query):
         return results[:5]
     except Exception as e:
         print(e)
-        return []
+        return {'error': f'Could not search the documentation: {e}'}
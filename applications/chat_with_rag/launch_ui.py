@@ -6,8 +6,7 @@ import gradio as gr
 from blocks_llm_chat_with_rag import (
     append_user,
     append_ai,
-    clear_chat,
-    client
+    clear_chat
 )
 from blocks_rag_upload import (
     on_file_uploaded,
@@ -17,7 +16,11 @@ from blocks_view_history import (
     load_files,
     file_selected,
     set_folder,
-    remove_file
+    remove_file,
+    search_logs,
+    search_next_page,
+    search_previous_page,
+    search_result_selected
 )
 
 sys.path.append('../../')
@@ -25,6 +28,9 @@ sys.path.append('../../')
 from applications.chat_with_rag.blocks_rag_upload import remove_collection
 from demos.components.vectorstore.vs_utilities import sanitize_string
 from demos.components.fn_auth import auth_method
+from demos.components.log_archive import start_log_rotation
+from demos.components.metrics import metrics_app_kwargs
+from demos.components.token_counter import TokenTally
 
 
 def show_live():
@@ -86,9 +92,8 @@ def show_upload():
 
 def on_login(request: gr.Request):
     user_folder = sanitize_string(request.username.lower())
-    new_thread = client.beta.threads.create()
-    print(f'Created a thread with id: {new_thread.id} for user {user_folder}')
-    return [set_folder(user_folder), new_thread]
+    # the thread is created with the first message, the tally is updated in place
+    return [set_folder(user_folder), None, TokenTally()]
 
 
 def show_chat():
@@ -148,7 +153,10 @@ with (gr.Blocks(fill_height=True, title='Pixie Lite', css=custom_css) as llm_cli
     # state that is unique to each user
     st_log_folder = gr.State('logs/')
     st_thread = gr.State()
+    st_token_tally = gr.State()  # token estimate of the chat, for runs that don't report their usage
     st_selected_index = gr.State()
+    st_search_page = gr.State(0)
+    st_search_paths = gr.State([])
 
     disposal_ico = f'{icons_folder}/disposal.png'
 
@@ -172,11 +180,13 @@ with (gr.Blocks(fill_height=True, title='Pixie Lite', css=custom_css) as llm_cli
 
         # event handlers live chat UI
         tb_user_prompt.submit(append_user, [tb_user_prompt, cb_live_chat], [cb_live_chat]
-                              ).then(append_ai, [st_thread, tb_user_prompt, cb_live_chat, st_log_folder],
-                                     [tb_user_prompt, cb_live_chat, lbl_debug])
+                              ).then(append_ai,
+                                     [st_thread, tb_user_prompt, cb_live_chat, st_log_folder, st_token_tally],
+                                     [tb_user_prompt, cb_live_chat, lbl_debug, st_thread])
         btn_send_prompt.click(append_user, [tb_user_prompt, cb_live_chat], [cb_live_chat]
-                              ).then(append_ai, [st_thread, tb_user_prompt, cb_live_chat, st_log_folder],
-                                     [tb_user_prompt, cb_live_chat, lbl_debug])
+                              ).then(append_ai,
+                                     [st_thread, tb_user_prompt, cb_live_chat, st_log_folder, st_token_tally],
+                                     [tb_user_prompt, cb_live_chat, lbl_debug, st_thread])
         btn_clear_chat.click(clear_chat, [], [tb_user_prompt, cb_live_chat, st_thread])
 
     # log viewer UI
@@ -194,10 +204,31 @@ with (gr.Blocks(fill_height=True, title='Pixie Lite', css=custom_css) as llm_cli
             btn_remove_log = gr.Button(value='', scale=0, min_width=64, icon=disposal_ico,
                                        elem_classes='danger')
 
+        with gr.Row():
+            tb_search = gr.Textbox(show_label=False,
+                                   placeholder='Search in your conversations and the FAQ tool logs...',
+                                   scale=10)
+            btn_search = gr.Button('Search', scale=0, min_width=64)
+        df_search_results = gr.Dataframe(headers=['Conversation', 'Source', 'Date', 'Match'],
+                                         col_count=4,
+                                         interactive=False,
+                                         wrap=True)
+        with gr.Row():
+            btn_previous_results = gr.Button('Previous', scale=0, min_width=64)
+            lbl_search_results = gr.Markdown('')
+            btn_next_results = gr.Button('Next', scale=0, min_width=64)
+
         # event handlers log viewer UI
         btn_reload_logs.click(load_files, [st_log_folder], [dd_log_files])
         btn_remove_log.click(remove_file, [dd_log_files, st_log_folder], [dd_log_files])
-        dd_log_files.input(file_selected, [dd_log_files], [cb_chat_history])
+        dd_log_files.input(file_selected, [dd_log_files, st_log_folder], [cb_chat_history])
+
+        search_outputs = [df_search_results, st_search_paths, st_search_page, lbl_search_results]
+        tb_search.submit(search_logs, [tb_search, st_log_folder], search_outputs)
+        btn_search.click(search_logs, [tb_search, st_log_folder], search_outputs)
+        btn_next_results.click(search_next_page, [tb_search, st_log_folder, st_search_page], search_outputs)
+        btn_previous_results.click(search_previous_page, [tb_search, st_log_folder, st_search_page], search_outputs)
+        df_search_results.select(search_result_selected, [st_search_paths], [cb_chat_history])
 
     # file upload UI
     lbl_rag_explainer = gr.HTML(rag_explainer, visible=False)
@@ -248,12 +279,16 @@ with (gr.Blocks(fill_height=True, title='Pixie Lite', css=custom_css) as llm_cli
                           btn_live, btn_history, btn_upload])
 
     # global UI events
-    llm_client_ui.load(on_login, None, [st_log_folder, st_thread])
+    llm_client_ui.load(on_login, None, [st_log_folder, st_thread, st_token_tally])
     llm_client_ui.load(list_collections, [], [df_rag_files])
     llm_client_ui.load(show_chat, [], [cb_live_chat])
 
+# logs that didn't change for LOG_ARCHIVE_DAYS are packed into compressed per-day archives, they stay readable
+start_log_rotation('logs/', float(os.getenv('LOG_ARCHIVE_DAYS', 30)))
+
 # To create a public link, set `share=True` in `launch()`.
 llm_client_ui.queue().launch(auth=auth_method,
                              server_name='0.0.0.0',
                              server_port=7025,
-                             allowed_paths=[assets_folder, icons_folder])
+                             allowed_paths=[assets_folder, icons_folder],
+                             app_kwargs=metrics_app_kwargs())  # Prometheus metrics on /metrics
@@ -1,13 +1,21 @@
-import json
 import os
 import sys
-from datetime import datetime
 
 import gradio as gr
 from dotenv import load_dotenv
 
 sys.path.append('../../')
+from demos.components.agent_loop import AgentLoop
+from demos.components.conversation_context import ConversationCompactor, make_llm_summarizer
+from demos.components.fair_scheduler import FairScheduler, QuotaExceeded, request_identity
+from demos.components.log_archive import start_log_rotation
+from demos.components.log_writer import log_new_messages, start_conversation_log
+from demos.components.metrics import metrics_app_kwargs
 from demos.components.open_router_client import OpenRouterClient, GPT_4O_MINI_1807
+from demos.components.session_store import SessionStore
+from demos.components.token_counter import TokenTally
+from demos.components.tool_cache import ToolCache
+from demos.components.usage_ledger import UsageLedger
 from demos.tool_calling.tool_descriptors import (tools_rag_descriptor)
 
 # noinspection PyUnresolvedReferences
@@ -26,6 +34,36 @@ or_client = OpenRouterClient(model_name=GPT_4O_MINI_1807,
                              api_key=os.getenv('OPENROUTER_API_KEY'),
                              temperature=0.25,
                              custom_headers=custom_headers)
+tool_cache = ToolCache()
+usage_ledger = UsageLedger()
+# long conversations: old tool outputs are replaced by stubs, old turns are summarized
+compactor = ConversationCompactor(max_tokens=16000,
+                                  keep_last_turns=4,
+                                  summarizer=make_llm_summarizer(or_client))
+agent_loop = AgentLoop(or_client,
+                       tool_namespace=globals(),
+                       tool_cache=tool_cache,
+                       compactor=compactor,
+                       usage_ledger=usage_ledger,
+                       deadline_seconds=60,
+                       max_tool_rounds=3,
+                       max_prompt_tokens=100000)
+
+concurrency_limit = 10
+# LLM calls are admitted round robin over the users, within a request and token quota per user and minute
+scheduler = FairScheduler('faq_tool',
+                          max_concurrent=concurrency_limit,
+                          requests_per_minute=float(os.getenv('FAQ_REQUESTS_PER_MINUTE', 10)),
+                          tokens_per_minute=float(os.getenv('FAQ_TOKENS_PER_MINUTE', 100000)),
+                          max_queued_per_user=3)
+QUEUE_UPDATE_INTERVAL = 1.0  # seconds between two updates of the waiting message
+
+# the message lists of the sessions (with the tool outputs): in memory within a budget, idle ones on disk
+session_store = SessionStore('./cache/sessions',
+                             max_bytes=int(float(os.getenv('SESSION_MEMORY_MB', 256)) * 1024 * 1024),
+                             idle_seconds=float(os.getenv('SESSION_IDLE_MINUTES', 10)) * 60,
+                             name='faq_tool')
+session_store.start_sweeper()
 
 main_topic = 'internships at PXL University College in Belgium'
 
@@ -46,20 +84,43 @@ system_instruction = {
 }
 
 
+def get_message_list(session):
+    # a new session (or one that expired on disk) starts with the system instruction
+    return session_store.get(session) or [system_instruction]
+
+
 # blocks UI method
-def append_user(user_message, chat_history, message_list):
+def append_user(user_message, chat_history, request: gr.Request):
+    message_list = get_message_list(request.session_hash)
     chat_history.append({'role': 'user', 'content': user_message})
     message_list.append({'role': 'user', 'content': user_message})
-    return '', chat_history, message_list
+    session_store.put(request.session_hash, message_list)
+    return '', chat_history
 
 
 # blocks UI method
-def append_bot(chat_history, message_list, log_file_name):
-    yield from complete_with_llm(chat_history, message_list, log_file_name)
+def append_bot(chat_history, conversation_log, token_tally, request: gr.Request):
+    # the login name when there is one, otherwise the browser session
+    user = request_identity(request)
+    message_list = get_message_list(request.session_hash)
+    try:
+        yield from complete_with_llm(chat_history, message_list, conversation_log, request.session_hash, user,
+                                     token_tally)
+    finally:
+        session_store.put(request.session_hash, message_list)  # also when the user left during the answer
+
 
+def on_clear_clicked(request: gr.Request):
+    session_store.remove(request.session_hash)
+    return [None, on_load_ui()]
 
-def on_clear_clicked():
-    return [None, on_load_ui(), [system_instruction]]
+
+def on_load_token_tally():
+    return TokenTally()  # one per session, cleared conversations are detected and counted again
+
+
+def on_unload(request: gr.Request):
+    session_store.remove(request.session_hash)
 
 
 def on_load_ui():
@@ -67,86 +128,61 @@ def on_load_ui():
     if not os.path.exists(log_folder):
         os.makedirs(log_folder)
 
-    file_name = datetime.now().strftime('%y%m%d_%H%M%S_%f.log')
-    print(f'Started a new log file named "{file_name}"')
-    return os.path.join(log_folder, file_name)
-
-
-def complete_with_llm(chat_history, message_list, log_file_name):
-    # generate an answer
-    response_stream = or_client.create_completions_stream(message_list=message_list)
-
-    partial_message = ''
-    tool_calls = []
-
-    chat_history.append({'role': 'assistant', 'content': ''})
-
-    for chunk in response_stream:  # stream the response
-        if len(chunk.choices) > 0:
-            # LLM text reponses
-            if chunk.choices[0].delta.content is not None:
-                partial_message = partial_message + chunk.choices[0].delta.content
-                if partial_message:  # Check if partial_message is not empty
-                    chat_history[-1]['content'] = partial_message
-                    yield chat_history, message_list
-
-            # LLM tool call requests
-            if chunk.choices[0].delta.tool_calls is not None:
-                for tool_call_chunk in chunk.choices[0].delta.tool_calls:
-                    if tool_call_chunk.index >= len(tool_calls):
-                        tool_calls.insert(tool_call_chunk.index, tool_call_chunk)
-                    else:
-                        if tool_call_chunk.function is not None:
-                            if tool_calls[tool_call_chunk.index].function is None:
-                                tool_calls[tool_call_chunk.index].function = tool_call_chunk.function
-                            else:
-                                tool_calls[
-                                    tool_call_chunk.index].function.arguments += tool_call_chunk.function.arguments
-
-    response_stream.close()
-
-    # handle text responses
-    if chat_history[-1]['content'] is not None and chat_history[-1]['content'] != '':
-        message_list.append({'role': 'assistant', 'content': chat_history[-1]['content']})
-
-        # write to log file
-        log_string = json.dumps(message_list, indent=2)
-        log_file = open(log_file_name, 'wt')
-        log_file.write(log_string)
-        log_file.close()
-
-    # handle tool requests
-    if len(tool_calls) > 0:
-        print(f'Processing {len(tool_calls)} tool calls')
-        for call in tool_calls:
-            print(f'\t- {call.function.name}')
-            fn_pointer = globals()[call.function.name]
-            fn_args = json.loads(call.function.arguments)
-            tool_call_obj = {
-                'role': 'assistant',
-                'content': None,
-                'tool_calls': [
-                    {
-                        'id': call.id,
-                        'type': 'function',
-                        'function': {
-                            'name': call.function.name,
-                            'arguments': call.function.arguments
-                        }
-                    }
-                ]
-            }
-            message_list.append(tool_call_obj)
-
-            if fn_pointer is not None:
-                fn_result = fn_pointer(**fn_args)
-                tool_resp = {'role': 'tool',
-                             'name': call.function.name,
-                             'tool_call_id': call.id,
-                             'content': json.dumps(fn_result)}
-                message_list.append(tool_resp)
-        # recursively call completion message to give the LLM a chance to process results
-        yield from complete_with_llm(chat_history, message_list, log_file_name)
+    conversation_log = start_conversation_log(log_folder)
+    print(f'Started a new log file named "{os.path.basename(conversation_log["log_file"])}"')
+    return conversation_log
+
+
+def complete_with_llm(chat_history, message_list, conversation_log, session=None, user=None, token_tally=None):
+    # wait for a slot: the prompt is the estimate of the tokens, corrected with the usage afterwards
+    # (the tally of the session only counts the messages added since the previous turn)
+    token_tally = token_tally if token_tally is not None else TokenTally()
+    estimated_tokens = token_tally.update(message_list)
+    try:
+        ticket = scheduler.submit(user or session, estimated_tokens)
+    except QuotaExceeded:
+        gr.Warning('Please wait for the answers to your previous questions before asking a new one.')
+        chat_history.pop()
+        message_list.pop()
+        yield chat_history
+        return
+
+    agent_run = None
+    try:
+        if not ticket.wait(timeout=0):
+            chat_history.append({'role': 'assistant', 'content': ''})
+            while not ticket.wait(timeout=QUEUE_UPDATE_INTERVAL):
+                chat_history[-1]['content'] = (f'*Waiting for a free spot, '
+                                               f'{scheduler.get_position(ticket)} questions ahead of yours...*')
+                yield chat_history
+            chat_history.pop()
+
+        # generate an answer, calling tools when needed
+        agent_run = agent_loop.start(message_list, user=user, session=session, token_tally=token_tally)
+
+        current_round = None
+        for round_nr, partial_message in agent_run.run():  # stream the response(s)
+            if round_nr != current_round:
+                chat_history.append({'role': 'assistant', 'content': ''})
+                current_round = round_nr
+            chat_history[-1]['content'] = partial_message
+            yield chat_history
+    finally:
+        # also when the user leaves while waiting or streaming
+        used_tokens = agent_run.get_prompt_tokens() + agent_run.get_completion_tokens() if agent_run else None
+        scheduler.release(ticket, used_tokens)
+
+    print(agent_run.get_summary())
+    print(f'Waited {ticket.get_wait_time():.2f}s for a slot, scheduler: {scheduler.get_stats()}')
+    report = session_store.get_report(limit=0)
+    print(f'Session: {len(message_list)} messages, {session_store.get_size(session) or 0} bytes, '
+          f'all sessions: {report["bytes_in_memory"]} bytes in memory ({report["sessions_in_memory"]} sessions), '
+          f'{report["sessions_on_disk"]} on disk')
+
+    # append the new messages to the log file (written in the background)
+    log_new_messages(conversation_log, message_list)
+
+    yield chat_history
 
 
 # Gradio UI
@@ -168,12 +204,13 @@ feedback_message = (
     f'please drop us a line at <{os.getenv('FEEDBACK_EMAIL')}>! '
     f'Don\'t forget to include a screenshot of a copy of your chatlog.*')
 
-concurrency_limit = 10
+# handlers that wait in the scheduler queue (or stream an answer), the scheduler admits concurrency_limit LLM calls
+bot_concurrency_limit = 3 * concurrency_limit
 
 with (gr.Blocks(fill_height=True, title='Pixie FAQ Tool', css=custom_css) as llm_client_ui):
     # state variables
-    messages = gr.State([system_instruction])
-    log_file_name = gr.State()
+    conversation_log = gr.State()  # the message list of the session is in session_store
+    token_tally = gr.State()  # token count of the message list, updated in place
 
     # UI elements
     cb_live = gr.Chatbot(label='Chat',
@@ -199,28 +236,36 @@ with (gr.Blocks(fill_height=True, title='Pixie FAQ Tool', css=custom_css) as llm
 
     # event handlers
     tb_user.submit(append_user,
-                   [tb_user, cb_live, messages],
-                   [tb_user, cb_live, messages],
+                   [tb_user, cb_live],
+                   [tb_user, cb_live],
                    concurrency_limit=concurrency_limit).then(append_bot,
-                                                             [cb_live, messages, log_file_name],
-                                                             [cb_live, messages])
+                                                             [cb_live, conversation_log, token_tally],
+                                                             [cb_live],
+                                                             concurrency_limit=bot_concurrency_limit)
 
     btn_send.click(append_user,
-                   [tb_user, cb_live, messages],
-                   [tb_user, cb_live, messages],
+                   [tb_user, cb_live],
+                   [tb_user, cb_live],
                    concurrency_limit=concurrency_limit).then(append_bot,
-                                                             [cb_live, messages, log_file_name],
-                                                             [cb_live, messages])
+                                                             [cb_live, conversation_log, token_tally],
+                                                             [cb_live],
+                                                             concurrency_limit=bot_concurrency_limit)
 
     btn_clear.click(on_clear_clicked, None,
-                    [cb_live, log_file_name, messages],
+                    [cb_live, conversation_log],
                     concurrency_limit=concurrency_limit)
     cb_live.clear(on_clear_clicked, None,
-                  [cb_live, log_file_name, messages],
+                  [cb_live, conversation_log],
                   concurrency_limit=concurrency_limit)
     llm_client_ui.load(on_load_ui, None,
-                       [log_file_name])
+                       [conversation_log])
+    llm_client_ui.load(on_load_token_tally, None, [token_tally])
+    llm_client_ui.unload(on_unload)
+
+# logs that didn't change for LOG_ARCHIVE_DAYS are packed into compressed per-day archives
+start_log_rotation('./logs', float(os.getenv('LOG_ARCHIVE_DAYS', 30)))
 
 llm_client_ui.launch(auth=None,
                      server_name='0.0.0.0',
-                     server_port=10000)
+                     server_port=10000,
+                     app_kwargs=metrics_app_kwargs())  # Prometheus metrics on /metrics
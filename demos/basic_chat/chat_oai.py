@@ -1,16 +1,20 @@
-import json
 import os
+import sys
 
 import gradio as gr
-import tiktoken
 from dotenv import load_dotenv
 from openai import AzureOpenAI
 
+sys.path.append('../../')
+
+from demos.components.stream_aggregator import StreamAggregator
+from demos.components.usage_ledger import UsageLedger
+
 load_dotenv()
 
 client = AzureOpenAI(
     api_key=os.getenv('AOA_API_KEY'),
-    api_version='2024-02-15-preview',
+    api_version='2024-10-21',  # stream_options needs at least this version
     azure_endpoint=os.getenv('AOA_ENDPOINT'),
 )
 
@@ -21,12 +25,14 @@ system_instruction = {
                'Always think step by step. '
 }
 
+model_name = 'gpt-4o-mini'
+prompt_price = 0.15 / 1000000  # in dollar per token
+completion_price = 0.6 / 1000000
+usage_ledger = UsageLedger()
+
 
-def chat_completion(message, history):
-    # token estimation
-    tokeniser = tiktoken.encoding_for_model('gpt-4')
-    msg_len = len(tokeniser.encode(message))
-    print(f'Message: {message} ({msg_len} tokens)')
+def chat_completion(message, history, request: gr.Request):
+    print(f'Message: {message}')
 
     if system_instruction not in history:
         # prepend system instructions
@@ -43,25 +49,22 @@ def chat_completion(message, history):
             else:
                 del event[key]
 
-    # token estimation
-    hist_string = json.dumps(history)
-    hist_len = len(tokeniser.encode(hist_string))
-    print(f'History: {hist_len} tokens')
-
-    # cost estimation
-    cost_in_cents = round(hist_len / 1000 * 3)
-    if cost_in_cents > 0:
-        print(f'Cost estimate: {cost_in_cents} cents')
-
-    response_stream = client.chat.completions.create(model='gpt-4o-mini',
+    response_stream = client.chat.completions.create(model=model_name,
                                                      messages=history,
                                                      temperature=1.0,
+                                                     stream_options={'include_usage': True},
                                                      stream=True)
-    partial_message = ''
+    aggregator = StreamAggregator()
     for chunk in response_stream:
+        if chunk.usage is not None:  # the last chunk, with the exact token counts
+            cost = chunk.usage.prompt_tokens * prompt_price + chunk.usage.completion_tokens * completion_price
+            print(f'History: {chunk.usage.prompt_tokens} tokens, cost: {round(cost * 100, 3)} cents')
+            usage_ledger.record(chunk.usage, model=f'azure/{model_name}', session=request.session_hash, cost=cost)
         if len(chunk.choices) > 0 and chunk.choices[0].delta.content is not None:
-            partial_message = partial_message + chunk.choices[0].delta.content
-            yield partial_message
+            if aggregator.add(chunk.choices[0].delta.content):
+                yield aggregator.flush()
+    if aggregator.has_pending():  # always show the final text
+        yield aggregator.flush()
 
 
 # https://www.gradio.app/guides/creating-a-chatbot-fast
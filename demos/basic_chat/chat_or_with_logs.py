@@ -1,11 +1,16 @@
-import datetime
-import json
 import os
+import sys
 
 import gradio as gr
 from dotenv import load_dotenv
 from openai import OpenAI
 
+sys.path.append('../../')
+
+from demos.components.log_writer import log_new_messages, start_conversation_log
+from demos.components.stream_aggregator import StreamAggregator
+from demos.components.usage_ledger import UsageLedger
+
 load_dotenv()
 
 client = OpenAI(
@@ -20,36 +25,20 @@ system_instruction = {
                'Always think step by step. '
 }
 
-log_filename = None
-previous_history = ''
-
-
-def get_new_filename(log_folder):
-    time_stamp = f'{datetime.datetime.now():%y%m%d_%H%M_%S}'
-    return f'{log_folder}{time_stamp}.json'
-
-
-def store_history(history, log_folder):
-    if not os.path.exists(log_folder):
-        os.makedirs(log_folder)
-
-    global log_filename
-    global previous_history
-
-    current_history = json.dumps(history, indent=1)
-
-    if log_filename is None or not current_history.startswith(previous_history[:-2]):
-        # this is a new thread -> start a new log
-        log_filename = get_new_filename(log_folder)
+log_folder = 'logs/'
+usage_ledger = UsageLedger()
+model_name = 'google/gemini-2.0-flash-001'
 
-    log_file = open(log_filename, 'wt')
-    log_file.write(current_history)
-    log_file.close()
 
-    previous_history = current_history
+def store_history(history, conversation_log):
+    # only the messages that are new since the previous turn are appended, by a background writer
+    if conversation_log is None or len(history) <= 3:  # system instruction, prompt and answer: a new conversation
+        conversation_log = start_conversation_log(log_folder)
+    log_new_messages(conversation_log, history)
+    return conversation_log
 
 
-def chat_completion(message, history):
+def chat_completion(message, history, conversation_log, request: gr.Request):
     if system_instruction not in history:
         # prepend system instructions
         history.insert(0, system_instruction)
@@ -66,26 +55,36 @@ def chat_completion(message, history):
                 del event[key]
 
     # call the language model
-    response_stream = client.chat.completions.create(model='google/gemini-2.0-flash-001',
+    response_stream = client.chat.completions.create(model=model_name,
                                                      messages=history,
                                                      extra_headers={
                                                          'HTTP-Referer': 'https://pxl-research.be/',
                                                          'X-Title': 'PXL Smart ICT'
                                                      },
+                                                     stream_options={'include_usage': True},
+                                                     extra_body={'usage': {'include': True}},
                                                      stream=True)
-    partial_message = ''
+    aggregator = StreamAggregator()
     for chunk in response_stream:  # stream the response
+        if chunk.usage is not None:  # the last chunk, when the response is complete
+            usage_ledger.record(chunk.usage, model=model_name, session=request.session_hash)
         if len(chunk.choices) > 0 and chunk.choices[0].delta.content is not None:
-            partial_message = partial_message + chunk.choices[0].delta.content
-            yield partial_message
+            if aggregator.add(chunk.choices[0].delta.content):
+                yield aggregator.flush(), conversation_log
 
     # store in a log file
-    history.append({'role': 'assistant', 'content': partial_message})
-    store_history(history, 'logs/')
+    history.append({'role': 'assistant', 'content': aggregator.flush()})
+    conversation_log = store_history(history, conversation_log)
+    yield aggregator.flush(), conversation_log  # always show the final text
 
 
 # https://www.gradio.app/guides/creating-a-chatbot-fast
-(gr.ChatInterface(chat_completion,
-                  type='messages',
-                  flagging_mode='manual')
- .launch(server_name='0.0.0.0', server_port=7020))
+with gr.Blocks() as chat_ui:
+    st_conversation_log = gr.State()  # the log file of the conversation of this session
+    gr.ChatInterface(chat_completion,
+                     type='messages',
+                     flagging_mode='manual',
+                     additional_inputs=[st_conversation_log],
+                     additional_outputs=[st_conversation_log])
+
+chat_ui.launch(server_name='0.0.0.0', server_port=7020)
@@ -0,0 +1,328 @@
+import json
+import time
+
+from demos.components.metrics import track_tool_call, count_tool_error
+from demos.components.open_router_client import get_usage_summary
+from demos.components.stream_aggregator import StreamAggregator, DEFAULT_FLUSH_INTERVAL, DEFAULT_FLUSH_EVERY
+from demos.components.token_counter import TokenTally
+from demos.components.tracing import get_tracer, current_span
+
+# appended to the request (not to the message list) when a budget runs out
+FINAL_ANSWER_INSTRUCTION = {
+    'role': 'system',
+    'content': 'You have run out of time or budget for using tools. '
+               'Do not call any more tools, answer now using the information you already have. '
+               'Mention it briefly if your answer may be incomplete because of this. '
+}
+
+STOP_COMPLETED = 'completed'
+STOP_DEADLINE = 'deadline'
+STOP_MAX_ROUNDS = 'max_tool_rounds'
+STOP_TOKEN_BUDGET = 'prompt_token_budget'
+
+
+class RoundStats:
+    round_nr: int
+    forced_final: bool
+    time_to_first_token: float
+    llm_time: float
+    tool_time: float
+    prompt_tokens: int
+    cached_prompt_tokens: int
+    completion_tokens: int
+    cost: float
+    tool_names: list
+
+    def __init__(self, round_nr: int, forced_final: bool = False):
+        self.round_nr = round_nr
+        self.forced_final = forced_final
+        self.time_to_first_token = None
+        self.llm_time = 0
+        self.tool_time = 0
+        self.prompt_tokens = 0
+        self.cached_prompt_tokens = 0
+        self.completion_tokens = 0
+        self.cost = 0
+        self.tool_names = []
+
+    def to_dict(self):
+        return dict(vars(self))
+
+
+class AgentLoop:
+    or_client: object
+    tool_namespace: dict
+    tool_cache: object
+    compactor: object
+    usage_ledger: object
+    deadline_seconds: float
+    max_tool_rounds: int
+    max_prompt_tokens: int
+    flush_interval: float
+    flush_every: int
+
+    def __init__(self,
+                 or_client,
+                 tool_namespace: dict,
+                 tool_cache=None,
+                 compactor=None,
+                 usage_ledger=None,
+                 deadline_seconds: float = 120,
+                 max_tool_rounds: int = 5,
+                 max_prompt_tokens: int = 200000,
+                 flush_interval: float = DEFAULT_FLUSH_INTERVAL,
+                 flush_every: int = DEFAULT_FLUSH_EVERY):
+        self.or_client = or_client
+        self.tool_namespace = tool_namespace  # usually globals() of the app, where the tools are imported
+        self.tool_cache = tool_cache
+        self.compactor = compactor  # keeps long conversations within a token budget
+        self.usage_ledger = usage_ledger  # records the usage (and cost) of every request
+        self.deadline_seconds = deadline_seconds
+        self.max_tool_rounds = max_tool_rounds
+        self.max_prompt_tokens = max_prompt_tokens
+        self.flush_interval = flush_interval  # partial messages are yielded at most this often (or every N deltas)
+        self.flush_every = flush_every
+
+    def start(self, message_list: list, user: str = None, session: str = None, token_tally: TokenTally = None):
+        """Pass the token_tally of the conversation (e.g. from a gr.State) to keep its count over the turns."""
+        return AgentRun(self, message_list, user=user, session=session, token_tally=token_tally)
+
+    def prepare_messages(self, message_list: list, token_tally: TokenTally = None):
+        if self.compactor is None:
+            return message_list
+        return self.compactor.compact(message_list, token_tally)
+
+    def call_tool(self, fn_name: str, fn_args: dict):
+        fn_pointer = self.tool_namespace.get(fn_name)
+        if fn_pointer is None:
+            print(f'Unknown tool: {fn_name}')
+            count_tool_error(fn_name)
+            return {'error': f'Unknown tool "{fn_name}"'}
+
+        try:
+            with track_tool_call(fn_name):
+                if self.tool_cache is not None:
+                    return self.tool_cache.call(fn_name, fn_pointer, fn_args)
+                return fn_pointer(**fn_args)
+        except Exception as e:
+            print(f'Problem calling {fn_name}: {type(e).__name__} - {str(e)}')
+            return {'error': f'{type(e).__name__}: {str(e)}'}
+
+
+class AgentRun:
+    """A single user turn: LLM rounds and tool rounds until there is an answer or a budget runs out."""
+
+    def __init__(self, agent_loop: AgentLoop, message_list: list, user: str = None, session: str = None,
+                 token_tally: TokenTally = None):
+        self.agent_loop = agent_loop
+        self.message_list = message_list
+        # the rounds only add messages: every round only counts the new ones, for the compactor ...
+        self.context_tally = token_tally if token_tally is not None else TokenTally()
+        self.token_tally = TokenTally()  # ... and for the estimate of the (possibly compacted) request
+        self.user = user
+        self.session = session
+        self.rounds = []
+        self.stop_reason = None
+        self.started_at = None
+        self.deadline = None
+
+    def run(self):
+        """Generator yielding (round_nr, partial_message) while the answer streams in."""
+        self.started_at = time.monotonic()
+        self.deadline = self.started_at + self.agent_loop.deadline_seconds
+        tracer = get_tracer()
+
+        with tracer.start_span('chat_turn', attributes={'user': self.user,
+                                                        'session': self.session,
+                                                        'messages': len(self.message_list)}) as turn_span:
+            force_final = False
+            while True:
+                stats = RoundStats(len(self.rounds), forced_final=force_final)
+                self.rounds.append(stats)
+
+                with tracer.start_span('llm_round', parent=turn_span,
+                                       attributes={'model': self.agent_loop.or_client.model_name,
+                                                   'round': stats.round_nr,
+                                                   'forced_final': force_final}) as round_span:
+                    tool_calls = yield from self.complete_round(stats)
+                    if len(tool_calls) > 0 and not force_final:
+                        self.run_tools(tool_calls, stats, round_span)
+                    round_span.set_attributes(stats.to_dict())
+
+                if len(tool_calls) == 0 or force_final:
+                    break
+
+                # decide whether we can afford another round with tools
+                self.stop_reason = self.check_budgets()
+                force_final = self.stop_reason is not None
+
+            if self.stop_reason is None:
+                self.stop_reason = STOP_COMPLETED
+            turn_span.set_attributes({'rounds': len(self.rounds),
+                                      'stop_reason': self.stop_reason,
+                                      'prompt_tokens': self.get_prompt_tokens(),
+                                      'cached_prompt_tokens': self.get_cached_prompt_tokens(),
+                                      'completion_tokens': self.get_completion_tokens(),
+                                      'cost': self.get_cost()})
+
+    def complete_round(self, stats: RoundStats):
+        request_messages = self.agent_loop.prepare_messages(self.message_list, self.context_tally)
+        tool_choice = None
+        if stats.forced_final:
+            request_messages = request_messages + [FINAL_ANSWER_INSTRUCTION]
+            tool_choice = 'none'
+
+        round_start = time.monotonic()
+        response_stream = self.agent_loop.or_client.create_completions_stream(message_list=request_messages,
+                                                                             tool_choice=tool_choice)
+        aggregator = StreamAggregator(self.agent_loop.flush_interval, self.agent_loop.flush_every)
+        tool_calls = []
+        usage = None
+
+        for chunk in response_stream:  # stream the response
+            if getattr(chunk, 'usage', None) is not None:
+                usage = chunk.usage
+
+            if len(chunk.choices) > 0:
+                delta = chunk.choices[0].delta
+                if stats.time_to_first_token is None and (delta.content or delta.tool_calls):
+                    stats.time_to_first_token = time.monotonic() - round_start
+
+                # LLM text responses
+                if delta.content is not None and aggregator.add(delta.content):
+                    yield stats.round_nr, aggregator.flush()
+
+                # LLM tool call requests
+                if delta.tool_calls is not None:
+                    merge_tool_call_chunks(tool_calls, delta.tool_calls)
+
+        response_stream.close()
+        if aggregator.has_pending():
+            yield stats.round_nr, aggregator.flush()  # always show the final text
+        partial_message = aggregator.flush()
+        stats.llm_time = time.monotonic() - round_start
+
+        usage_summary = get_usage_summary(usage)
+        if usage_summary is not None:
+            stats.prompt_tokens = usage_summary['prompt_tokens']
+            stats.cached_prompt_tokens = usage_summary['cached_prompt_tokens']
+            stats.completion_tokens = usage_summary['completion_tokens']
+            stats.cost = usage_summary['cost']
+            if self.agent_loop.usage_ledger is not None:
+                self.agent_loop.usage_ledger.record(usage,
+                                                    model=self.agent_loop.or_client.model_name,
+                                                    user=self.user,
+                                                    session=self.session)
+        else:
+            stats.prompt_tokens = self.token_tally.update(request_messages)  # estimate
+
+        # handle text responses
+        if partial_message:
+            self.message_list.append({'role': 'assistant', 'content': partial_message})
+
+        return tool_calls
+
+    def run_tools(self, tool_calls: list, stats: RoundStats, round_span=None):
+        print(f'Processing {len(tool_calls)} tool calls')
+        tools_start = time.monotonic()
+        tracer = get_tracer()
+        for call in tool_calls:
+            if time.monotonic() > self.deadline:
+                print(f'\t- {call.function.name} (skipped, deadline passed)')
+                continue
+
+            print(f'\t- {call.function.name}')
+            stats.tool_names.append(call.function.name)
+            tool_call_obj = {
+                'role': 'assistant',
+                'content': None,
+                'tool_calls': [
+                    {
+                        'id': call.id,
+                        'type': 'function',
+                        'function': {
+                            'name': call.function.name,
+                            'arguments': call.function.arguments
+                        }
+                    }
+                ]
+            }
+            self.message_list.append(tool_call_obj)
+
+            try:
+                fn_args = json.loads(call.function.arguments or '{}')
+            except ValueError as e:
+                # malformed or truncated arguments: the tool call still needs a reply, or the API rejects the list
+                print(f'Invalid arguments for {call.function.name}: {e}')
+                count_tool_error(call.function.name)
+                self.message_list.append({'role': 'tool',
+                                          'name': call.function.name,
+                                          'tool_call_id': call.id,
+                                          'content': json.dumps({'error': f'Invalid arguments: {e}'})})
+                continue
+            with tracer.start_span('tool_call', parent=round_span,
+                                   attributes={'tool': call.function.name}) as tool_span:
+                span_token = current_span.set(tool_span)  # parent for spans inside the tool, e.g. query_store
+                try:
+                    fn_result = self.agent_loop.call_tool(call.function.name, fn_args)
+                finally:
+                    current_span.reset(span_token)
+                if isinstance(fn_result, dict) and 'error' in fn_result:
+                    tool_span.set_attribute('error.message', str(fn_result['error']))
+            tool_resp = {'role': 'tool',
+                         'name': call.function.name,
+                         'tool_call_id': call.id,
+                         'content': json.dumps(fn_result)}
+            self.message_list.append(tool_resp)
+        stats.tool_time = time.monotonic() - tools_start
+
+    def check_budgets(self):
+        tool_rounds = len([r for r in self.rounds if len(r.tool_names) > 0])
+        if time.monotonic() > self.deadline:
+            return STOP_DEADLINE
+        if tool_rounds >= self.agent_loop.max_tool_rounds:
+            return STOP_MAX_ROUNDS
+        if self.get_prompt_tokens() >= self.agent_loop.max_prompt_tokens:
+            return STOP_TOKEN_BUDGET
+        return None
+
+    def get_prompt_tokens(self):
+        return sum(r.prompt_tokens for r in self.rounds)
+
+    def get_cached_prompt_tokens(self):
+        return sum(r.cached_prompt_tokens for r in self.rounds)
+
+    def get_completion_tokens(self):
+        return sum(r.completion_tokens for r in self.rounds)
+
+    def get_cost(self):
+        return sum(r.cost for r in self.rounds)
+
+    def get_elapsed_time(self):
+        if self.started_at is None:
+            return 0
+        return time.monotonic() - self.started_at
+
+    def get_summary(self):
+        lines = [f'Agent run: {len(self.rounds)} rounds in {self.get_elapsed_time():.2f}s, '
+                 f'{self.get_prompt_tokens()} prompt tokens ({self.get_cached_prompt_tokens()} cached), '
+                 f'cost ${self.get_cost():.5f}, '
+                 f'stopped because: {self.stop_reason}']
+        for r in self.rounds:
+            ttft = f'{r.time_to_first_token:.2f}s' if r.time_to_first_token is not None else '-'
+            lines.append(f'\t#{r.round_nr}: ttft {ttft}, llm {r.llm_time:.2f}s, tools {r.tool_time:.2f}s '
+                         f'{r.tool_names}{" (forced final answer)" if r.forced_final else ""}')
+        return '\n'.join(lines)
+
+
+# helper method: tool calls arrive in pieces when streaming
+def merge_tool_call_chunks(tool_calls: list, tool_call_chunks):
+    for tool_call_chunk in tool_call_chunks:
+        if tool_call_chunk.index >= len(tool_calls):
+            tool_calls.insert(tool_call_chunk.index, tool_call_chunk)
+        else:
+            if tool_call_chunk.function is not None:
+                if tool_calls[tool_call_chunk.index].function is None:
+                    tool_calls[tool_call_chunk.index].function = tool_call_chunk.function
+                else:
+                    tool_calls[tool_call_chunk.index].function.arguments += tool_call_chunk.function.arguments
@@ -0,0 +1,180 @@
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+
+from demos.components.token_counter import TokenCounter, TokenTally, shared_token_counter
+
+SUMMARY_INSTRUCTION = {
+    'role': 'system',
+    'content': 'You summarize conversations between a user and an assistant. '
+               'Keep the questions of the user, the essential facts and conclusions of the answers, '
+               'and the sources (document names, pages, urls) that were used. '
+               'Write a compact bulleted list, in the language of the conversation. '
+}
+
+SUMMARY_PREFIX = 'Summary of the earlier part of this conversation:\n'
+
+
+class ConversationCompactor:
+    max_tokens: int
+    keep_last_turns: int
+    summarizer: object
+    token_counter: TokenCounter
+
+    def __init__(self,
+                 max_tokens: int = 16000,
+                 keep_last_turns: int = 4,
+                 summarizer=None,
+                 token_counter: TokenCounter = None,
+                 max_cached_summaries: int = 512):
+        self.max_tokens = max_tokens
+        self.keep_last_turns = keep_last_turns
+        self.summarizer = summarizer  # callable(previous_summary, messages) -> str, None to only drop tool outputs
+        self.token_counter = token_counter if token_counter is not None else shared_token_counter
+        self.max_cached_summaries = max_cached_summaries
+
+        self.summaries = OrderedDict()  # hash of the folded messages -> summary text
+        self.lock = threading.Lock()
+
+    def compact(self, message_list: list, token_tally: TokenTally = None):
+        """
+        Return the messages to send: the full list if it fits, a compacted copy otherwise. Pass the token_tally
+        of the conversation (kept over its rounds) to only count the messages added since the previous call.
+        """
+        if token_tally is None:
+            token_tally = TokenTally(self.token_counter)
+        total_tokens = token_tally.update(message_list)
+        if total_tokens <= self.max_tokens:
+            return message_list
+
+        system_part, turns = split_in_turns(message_list)
+        if len(turns) <= self.keep_last_turns:
+            return message_list  # nothing old enough to compact
+
+        old_turns = turns[:-self.keep_last_turns]
+        recent_turns = turns[-self.keep_last_turns:]
+        recent_messages = [m for turn in recent_turns for m in turn]
+
+        # step 1: replace the (often large) tool outputs of older turns by short stubs,
+        # only the stubs are counted, the counts of the other messages are known
+        old_messages = []
+        compacted_tokens = total_tokens
+        for index, message in enumerate((m for turn in old_turns for m in turn), start=len(system_part)):
+            stubbed_message = stub_tool_output(message)
+            if stubbed_message is not message:
+                compacted_tokens += (self.token_counter.count_message(stubbed_message)
+                                     - token_tally.message_counts[index])
+            old_messages.append(stubbed_message)
+        compacted = system_part + old_messages + recent_messages
+        if compacted_tokens <= self.max_tokens or self.summarizer is None:
+            return compacted
+
+        # step 2: fold the older turns into a (cached) summary,
+        # in blocks of keep_last_turns so we don't need a new summary for every turn
+        fold_count = (len(old_turns) // self.keep_last_turns) * self.keep_last_turns
+        if fold_count == 0:
+            return compacted
+
+        summary = self.get_summary(old_turns[:fold_count])
+        if summary is None:
+            return compacted  # no summary this turn, the stubbed conversation is sent instead
+        summary_message = {'role': 'system', 'content': f'{SUMMARY_PREFIX}{summary}'}
+        unfolded_messages = [stub_tool_output(m) for turn in old_turns[fold_count:] for m in turn]
+        return system_part + [summary_message] + unfolded_messages + recent_messages
+
+    def get_summary(self, old_turns: list):
+        # hash chain over the turns, so summaries of shorter prefixes can be reused and extended
+        turn_hashes = []
+        running_hash = ''
+        for turn in old_turns:
+            running_hash = hash_messages(turn, running_hash)
+            turn_hashes.append(running_hash)
+
+        with self.lock:
+            if turn_hashes[-1] in self.summaries:
+                self.summaries.move_to_end(turn_hashes[-1])
+                return self.summaries[turn_hashes[-1]]
+
+            previous_summary = None
+            first_new_turn = 0
+            for t in range(len(turn_hashes) - 2, -1, -1):
+                if turn_hashes[t] in self.summaries:
+                    previous_summary = self.summaries[turn_hashes[t]]
+                    first_new_turn = t + 1
+                    break
+
+        new_messages = [m for turn in old_turns[first_new_turn:] for m in turn]
+        print(f'Summarizing {len(new_messages)} older messages')
+        try:
+            summary = self.summarizer(previous_summary, new_messages)
+        except Exception as e:  # e.g. a timeout or rate limit, the user's turn shouldn't fail on it
+            print(f'Could not summarize the conversation: {type(e).__name__} - {str(e)}')
+            return None
+
+        with self.lock:
+            self.summaries[turn_hashes[-1]] = summary
+            while len(self.summaries) > self.max_cached_summaries:
+                self.summaries.popitem(last=False)
+        return summary
+
+
+def make_llm_summarizer(or_client, model_name: str = None, max_tool_chars: int = 500):
+    def summarize(previous_summary, messages):
+        transcript = messages_to_transcript(messages, max_tool_chars)
+        if previous_summary:
+            transcript = f'{SUMMARY_PREFIX}{previous_summary}\n\nContinuation of the conversation:\n{transcript}'
+
+        response = or_client.chat.completions.create(model=model_name or or_client.model_name,
+                                                     messages=[SUMMARY_INSTRUCTION,
+                                                               {'role': 'user', 'content': transcript}],
+                                                     temperature=0,
+                                                     extra_headers=or_client.extra_headers)
+        return response.choices[0].message.content
+
+    return summarize
+
+
+# helper method: leading system messages, then one list of messages per turn (starting with a user message)
+def split_in_turns(message_list: list):
+    system_part = []
+    turns = []
+    for message in message_list:
+        if message.get('role') == 'user':
+            turns.append([message])
+        elif len(turns) == 0:
+            system_part.append(message)
+        else:
+            turns[-1].append(message)
+    return system_part, turns
+
+
+def stub_tool_output(message: dict):
+    if message.get('role') != 'tool' or message.get('content') is None:
+        return message
+    stub = (f'[Output of {message.get("name", "tool")} omitted to save space ({len(message["content"])} characters). '
+            f'Call the tool again if you need these details.]')
+    stubbed = dict(message)
+    stubbed['content'] = json.dumps(stub)
+    return stubbed
+
+
+def messages_to_transcript(messages: list, max_tool_chars: int = 500):
+    lines = []
+    for message in messages:
+        role = message.get('role')
+        if message.get('tool_calls'):
+            for call in message['tool_calls']:
+                lines.append(f'assistant called {call["function"]["name"]}({call["function"]["arguments"]})')
+        elif role == 'tool':
+            lines.append(f'{message.get("name", "tool")} returned: {(message.get("content") or "")[:max_tool_chars]}')
+        elif message.get('content'):
+            lines.append(f'{role}: {message["content"]}')
+    return '\n'.join(lines)
+
+
+def hash_messages(messages: list, previous_hash: str = ''):
+    hasher = hashlib.sha256(previous_hash.encode('utf-8'))
+    for message in messages:
+        hasher.update(json.dumps(message, sort_keys=True).encode('utf-8'))
+    return hasher.hexdigest()
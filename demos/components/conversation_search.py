@@ -0,0 +1,290 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from demos.components.log_archive import list_archived_logs, read_log_bytes, split_archived_path, stat_log
+
+DEFAULT_INDEX_FILE = './logs/.search_index.sqlite'
+SEARCHABLE_ROLES = ('user', 'assistant')
+LOG_EXTENSIONS = ('.json', '.jsonl', '.log')
+
+
+class ConversationSearch:
+    """
+    Full-text index (SQLite FTS5) over the user and assistant messages of conversation logs, ranked with bm25.
+    Understands the logs of the Assistants apps (thread messages) and of the chat completions apps (message lists),
+    as a JSON document or as JSON lines. JSON lines logs are indexed incrementally: only the lines appended
+    since the previous update are read. Archived logs (see log_archive.py) are searched as well.
+    """
+    index_file: str
+
+    def __init__(self, index_file: str = DEFAULT_INDEX_FILE):
+        self.index_file = index_file
+        self.lock = threading.Lock()
+        self.db = open_index_db(index_file)
+        self.last_scans = {}  # folder -> time of the last scan
+
+    def update_log(self, log_path: str, owner: str = None, source: str = None):
+        """Index the messages added to a log since the previous update. Returns the number of new messages."""
+        log_path = os.path.normpath(os.path.abspath(log_path))
+        log_stat = stat_log(log_path)
+        if log_stat is None:
+            self.remove_log(log_path)
+            return 0
+        size, mtime = log_stat
+
+        with self.lock:
+            row = self.db.execute('SELECT size, mtime, indexed_bytes, message_count, title FROM indexed_logs '
+                                  'WHERE log_path = ?', (log_path,)).fetchone()
+        if row is not None and (row[0], row[1]) == (size, mtime):
+            return 0
+
+        appended = (row is not None and log_path.endswith('.jsonl') and size >= row[2]
+                    and split_archived_path(log_path) is None)
+        start_offset, position, title = (row[2], row[3], row[4]) if appended else (0, 0, None)
+        try:
+            records, indexed_bytes = read_records(log_path, start_offset)
+        except (OSError, ValueError) as e:
+            print(f'Could not index {log_path}: {e}')
+            return 0
+
+        rows = []
+        for record in records:
+            role, text, created_at = get_message_text(record)
+            if text is None:
+                continue
+            if title is None and role == 'user':
+                title = text[:100]
+            rows.append((text, role, log_path, owner, position, created_at or mtime))
+            position += 1
+
+        with self.lock:
+            if not appended:
+                self.db.execute('DELETE FROM message_index WHERE log_path = ?', (log_path,))
+            self.db.executemany('INSERT INTO message_index (text, role, log_path, owner, position, created_at) '
+                                'VALUES (?, ?, ?, ?, ?, ?)', rows)
+            self.db.execute('INSERT OR REPLACE INTO indexed_logs '
+                            '(log_path, owner, source, title, size, mtime, indexed_bytes, message_count) '
+                            'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                            (log_path, owner, source, title or os.path.basename(log_path),
+                             size, mtime, indexed_bytes, position))
+            self.db.commit()
+        return len(rows)
+
+    def update_folder(self, log_folder: str, owner: str = None, source: str = None, min_interval: float = 0):
+        """Index the new and changed logs of a folder (not its subfolders), and forget the removed ones."""
+        log_folder = os.path.normpath(os.path.abspath(log_folder))
+        now = time.monotonic()
+        if now - self.last_scans.get(log_folder, -min_interval) < min_interval:
+            return 0
+        self.last_scans[log_folder] = now
+
+        current_paths = set()
+        new_messages = 0
+        for archived_log in list_archived_logs(log_folder):
+            if archived_log['file_name'].endswith(LOG_EXTENSIONS):
+                current_paths.add(archived_log['path'])
+                new_messages += self.update_archived_log(archived_log, log_folder, owner, source)
+        try:
+            with os.scandir(log_folder) as entries:
+                for entry in entries:
+                    if entry.is_file() and entry.name.endswith(LOG_EXTENSIONS):
+                        current_paths.add(entry.path)
+                        new_messages += self.update_log(entry.path, owner, source)
+        except OSError as e:
+            print(f'Could not scan {log_folder}: {e}')
+            return new_messages
+
+        with self.lock:
+            indexed_paths = [log_path for (log_path,) in
+                             self.db.execute('SELECT log_path FROM indexed_logs WHERE log_path LIKE ?',
+                                             (os.path.join(log_folder, '%'),))]
+        for log_path in indexed_paths:
+            archived = split_archived_path(log_path)
+            if archived is not None:
+                folder = os.path.dirname(os.path.dirname(archived[0]))  # <folder>/archive/<day>.gz#<file name>
+            else:
+                folder = os.path.dirname(log_path)
+            if folder == log_folder and log_path not in current_paths:
+                self.remove_log(log_path)
+        return new_messages
+
+    def update_archived_log(self, archived_log: dict, log_folder: str, owner: str = None, source: str = None):
+        # a log that was indexed before it was archived only moves, nothing needs to be decompressed
+        original_path = os.path.join(log_folder, archived_log['file_name'])
+        with self.lock:
+            row = self.db.execute('SELECT size, mtime FROM indexed_logs WHERE log_path = ?',
+                                  (original_path,)).fetchone()
+            if row is not None and row == (archived_log['size'], archived_log['mtime']):
+                self.db.execute('DELETE FROM indexed_logs WHERE log_path = ?', (archived_log['path'],))
+                self.db.execute('DELETE FROM message_index WHERE log_path = ?', (archived_log['path'],))
+                self.db.execute('UPDATE indexed_logs SET log_path = ? WHERE log_path = ?',
+                                (archived_log['path'], original_path))
+                self.db.execute('UPDATE message_index SET log_path = ? WHERE log_path = ?',
+                                (archived_log['path'], original_path))
+                self.db.commit()
+                return 0
+        return self.update_log(archived_log['path'], owner, source)
+
+    def remove_log(self, log_path: str):
+        log_path = os.path.normpath(os.path.abspath(log_path))
+        with self.lock:
+            self.db.execute('DELETE FROM message_index WHERE log_path = ?', (log_path,))
+            self.db.execute('DELETE FROM indexed_logs WHERE log_path = ?', (log_path,))
+            self.db.commit()
+
+    def search(self, query: str, owners: list = None, page: int = 0, page_size: int = 10):
+        """
+        The conversations that match the query, best match first, one page at a time.
+        Returns (results, total), every result has the log path, title, source, time, role and a snippet of
+        the best matching message. owners limits the search to the logs of those owners.
+        """
+        match_query = to_match_query(query)
+        if match_query is None:
+            return [], 0
+
+        owner_filter = ''
+        parameters = [match_query]
+        if owners is not None:
+            owner_filter = f'AND owner IN ({", ".join("?" * len(owners))})'
+            parameters += list(owners)
+
+        # bm25 per message, a conversation ranks with its best matching message
+        # (materialized: the ranking functions can't be used once SQLite flattens the query into the GROUP BY)
+        matches = ('WITH matches AS MATERIALIZED ('
+                   'SELECT log_path, role, created_at, bm25(message_index) AS rank, '
+                   "snippet(message_index, 0, '**', '**', ' ... ', 16) AS snippet "
+                   f'FROM message_index WHERE message_index MATCH ? {owner_filter}) ')
+        with self.lock:
+            try:
+                (total,) = self.db.execute('SELECT COUNT(DISTINCT log_path) FROM message_index '
+                                           f'WHERE message_index MATCH ? {owner_filter}', parameters).fetchone()
+                rows = self.db.execute(f'{matches}'
+                                       'SELECT matches.log_path, indexed_logs.title, indexed_logs.source, '
+                                       'matches.created_at, matches.role, matches.snippet, MIN(matches.rank) '
+                                       'FROM matches JOIN indexed_logs ON indexed_logs.log_path = matches.log_path '
+                                       'GROUP BY matches.log_path ORDER BY MIN(matches.rank) LIMIT ? OFFSET ?',
+                                       parameters + [page_size, page * page_size]).fetchall()
+            except sqlite3.OperationalError as e:
+                print(f'Search for "{query}" failed: {e}')
+                return [], 0
+
+        results = [{'log_path': log_path, 'title': title, 'source': source, 'created_at': created_at,
+                    'role': role, 'snippet': snippet, 'rank': rank}
+                   for log_path, title, source, created_at, role, snippet, rank in rows]
+        return results, total
+
+
+def to_match_query(query: str):
+    # every word as a quoted phrase: all words must occur, and user input can't break the FTS5 query syntax
+    words = query.split() if query else []
+    if len(words) == 0:
+        return None
+    phrases = []
+    for word in words:
+        prefix = word.endswith('*') and len(word.rstrip('*')) > 0  # e.g. intern* for internship, internal, ...
+        phrases.append('"' + word.rstrip('*').replace('"', '""') + '"' + ('*' if prefix else ''))
+    return ' '.join(phrases)
+
+
+def read_records(log_path: str, start_offset: int = 0):
+    """The records of a log from start_offset on, and the offset up to where it was read completely."""
+    if split_archived_path(log_path) is not None:
+        log_content = read_log_bytes(log_path)  # only the member of this log is decompressed
+        if log_path.endswith('.jsonl'):
+            return [json.loads(line) for line in log_content.splitlines() if line.strip()], len(log_content)
+        return get_records(json.loads(log_content)), len(log_content)
+
+    if log_path.endswith('.jsonl'):
+        records = []
+        with open(log_path, 'rb') as log_file:
+            log_file.seek(start_offset)
+            offset = start_offset
+            for line in log_file:
+                if not line.endswith(b'\n'):
+                    break  # still being written, read again with the next update
+                offset += len(line)
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    continue
+        return records, offset
+
+    with open(log_path, 'rt', encoding='utf-8') as log_file:
+        content = json.load(log_file)
+    return get_records(content), os.path.getsize(log_path)
+
+
+def get_records(content):
+    if isinstance(content, dict):
+        return content.get('data') or []  # a list of thread messages
+    return content
+
+
+def get_message_text(record: dict):
+    """(role, text, created_at) of a logged message, text is None for messages that aren't searchable."""
+    if not isinstance(record, dict):
+        return None, None, None
+    role = record.get('role')
+    if role not in SEARCHABLE_ROLES:
+        return role, None, None
+
+    content = record.get('content')
+    if isinstance(content, list):
+        parts = []
+        for part in content:
+            if isinstance(part, dict) and part.get('type') == 'text':
+                text = part.get('text')
+                parts.append(text.get('value', '') if isinstance(text, dict) else str(text))  # Assistants: a dict
+        content = '\n'.join(parts)
+    if not content:
+        return role, None, None
+    return role, content, record.get('created_at')
+
+
+def read_conversation(log_path: str):
+    """The user and assistant messages of a log, in the format of a Gradio Chatbot."""
+    records, _ = read_records(log_path)
+    chat_history = []
+    for record in records:
+        role, text, _ = get_message_text(record)
+        if text is not None:
+            chat_history.append({'role': role, 'content': text})
+    return chat_history
+
+
+def open_index_db(index_file):
+    index_folder = os.path.dirname(index_file)
+    if index_folder and not os.path.exists(index_folder):
+        os.makedirs(index_folder)
+
+    db = sqlite3.connect(index_file, check_same_thread=False)  # access is guarded by ConversationSearch.lock
+    db.execute('CREATE TABLE IF NOT EXISTS indexed_logs ('
+               'log_path TEXT PRIMARY KEY, '
+               'owner TEXT, '
+               'source TEXT, '
+               'title TEXT, '
+               'size INTEGER NOT NULL, '
+               'mtime REAL NOT NULL, '
+               'indexed_bytes INTEGER NOT NULL, '
+               'message_count INTEGER NOT NULL)')
+    db.execute('CREATE VIRTUAL TABLE IF NOT EXISTS message_index USING fts5('
+               'text, role UNINDEXED, log_path UNINDEXED, owner UNINDEXED, position UNINDEXED, created_at UNINDEXED, '
+               "tokenize = 'unicode61 remove_diacritics 2')")
+    db.commit()
+    return db
+
+
+shared_indexes = {}
+shared_indexes_lock = threading.Lock()
+
+
+def get_conversation_search(index_file: str = DEFAULT_INDEX_FILE):
+    """One shared index per index file and process."""
+    index_file = os.path.normpath(os.path.abspath(index_file))
+    with shared_indexes_lock:
+        if index_file not in shared_indexes:
+            shared_indexes[index_file] = ConversationSearch(index_file)
+        return shared_indexes[index_file]
@@ -0,0 +1,250 @@
+import statistics
+import threading
+import time
+from collections import OrderedDict, deque
+
+from demos.components.metrics import SCHEDULER_ACTIVE, SCHEDULER_QUEUE_DEPTH, SCHEDULER_REJECTED, SCHEDULER_WAIT_TIME
+
+DEFAULT_MAX_CONCURRENT = 10  # LLM calls at the same time, over all users
+DEFAULT_REQUESTS_PER_MINUTE = 10  # per user
+DEFAULT_TOKENS_PER_MINUTE = 100000  # per user, prompt and completion tokens
+DEFAULT_MAX_QUEUED_PER_USER = 3
+IDLE_USER_SECONDS = 120  # users without requests for this long are forgotten (once their buckets are full again)
+WAIT_SAMPLES = 1000  # the most recent wait times, for get_stats
+
+
+class QuotaExceeded(Exception):
+    """The user already has the maximum number of requests waiting."""
+
+
+class TokenBucket:
+    """
+    Refills at rate_per_minute up to capacity (a minute's worth by default). The level can go below zero when
+    a request uses more than it was estimated to use, the user then waits until the debt is refilled.
+    """
+    rate: float
+    capacity: float
+    level: float
+
+    def __init__(self, rate_per_minute: float, capacity: float = None, now: float = None):
+        self.rate = rate_per_minute / 60
+        self.capacity = capacity if capacity is not None else rate_per_minute
+        self.level = self.capacity
+        self.updated_at = now if now is not None else time.monotonic()
+
+    def refill(self, now: float):
+        self.level = min(self.capacity, self.level + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def time_until(self, amount: float, now: float):
+        """Seconds until amount is available, a request larger than the bucket only waits for a full bucket."""
+        self.refill(now)
+        amount = min(amount, self.capacity)
+        if self.level >= amount:
+            return 0.0
+        return (amount - self.level) / self.rate if self.rate > 0 else float('inf')
+
+    def consume(self, amount: float, now: float):
+        self.refill(now)
+        self.level -= amount
+
+    def is_full(self, now: float):
+        self.refill(now)
+        return self.level >= self.capacity
+
+
+class Ticket:
+    """A request of a user, waiting for (or holding) a slot of the scheduler."""
+    user: str
+    estimated_tokens: int
+
+    def __init__(self, user: str, estimated_tokens: int, submitted_at: float = None):
+        self.user = user
+        self.estimated_tokens = estimated_tokens
+        self.submitted_at = submitted_at if submitted_at is not None else time.monotonic()
+        self.granted_at = None
+        self.granted = threading.Event()
+        self.released = False
+
+    def wait(self, timeout: float = None):
+        """True once the request has a slot, False when the timeout passed first."""
+        return self.granted.wait(timeout)
+
+    def get_wait_time(self):
+        return (self.granted_at or time.monotonic()) - self.submitted_at
+
+
+class UserState:
+    def __init__(self, requests_per_minute: float, tokens_per_minute: float, now: float):
+        self.request_bucket = TokenBucket(requests_per_minute, now=now)
+        self.token_bucket = TokenBucket(tokens_per_minute, now=now)
+        self.queue = deque()
+        self.last_active = now
+
+
+class FairScheduler:
+    """
+    Admits at most max_concurrent requests (e.g. LLM calls) at a time. Every user has token buckets for the
+    requests and the tokens per minute, and the waiting requests are served round robin over the users:
+    a user with many questions queued doesn't hold back the others. Users are identified by a string,
+    see request_identity.
+    """
+    name: str
+    max_concurrent: int
+    max_queued_per_user: int
+
+    def __init__(self,
+                 name: str,
+                 max_concurrent: int = DEFAULT_MAX_CONCURRENT,
+                 requests_per_minute: float = DEFAULT_REQUESTS_PER_MINUTE,
+                 tokens_per_minute: float = DEFAULT_TOKENS_PER_MINUTE,
+                 max_queued_per_user: int = DEFAULT_MAX_QUEUED_PER_USER):
+        self.name = name  # the label of the metrics
+        self.max_concurrent = max_concurrent
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.max_queued_per_user = max_queued_per_user
+        self.lock = threading.Lock()
+        self.users = OrderedDict()  # user -> UserState, the next user in the round robin first
+        self.active = 0
+        self.queued = 0
+        self.rejected = 0
+        self.wait_times = deque(maxlen=WAIT_SAMPLES)
+        self.timer = None  # dispatches again when a bucket of a waiting user has refilled
+        self.timer_due = None
+        self.last_prune = time.monotonic()
+
+    def submit(self, user: str, estimated_tokens: int = 0):
+        """Queue a request, wait for its slot with ticket.wait() and always release it afterwards."""
+        now = time.monotonic()
+        with self.lock:
+            state = self.users.get(user)
+            if state is None:
+                state = UserState(self.requests_per_minute, self.tokens_per_minute, now)
+                self.users[user] = state
+                self.users.move_to_end(user, last=False)  # not served yet, before the users that were
+            if len(state.queue) >= self.max_queued_per_user:
+                self.rejected += 1
+                SCHEDULER_REJECTED.labels(self.name).inc()
+                raise QuotaExceeded(f'{user} already has {len(state.queue)} requests waiting')
+
+            ticket = Ticket(user, estimated_tokens, submitted_at=now)  # the same clock reading as dispatch
+            state.queue.append(ticket)
+            state.last_active = now
+            self.queued += 1
+            self.dispatch(now)
+        return ticket
+
+    def release(self, ticket: Ticket, used_tokens: int = None):
+        """Free the slot of a finished request (or cancel a waiting one), used_tokens corrects the estimate."""
+        now = time.monotonic()
+        with self.lock:
+            if ticket.released:
+                return
+            ticket.released = True
+            state = self.users.get(ticket.user)
+            if ticket.granted.is_set():
+                self.active -= 1
+                if state is not None and used_tokens is not None:
+                    state.token_bucket.consume(used_tokens - ticket.estimated_tokens, now)
+            elif state is not None and ticket in state.queue:
+                state.queue.remove(ticket)
+                self.queued -= 1
+            if state is not None:
+                state.last_active = now
+            self.dispatch(now)
+
+    def get_position(self, ticket: Ticket):
+        """Roughly how many requests will be served before this one (round robin, ignoring the quotas)."""
+        with self.lock:
+            state = self.users.get(ticket.user)
+            if ticket.granted.is_set() or state is None or ticket not in state.queue:
+                return 0
+            rounds = state.queue.index(ticket) + 1
+            return sum(min(len(other.queue), rounds) for other in self.users.values()) - 1
+
+    def get_stats(self):
+        """Active and queued requests, and the wait times of the most recent requests (seconds)."""
+        with self.lock:
+            wait_times = list(self.wait_times)
+            stats = {'active': self.active,
+                     'queued': self.queued,
+                     'queued_per_user': {user: len(state.queue) for user, state in self.users.items() if state.queue},
+                     'rejected': self.rejected}
+        if len(wait_times) >= 2:
+            cut_points = statistics.quantiles(wait_times, n=100, method='inclusive')
+            stats.update({'wait_p50': cut_points[49], 'wait_p95': cut_points[94], 'wait_max': max(wait_times)})
+        elif wait_times:
+            stats.update({'wait_p50': wait_times[0], 'wait_p95': wait_times[0], 'wait_max': wait_times[0]})
+        return stats
+
+    def dispatch(self, now: float):
+        # called with the lock held: grant slots round robin to the users whose buckets allow their next request
+        next_check = None
+        while self.active < self.max_concurrent and self.queued > 0:
+            granted_user = None
+            for user, state in self.users.items():
+                if not state.queue:
+                    continue
+                ticket = state.queue[0]
+                wait = max(state.request_bucket.time_until(1, now),
+                           state.token_bucket.time_until(ticket.estimated_tokens, now))
+                if wait > 0:
+                    next_check = wait if next_check is None else min(next_check, wait)
+                    continue
+                state.queue.popleft()
+                state.request_bucket.consume(1, now)
+                state.token_bucket.consume(ticket.estimated_tokens, now)
+                self.queued -= 1
+                self.active += 1
+                ticket.granted_at = now
+                ticket.granted.set()
+                self.wait_times.append(ticket.get_wait_time())
+                SCHEDULER_WAIT_TIME.labels(self.name).observe(ticket.get_wait_time())
+                granted_user = user
+                break
+            if granted_user is None:
+                break
+            self.users.move_to_end(granted_user)  # served, the other users come first now
+
+        if next_check is not None and self.active < self.max_concurrent:
+            self.dispatch_later(now, next_check)
+        if now - self.last_prune > IDLE_USER_SECONDS:
+            self.prune_users(now)
+        SCHEDULER_QUEUE_DEPTH.labels(self.name).set(self.queued)
+        SCHEDULER_ACTIVE.labels(self.name).set(self.active)
+
+    def dispatch_later(self, now: float, delay: float):
+        due = now + delay
+        if self.timer_due is not None and self.timer_due <= due:
+            return  # an earlier dispatch is planned already
+        if self.timer is not None:
+            self.timer.cancel()
+        self.timer_due = due
+        self.timer = threading.Timer(delay, self.on_timer)
+        self.timer.daemon = True
+        self.timer.start()
+
+    def on_timer(self):
+        with self.lock:
+            self.timer = None
+            self.timer_due = None
+            self.dispatch(time.monotonic())
+
+    def prune_users(self, now: float):
+        self.last_prune = now
+        idle_users = [user for user, state in self.users.items()
+                      if not state.queue and now - state.last_active > IDLE_USER_SECONDS
+                      and state.request_bucket.is_full(now) and state.token_bucket.is_full(now)]
+        for user in idle_users:
+            del self.users[user]
+
+
+def request_identity(request):
+    """The user of a Gradio request: the login name, or the browser session when the app has no login."""
+    if request is None:
+        return 'anonymous'
+    username = getattr(request, 'username', None)
+    if username:
+        return f'user:{username}'
+    return f'session:{request.session_hash}'
@@ -1,22 +1,91 @@
 import base64
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
 
 import bcrypt
 
 DEFAULT_PASSWD_FILE = '.passwd'
 default_encoding = 'utf-8'
 
+# bcrypt is slow on purpose, the checks run on a few dedicated threads instead of the request threads.
+# Gradio runs the login route and the (sync) event handlers on the same pool of 40 threads, a login storm
+# may hold at most MAX_WAITING_LOGINS of them: further logins are refused right away (the user can try again).
+AUTH_WORKERS = min(4, os.cpu_count() or 1)
+MAX_WAITING_LOGINS = 16
+LOGIN_TIMEOUT = 10.0  # seconds
+auth_pool = ThreadPoolExecutor(max_workers=AUTH_WORKERS, thread_name_prefix='bcrypt')
+login_slots = threading.BoundedSemaphore(MAX_WAITING_LOGINS)
+login_stats = {'checked': 0, 'refused': 0}
+
+
+class CredentialIndex:
+    """The password hashes of a users file per (encoded) username, parsed once and reloaded when the file changes."""
+    users_file: str
+
+    def __init__(self, users_file: str = DEFAULT_PASSWD_FILE):
+        self.users_file = users_file
+        self.lock = threading.Lock()
+        self.version = None  # (mtime, size) of the parsed file
+        self.hashes = {}
+
+    def get_hash(self, username: str):
+        """The stored hash of a user, None for unknown users."""
+        return self.load().get(encode_64(username))
+
+    def load(self):
+        try:
+            stat = os.stat(self.users_file)
+        except OSError as e:
+            print(f'Could not read {self.users_file}: {e}')
+            return {}
+        version = (stat.st_mtime_ns, stat.st_size)
+        if version == self.version:
+            return self.hashes
+
+        with self.lock:
+            if version != self.version:
+                hashes = {}
+                with open(self.users_file, 'r') as users_file:
+                    for user in users_file.read().splitlines():
+                        encoded_username, separator, stored_password = user.partition('|')
+                        if separator:
+                            hashes.setdefault(encoded_username, stored_password)  # the first line of a user wins
+                self.hashes = hashes
+                self.version = version
+        return self.hashes
+
+
+credential_indexes = {}
+credential_indexes_lock = threading.Lock()
+
+
+def get_credential_index(users_file=DEFAULT_PASSWD_FILE):
+    """One shared index per users file and process."""
+    users_file = os.path.abspath(users_file)
+    with credential_indexes_lock:
+        if users_file not in credential_indexes:
+            credential_indexes[users_file] = CredentialIndex(users_file)
+        return credential_indexes[users_file]
 
-def auth_method(username, password, users_file=DEFAULT_PASSWD_FILE):
-    encoded_username = encode_64(username)
-    log_file = open(users_file, 'r')
-    users_list = log_file.read().splitlines()
-    log_file.close()
-    for user in users_list:
-        if user.startswith(encoded_username):
-            stored_password = user.split(f'{encoded_username}|')[1]
-            return bc_check_string(password, stored_password)
 
-    return False
+def auth_method(username, password, users_file=DEFAULT_PASSWD_FILE):
+    stored_password = get_credential_index(users_file).get_hash(username)
+    if stored_password is None:
+        return False
+
+    if not login_slots.acquire(blocking=False):
+        login_stats['refused'] += 1
+        print(f'Too many logins at once, refused the login of {username}')
+        return False
+    login_stats['checked'] += 1
+    try:
+        return auth_pool.submit(bc_check_string, password, stored_password).result(timeout=LOGIN_TIMEOUT)
+    except TimeoutError:
+        print(f'Password check of {username} timed out')
+        return False
+    finally:
+        login_slots.release()
 
 
 def add_user(username, password, users_file=DEFAULT_PASSWD_FILE):
@@ -0,0 +1,238 @@
+import argparse
+import gzip
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+# Logs older than a number of days are packed into one compressed archive per day, in an 'archive' subfolder:
+#   archive/2025-03-14.gz           every log is a separate gzip member, so one log can be read on its own
+#   archive/2025-03-14.index.jsonl  file name, offset and length of every member (and removals)
+# An archived log is addressed as '<folder>/archive/2025-03-14.gz#<file name>', read_log_text reads both kinds of paths.
+ARCHIVE_FOLDER_NAME = 'archive'
+ARCHIVE_EXTENSION = '.gz'
+INDEX_EXTENSION = '.index.jsonl'
+LOG_EXTENSIONS = ('.json', '.jsonl', '.log')
+DEFAULT_ARCHIVE_DAYS = 30
+DAY = 24 * 60 * 60
+
+index_cache = OrderedDict()  # index path -> ((size, mtime), entries), the most recently read indexes
+index_cache_lock = threading.Lock()
+MAX_CACHED_INDEXES = 256
+
+
+def archive_logs(log_folder: str, older_than_days: float = DEFAULT_ARCHIVE_DAYS, now: float = None):
+    """Pack the logs of log_folder that didn't change for older_than_days into per-day archives. Returns the count."""
+    cutoff = (now if now is not None else time.time()) - older_than_days * DAY
+    logs_per_day = {}
+    try:
+        with os.scandir(log_folder) as entries:
+            for entry in entries:
+                if entry.is_file() and entry.name.endswith(LOG_EXTENSIONS):
+                    stat = entry.stat()
+                    if stat.st_mtime < cutoff:
+                        day = datetime.fromtimestamp(stat.st_mtime).strftime('%Y-%m-%d')
+                        logs_per_day.setdefault(day, []).append((entry.name, stat.st_size, stat.st_mtime))
+    except OSError as e:
+        print(f'Could not scan {log_folder}: {e}')
+        return 0
+
+    archived_count = 0
+    for day, logs in sorted(logs_per_day.items()):
+        archived_count += add_to_archive(log_folder, day, sorted(logs))
+    return archived_count
+
+
+def add_to_archive(log_folder: str, day: str, logs: list):
+    archive_folder = os.path.join(log_folder, ARCHIVE_FOLDER_NAME)
+    if not os.path.exists(archive_folder):
+        os.makedirs(archive_folder)
+    archive_path = os.path.join(archive_folder, day + ARCHIVE_EXTENSION)
+    archived = read_index(archive_path)
+
+    index_lines = []
+    archived_files = []
+    with open(archive_path, 'ab') as archive_file:
+        offset = archive_file.tell()
+        for file_name, size, mtime in logs:
+            previous = archived.get(file_name)
+            if previous is None or (previous['size'], previous['mtime']) != (size, mtime):
+                try:
+                    with open(os.path.join(log_folder, file_name), 'rb') as log_file:
+                        member = gzip.compress(log_file.read(), mtime=0)
+                except OSError as e:
+                    print(f'Could not archive {file_name}: {e}')
+                    continue
+                archive_file.write(member)
+                index_lines.append(json.dumps({'file_name': file_name, 'offset': offset, 'length': len(member),
+                                               'size': size, 'mtime': mtime}) + '\n')
+                offset += len(member)
+            archived_files.append(file_name)  # also when archived before, but its removal failed
+        archive_file.flush()
+        os.fsync(archive_file.fileno())
+
+    # the index is only written once the archive is on disk, and the logs are only removed after that
+    with open(archive_path[:-len(ARCHIVE_EXTENSION)] + INDEX_EXTENSION, 'at', encoding='utf-8') as index_file:
+        index_file.writelines(index_lines)
+        index_file.flush()
+        os.fsync(index_file.fileno())
+    for file_name in archived_files:
+        try:
+            os.remove(os.path.join(log_folder, file_name))
+        except OSError as e:
+            print(f'Could not remove archived log {file_name}: {e}')
+    return len(archived_files)
+
+
+def rotate_logs(log_root: str, older_than_days: float = DEFAULT_ARCHIVE_DAYS):
+    """Archive the old logs of log_root and of its subfolders (e.g. one per user)."""
+    archived_count = archive_logs(log_root, older_than_days)
+    try:
+        with os.scandir(log_root) as entries:
+            subfolders = [entry.path for entry in entries if entry.is_dir() and entry.name != ARCHIVE_FOLDER_NAME]
+    except OSError:
+        subfolders = []
+    for subfolder in subfolders:
+        archived_count += archive_logs(subfolder, older_than_days)
+    if archived_count > 0:
+        print(f'Archived {archived_count} logs of {log_root}')
+    return archived_count
+
+
+def start_log_rotation(log_root: str, older_than_days: float = DEFAULT_ARCHIVE_DAYS, interval: float = DAY):
+    """Rotate the logs now and then every interval seconds, from a background thread."""
+    def rotate_periodically():
+        while True:
+            try:
+                rotate_logs(log_root, older_than_days)
+            except OSError as e:
+                print(f'Log rotation failed: {e}')
+            time.sleep(interval)
+
+    rotator = threading.Thread(target=rotate_periodically, daemon=True)
+    rotator.start()
+    return rotator
+
+
+def read_index(archive_path: str):
+    """The archived logs of an archive: file name -> {'offset', 'length', 'size', 'mtime'}, removed logs left out."""
+    index_path = archive_path[:-len(ARCHIVE_EXTENSION)] + INDEX_EXTENSION
+    try:
+        stat = os.stat(index_path)
+    except OSError:
+        return {}
+
+    version = (stat.st_size, stat.st_mtime)
+    with index_cache_lock:
+        cached = index_cache.get(index_path)
+        if cached is not None and cached[0] == version:
+            index_cache.move_to_end(index_path)
+            return cached[1]
+
+    entries = {}
+    with open(index_path, 'rt', encoding='utf-8') as index_file:
+        for line in index_file:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue
+            if entry.get('removed'):
+                entries.pop(entry['file_name'], None)
+            else:
+                entries[entry['file_name']] = entry  # the last entry of a file name wins
+
+    with index_cache_lock:
+        index_cache[index_path] = (version, entries)
+        index_cache.move_to_end(index_path)
+        while len(index_cache) > MAX_CACHED_INDEXES:
+            index_cache.popitem(last=False)
+    return entries
+
+
+def list_archived_logs(log_folder: str):
+    """Every archived log of a folder: dicts with the path, file name, size and mtime of the original log."""
+    archive_folder = os.path.join(log_folder, ARCHIVE_FOLDER_NAME)
+    try:
+        archive_names = sorted(name for name in os.listdir(archive_folder) if name.endswith(ARCHIVE_EXTENSION))
+    except OSError:
+        return []
+
+    archived_logs = []
+    for archive_name in archive_names:
+        archive_path = os.path.join(archive_folder, archive_name)
+        for file_name, entry in read_index(archive_path).items():
+            archived_logs.append({'path': to_archived_path(archive_path, file_name),
+                                  'file_name': file_name,
+                                  'size': entry['size'],
+                                  'mtime': entry['mtime']})
+    return archived_logs
+
+
+def to_archived_path(archive_path: str, file_name: str):
+    return f'{archive_path}#{file_name}'
+
+
+def split_archived_path(log_path: str):
+    """(archive path, file name) of an archived log, None for a regular log file."""
+    archive_path, separator, file_name = log_path.partition(ARCHIVE_EXTENSION + '#')
+    if not separator:
+        return None
+    return archive_path + ARCHIVE_EXTENSION, file_name
+
+
+def stat_log(log_path: str):
+    """(size, mtime) of a log, archived or not, None when it doesn't exist."""
+    archived = split_archived_path(log_path)
+    if archived is None:
+        try:
+            stat = os.stat(log_path)
+        except OSError:
+            return None
+        return stat.st_size, stat.st_mtime
+
+    entry = read_index(archived[0]).get(archived[1])
+    return (entry['size'], entry['mtime']) if entry is not None else None
+
+
+def read_log_bytes(log_path: str):
+    """The content of a log, archived or not. Only the member of an archived log is decompressed."""
+    archived = split_archived_path(log_path)
+    if archived is None:
+        with open(log_path, 'rb') as log_file:
+            return log_file.read()
+
+    archive_path, file_name = archived
+    entry = read_index(archive_path).get(file_name)
+    if entry is None:
+        raise FileNotFoundError(log_path)
+    with open(archive_path, 'rb') as archive_file:
+        archive_file.seek(entry['offset'])
+        return gzip.decompress(archive_file.read(entry['length']))
+
+
+def read_log_text(log_path: str):
+    return read_log_bytes(log_path).decode('utf-8')
+
+
+def remove_log(log_path: str):
+    """Remove a log, an archived log is marked as removed in the index of its archive."""
+    archived = split_archived_path(log_path)
+    if archived is None:
+        if os.path.exists(log_path):
+            os.remove(log_path)
+        return
+
+    archive_path, file_name = archived
+    with open(archive_path[:-len(ARCHIVE_EXTENSION)] + INDEX_EXTENSION, 'at', encoding='utf-8') as index_file:
+        index_file.write(json.dumps({'file_name': file_name, 'removed': True}) + '\n')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Pack old conversation logs into compressed per-day archives.')
+    parser.add_argument('log_root', help='e.g. logs/, its subfolders (one per user) are rotated as well')
+    parser.add_argument('--days', type=float, default=DEFAULT_ARCHIVE_DAYS,
+                        help='archive the logs that did not change for this many days')
+    arguments = parser.parse_args()
+    rotate_logs(arguments.log_root, arguments.days)
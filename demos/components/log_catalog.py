@@ -0,0 +1,139 @@
+import os
+import sqlite3
+import threading
+
+from demos.components.log_archive import list_archived_logs, remove_log
+
+LOG_EXTENSIONS = ('.json', '.jsonl')
+CATALOG_FILE_NAME = '.log_catalog.sqlite'
+
+
+class LogCatalog:
+    """
+    Title, timestamp, size and modification time of every log file in a folder (e.g. the logs of one user),
+    kept in a SQLite file in that folder. A scan only reads the files that changed since the previous scan.
+    Archived logs (see log_archive.py) are cataloged as well, their location is a path into the archive.
+    """
+    log_folder: str
+    extensions: tuple
+
+    def __init__(self, log_folder: str, describe_log, extensions: tuple = LOG_EXTENSIONS):
+        self.log_folder = log_folder
+        self.describe_log = describe_log  # function(log path or archived log path) -> (title, created_at)
+        self.extensions = extensions
+        self.lock = threading.Lock()
+        self.db = open_catalog_db(os.path.join(log_folder, CATALOG_FILE_NAME))
+
+    def scan(self):
+        """Update the catalog with the log files that were added, changed or removed. Returns the number of changes."""
+        current_files = {}  # file name -> (location, size, mtime)
+        for archived_log in list_archived_logs(self.log_folder):
+            if archived_log['file_name'].endswith(self.extensions):
+                current_files[archived_log['file_name']] = (archived_log['path'], archived_log['size'],
+                                                        archived_log['mtime'])
+        try:
+            with os.scandir(self.log_folder) as entries:
+                for entry in entries:
+                    if entry.is_file() and entry.name.endswith(self.extensions):
+                        stat = entry.stat()
+                        current_files[entry.name] = (entry.path, stat.st_size, stat.st_mtime)
+        except OSError as e:
+            print(f'Could not scan {self.log_folder}: {e}')
+            return 0
+
+        with self.lock:
+            known_files = {file_name: (location, size, mtime, title, created_at)
+                           for file_name, location, size, mtime, title, created_at
+                           in self.db.execute('SELECT file_name, location, size, mtime, title, created_at '
+                                              'FROM log_catalog')}
+
+        changed_rows = []
+        for file_name, (location, size, mtime) in current_files.items():
+            known = known_files.get(file_name)
+            if known is not None and known[1:3] == (size, mtime):
+                if known[0] != location:  # archived (or restored) meanwhile, the content is the same
+                    changed_rows.append((file_name, location, known[3], known[4], size, mtime))
+                continue
+            try:
+                title, created_at = self.describe_log(location)
+            except (OSError, ValueError, KeyError, IndexError, TypeError) as e:
+                print(f'Could not read {file_name}: {e}')
+                title, created_at = file_name, None
+            changed_rows.append((file_name, location, title or file_name, created_at, size, mtime))
+        removed_files = [(file_name,) for file_name in known_files if file_name not in current_files]
+
+        if changed_rows or removed_files:
+            with self.lock:
+                self.db.executemany('INSERT OR REPLACE INTO log_catalog '
+                                    '(file_name, location, title, created_at, size, mtime) '
+                                    'VALUES (?, ?, ?, ?, ?, ?)', changed_rows)
+                self.db.executemany('DELETE FROM log_catalog WHERE file_name = ?', removed_files)
+                self.db.commit()
+        return len(changed_rows) + len(removed_files)
+
+    def list_logs(self, limit: int = None):
+        """The cataloged logs, most recently changed first."""
+        query = 'SELECT file_name, location, title, created_at, size, mtime FROM log_catalog ORDER BY mtime DESC'
+        parameters = ()
+        if limit is not None:
+            query += ' LIMIT ?'
+            parameters = (limit,)
+        with self.lock:
+            rows = self.db.execute(query, parameters).fetchall()
+        return [to_entry(row) for row in rows]
+
+    def get(self, file_name: str):
+        with self.lock:
+            row = self.db.execute('SELECT file_name, location, title, created_at, size, mtime FROM log_catalog '
+                                  'WHERE file_name = ?', (file_name,)).fetchone()
+        return to_entry(row) if row is not None else None
+
+    def get_path(self, file_name: str):
+        """Path of a cataloged log (a path into an archive for archived logs), None for any other file name."""
+        entry = self.get(file_name)
+        return entry['location'] if entry is not None else None
+
+    def remove(self, file_name: str):
+        log_path = self.get_path(file_name)
+        if log_path is not None:
+            remove_log(log_path)
+        with self.lock:
+            self.db.execute('DELETE FROM log_catalog WHERE file_name = ?', (file_name,))
+            self.db.commit()
+
+
+def to_entry(row):
+    file_name, location, title, created_at, size, mtime = row
+    return {'file_name': file_name, 'location': location, 'title': title, 'created_at': created_at,
+            'size': size, 'mtime': mtime}
+
+
+def open_catalog_db(catalog_file):
+    catalog_folder = os.path.dirname(catalog_file)
+    if catalog_folder and not os.path.exists(catalog_folder):
+        os.makedirs(catalog_folder)
+
+    db = sqlite3.connect(catalog_file, check_same_thread=False)  # access is guarded by LogCatalog.lock
+    db.execute('CREATE TABLE IF NOT EXISTS log_catalog ('
+               'file_name TEXT PRIMARY KEY, '
+               'location TEXT NOT NULL, '
+               'title TEXT NOT NULL, '
+               'created_at REAL, '
+               'size INTEGER NOT NULL, '
+               'mtime REAL NOT NULL)')
+    db.execute('CREATE INDEX IF NOT EXISTS idx_log_catalog_mtime ON log_catalog (mtime)')
+    db.commit()
+    return db
+
+
+catalogs = {}
+catalogs_lock = threading.Lock()
+
+
+def get_log_catalog(log_folder: str, describe_log):
+    """One shared catalog per log folder and process."""
+    log_folder = os.path.normpath(os.path.abspath(log_folder))
+    with catalogs_lock:
+        if log_folder not in catalogs:
+            catalogs[log_folder] = LogCatalog(log_folder, describe_log)
+        return catalogs[log_folder]
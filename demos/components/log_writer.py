@@ -0,0 +1,245 @@
+import atexit
+import hashlib
+import json
+import os
+import queue
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+DEFAULT_BATCH_SIZE = 256  # appends written per wake-up of the writer thread
+DEFAULT_MAX_QUEUE_SIZE = 10000  # appends waiting to be written, callers wait (and eventually drop) beyond this
+DEFAULT_APPEND_TIMEOUT = 1.0  # seconds a caller waits for room in a full queue
+DEFAULT_FSYNC_INTERVAL = 1.0  # seconds, written lines reach the disk within about this time
+MAX_OPEN_FILES = 64
+
+
+class LogWriter:
+    """
+    Appends records to JSON lines log files from a background thread, so the callers never wait for the disk.
+    Written lines are flushed to the OS right away (readers see them), and synced to the disk in batches.
+    """
+    batch_size: int
+    fsync_interval: float
+    append_timeout: float
+
+    def __init__(self,
+                 batch_size: int = DEFAULT_BATCH_SIZE,
+                 max_queue_size: int = DEFAULT_MAX_QUEUE_SIZE,
+                 fsync_interval: float = DEFAULT_FSYNC_INTERVAL,
+                 append_timeout: float = DEFAULT_APPEND_TIMEOUT):
+        self.batch_size = batch_size
+        self.fsync_interval = fsync_interval
+        self.append_timeout = append_timeout
+        self.record_queue = queue.Queue(maxsize=max_queue_size)
+        self.listeners = []  # called with the paths of the files written, from the writer thread
+        self.dropped_records = 0
+
+        # only used by the writer thread
+        self.open_files = OrderedDict()  # log path -> file, least recently written first
+        self.unsynced_files = set()
+        self.last_sync = time.monotonic()
+
+        self.writer = threading.Thread(target=self.write_batches, daemon=True)
+        self.writer.start()
+
+    def append(self, log_path: str, records: list):
+        """Queue records (JSON serialisable) to be appended to log_path, one line each."""
+        if not records:
+            return
+        # serialised right away: the caller may change its objects once this returns
+        lines = [json.dumps(record, ensure_ascii=False, default=str) + '\n' for record in records]
+        try:
+            self.record_queue.put((log_path, lines), timeout=self.append_timeout)
+        except queue.Full:
+            self.dropped_records += len(lines)  # the disk can't keep up, don't block the app any longer
+            print(f'Log writer queue is full, dropped {len(lines)} records for {log_path}')
+
+    def add_listener(self, listener):
+        """Call listener(log_paths) after every batch of writes, e.g. to index the new lines."""
+        self.listeners.append(listener)
+
+    def flush(self):
+        """Block until everything appended so far is written (not necessarily synced to the disk)."""
+        self.record_queue.join()
+
+    def close(self):
+        """Write and sync everything appended so far, and stop the writer thread."""
+        self.record_queue.put(None)
+        self.writer.join(timeout=10)
+
+    def get_queue_size(self):
+        return self.record_queue.qsize()
+
+    def write_batches(self):
+        while True:
+            try:
+                first_append = self.record_queue.get(timeout=self.fsync_interval)
+            except queue.Empty:
+                self.sync_files()  # idle: sync what is left
+                continue
+
+            batch = [first_append]
+            while len(batch) < self.batch_size and batch[-1] is not None:
+                try:
+                    batch.append(self.record_queue.get_nowait())
+                except queue.Empty:
+                    break
+            stop = batch[-1] is None
+            try:
+                written_paths = self.write([append for append in batch if append is not None])
+                if stop or time.monotonic() - self.last_sync >= self.fsync_interval:
+                    self.sync_files()
+                for listener in self.listeners:
+                    try:
+                        listener(written_paths)
+                    except Exception as e:
+                        print(f'Log writer listener failed: {e}')
+            finally:
+                for _ in batch:
+                    self.record_queue.task_done()
+            if stop:
+                self.close_files()
+                return
+
+    def write(self, batch: list):
+        # one write per file, however many appends the batch has for it
+        lines_per_file = {}
+        for log_path, lines in batch:
+            lines_per_file.setdefault(log_path, []).extend(lines)
+
+        for log_path, lines in lines_per_file.items():
+            try:
+                log_file = self.get_file(log_path)
+                log_file.writelines(lines)
+                log_file.flush()
+                self.unsynced_files.add(log_path)
+            except OSError as e:
+                print(f'Could not write {len(lines)} records to {log_path}: {e}')
+        return list(lines_per_file)
+
+    def get_file(self, log_path: str):
+        log_file = self.open_files.get(log_path)
+        if log_file is not None:
+            if os.path.exists(log_path):
+                self.open_files.move_to_end(log_path)
+                return log_file
+            self.close_file(log_path)  # removed or archived meanwhile, start a new file
+
+        log_folder = os.path.dirname(log_path)
+        if log_folder and not os.path.exists(log_folder):
+            os.makedirs(log_folder, exist_ok=True)
+        log_file = open(log_path, 'at', encoding='utf-8')
+        self.open_files[log_path] = log_file
+        while len(self.open_files) > MAX_OPEN_FILES:
+            self.close_file(next(iter(self.open_files)))
+        return log_file
+
+    def sync_files(self):
+        for log_path in self.unsynced_files:
+            log_file = self.open_files.get(log_path)
+            if log_file is not None:
+                try:
+                    os.fsync(log_file.fileno())
+                except OSError as e:
+                    print(f'Could not sync {log_path}: {e}')
+        self.unsynced_files.clear()
+        self.last_sync = time.monotonic()
+
+    def close_file(self, log_path: str):
+        log_file = self.open_files.pop(log_path)
+        try:
+            if log_path in self.unsynced_files:
+                os.fsync(log_file.fileno())
+                self.unsynced_files.discard(log_path)
+            log_file.close()
+        except OSError as e:
+            print(f'Could not close {log_path}: {e}')
+
+    def close_files(self):
+        for log_path in list(self.open_files):
+            self.close_file(log_path)
+
+
+def start_conversation_log(log_folder: str):
+    """The log of a new conversation (keep it in the session state), for log_new_messages."""
+    file_name = datetime.now().strftime('%y%m%d_%H%M%S_%f.jsonl')
+    return {'log_file': os.path.join(log_folder, file_name), 'logged_messages': 0, 'last_message': None}
+
+
+def log_new_messages(conversation_log: dict, message_list: list, writer=None):
+    """
+    Append the messages of message_list that aren't logged yet, O(new messages) per turn because message lists
+    only grow. A list that doesn't continue the logged messages (e.g. an undone or edited message) starts a new
+    log file, conversation_log is updated in place.
+    """
+    logged_messages = conversation_log['logged_messages']
+    if logged_messages > 0 and (len(message_list) < logged_messages
+                                or fingerprint(message_list[logged_messages - 1]) != conversation_log['last_message']):
+        conversation_log.update(start_conversation_log(os.path.dirname(conversation_log['log_file'])))
+        logged_messages = 0
+
+    new_messages = message_list[logged_messages:]
+    if len(new_messages) == 0:
+        return
+    (writer or get_log_writer()).append(conversation_log['log_file'], new_messages)
+    conversation_log['logged_messages'] = len(message_list)
+    conversation_log['last_message'] = fingerprint(message_list[-1])
+
+
+def fingerprint(message):
+    return hashlib.sha1(json.dumps(message, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+
+def read_jsonl(log_path: str):
+    """All records of a JSON lines log file, a partly written last line is skipped."""
+    records = []
+    with open(log_path, 'rt', encoding='utf-8') as log_file:
+        for line in log_file:
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                continue
+    return records
+
+
+def read_last_record(log_path: str, block_size: int = 8192):
+    """The last complete record of a JSON lines log file (read from the end), None if there is none."""
+    try:
+        with open(log_path, 'rb') as log_file:
+            log_file.seek(0, os.SEEK_END)
+            position = log_file.tell()
+            tail = b''
+            while position > 0:
+                read_size = min(block_size, position)
+                position -= read_size
+                log_file.seek(position)
+                tail = log_file.read(read_size) + tail
+                lines = tail.rstrip(b'\n').split(b'\n')
+                if len(lines) > 1 or position == 0:
+                    for line in reversed(lines):
+                        try:
+                            return json.loads(line)
+                        except ValueError:
+                            continue  # e.g. a partly written last line
+                    if position == 0:
+                        return None
+    except OSError:
+        return None
+    return None
+
+
+shared_writer_lock = threading.Lock()
+shared_writer = None
+
+
+def get_log_writer():
+    """One writer per process, synced and closed when the process exits."""
+    global shared_writer
+    if shared_writer is None:
+        with shared_writer_lock:
+            if shared_writer is None:
+                shared_writer = LogWriter()
+                atexit.register(shared_writer.close)
+    return shared_writer
@@ -0,0 +1,187 @@
+import time
+from contextlib import contextmanager
+
+try:
+    from prometheus_client import Counter, Gauge, Histogram, make_asgi_app
+except ImportError:  # metrics are optional, without prometheus_client every metric is a no-op
+    Counter = Gauge = Histogram = make_asgi_app = None
+
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2, 4, 8, 15, 30, 60, 120)
+TOKENS_PER_SECOND_BUCKETS = (5, 10, 20, 40, 60, 80, 100, 150, 200, 300, 500)
+RETRIEVAL_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2, 5)
+
+
+class NoOpMetric:
+    """Stands in for a prometheus metric when prometheus_client is not installed."""
+
+    def labels(self, *args, **kwargs):
+        return self
+
+    def observe(self, value):
+        pass
+
+    def inc(self, amount=1):
+        pass
+
+    def dec(self, amount=1):
+        pass
+
+    def set(self, value):
+        pass
+
+
+def make_metric(metric_class, name: str, documentation: str, labelnames=(), **kwargs):
+    if metric_class is None:
+        return NoOpMetric()
+    return metric_class(name, documentation, labelnames, **kwargs)
+
+
+# LLM calls (OpenRouterClient)
+LLM_TIME_TO_FIRST_TOKEN = make_metric(Histogram, 'llm_time_to_first_token_seconds',
+                                      'Time until the first streamed token', ['model'], buckets=LATENCY_BUCKETS)
+LLM_TOKENS_PER_SECOND = make_metric(Histogram, 'llm_tokens_per_second',
+                                    'Completion tokens per second after the first token', ['model'],
+                                    buckets=TOKENS_PER_SECOND_BUCKETS)
+LLM_COMPLETION_TIME = make_metric(Histogram, 'llm_completion_seconds',
+                                  'Total time of a completion request', ['model', 'stream'], buckets=LATENCY_BUCKETS)
+LLM_ERRORS = make_metric(Counter, 'llm_errors_total',
+                         'Failed completion requests', ['model', 'error'])
+LLM_ACTIVE_STREAMS = make_metric(Gauge, 'llm_active_streams',
+                                 'Completion streams currently being read', ['model'])
+
+# tool calls (AgentLoop and the Assistants apps)
+TOOL_CALL_TIME = make_metric(Histogram, 'tool_call_seconds',
+                             'Time spent in a tool call', ['tool'], buckets=LATENCY_BUCKETS)
+TOOL_CALL_ERRORS = make_metric(Counter, 'tool_call_errors_total',
+                               'Tool calls that raised an exception or returned an error', ['tool'])
+
+# fair scheduling of the LLM calls per user (FairScheduler)
+SCHEDULER_QUEUE_DEPTH = make_metric(Gauge, 'scheduler_queued_requests',
+                                    'Requests waiting for a slot', ['scheduler'])
+SCHEDULER_ACTIVE = make_metric(Gauge, 'scheduler_active_requests',
+                               'Requests holding a slot', ['scheduler'])
+SCHEDULER_WAIT_TIME = make_metric(Histogram, 'scheduler_wait_seconds',
+                                  'Time a request waited for a slot', ['scheduler'], buckets=LATENCY_BUCKETS)
+SCHEDULER_REJECTED = make_metric(Counter, 'scheduler_rejected_total',
+                                 'Requests refused because the user already had too many queued', ['scheduler'])
+
+# chat sessions (SessionStore)
+SESSION_STORE_BYTES = make_metric(Gauge, 'session_store_bytes',
+                                  'Size (as JSON) of the sessions kept in memory', ['store', 'location'])
+SESSION_STORE_SESSIONS = make_metric(Gauge, 'session_store_sessions',
+                                     'Sessions in memory and spilled to disk', ['store', 'location'])
+
+# retrieval (ChromaDocumentStore)
+QUERY_STORE_TIME = make_metric(Histogram, 'query_store_seconds',
+                               'Time of a query over all collections of the document store', ['collections'],
+                               buckets=RETRIEVAL_BUCKETS)
+
+
+class MeteredStream:
+    """Wraps a completions stream, to measure it while the caller reads it."""
+
+    def __init__(self, stream, model: str, started_at: float, observer=None):
+        self.stream = stream
+        self.model = model
+        self.started_at = started_at
+        self.observer = observer  # e.g. a ModelRouter, told about the latency (or failure) of the stream
+        self.first_token_at = None
+        self.delta_count = 0
+        self.completion_tokens = None
+        self.completed = False
+        self.finished = False
+        LLM_ACTIVE_STREAMS.labels(model).inc()
+
+    def __iter__(self):
+        try:
+            for chunk in self.stream:
+                if getattr(chunk, 'usage', None) is not None:
+                    self.completion_tokens = chunk.usage.completion_tokens
+                if len(chunk.choices) > 0:
+                    delta = chunk.choices[0].delta
+                    if delta.content or delta.tool_calls:
+                        if self.first_token_at is None:
+                            self.first_token_at = time.monotonic()
+                            LLM_TIME_TO_FIRST_TOKEN.labels(self.model).observe(self.first_token_at - self.started_at)
+                        self.delta_count += 1
+                yield chunk
+            self.completed = True
+        except Exception as e:
+            LLM_ERRORS.labels(self.model, type(e).__name__).inc()
+            if self.observer is not None:
+                self.observer.observe_error(self.model)
+            raise
+        finally:
+            self.finish()
+
+    def close(self):
+        self.stream.close()
+        self.finish()
+
+    def finish(self):
+        if self.finished:
+            return
+        self.finished = True
+        LLM_ACTIVE_STREAMS.labels(self.model).dec()
+        if not self.completed:
+            return  # abandoned streams would skew the timings
+
+        finished_at = time.monotonic()
+        LLM_COMPLETION_TIME.labels(self.model, 'true').observe(finished_at - self.started_at)
+        tokens = self.completion_tokens if self.completion_tokens is not None else self.delta_count
+        tokens_per_second = None
+        if self.first_token_at is not None and finished_at > self.first_token_at and tokens > 1:
+            tokens_per_second = tokens / (finished_at - self.first_token_at)
+            LLM_TOKENS_PER_SECOND.labels(self.model).observe(tokens_per_second)
+        if self.observer is not None and self.first_token_at is not None:
+            self.observer.observe(self.model, self.first_token_at - self.started_at, tokens_per_second)
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)  # e.g. response
+
+
+@contextmanager
+def track_llm_request(model: str, stream: bool):
+    started_at = time.monotonic()
+    try:
+        yield started_at
+    except Exception as e:
+        LLM_ERRORS.labels(model, type(e).__name__).inc()
+        raise
+    if not stream:
+        LLM_COMPLETION_TIME.labels(model, 'false').observe(time.monotonic() - started_at)
+
+
+@contextmanager
+def track_tool_call(tool_name: str):
+    started_at = time.monotonic()
+    try:
+        yield
+    except Exception:
+        TOOL_CALL_ERRORS.labels(tool_name).inc()
+        raise
+    finally:
+        TOOL_CALL_TIME.labels(tool_name).observe(time.monotonic() - started_at)
+
+
+def count_tool_error(tool_name: str):
+    TOOL_CALL_ERRORS.labels(tool_name).inc()
+
+
+def collection_count_label(collection_count: int):
+    # a label per exact count would create a new series for every uploaded document
+    for upper_bound in (1, 2, 5, 10, 20, 50):
+        if collection_count <= upper_bound:
+            return str(upper_bound)
+    return '50+'
+
+
+def metrics_app_kwargs(app_kwargs: dict = None):
+    """Arguments for launch(app_kwargs=...) of a Gradio app, to serve the metrics on /metrics."""
+    app_kwargs = dict(app_kwargs or {})
+    if make_asgi_app is None:
+        return app_kwargs
+
+    from starlette.routing import Mount  # starlette comes with gradio
+    app_kwargs['routes'] = list(app_kwargs.get('routes', [])) + [Mount('/metrics', app=make_asgi_app())]
+    return app_kwargs
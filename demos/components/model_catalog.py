@@ -0,0 +1,185 @@
+import hashlib
+import json
+import os
+import threading
+import time
+
+import requests
+
+from demos.components.open_router_endpoint import get_base_url
+
+DEFAULT_CACHE_FILE = './cache/openrouter_models.json'
+DEFAULT_TTL = 3600  # seconds
+MIN_RETRY_INTERVAL = 60  # seconds after a failed refresh, doubled after every next failure (up to the TTL)
+
+
+class ModelCatalog:
+    """The OpenRouter model list, cached in memory and on disk, and refreshed in the background."""
+    base_url: str
+    cache_file: str
+    ttl: float
+
+    def __init__(self, base_url: str = None, cache_file: str = DEFAULT_CACHE_FILE, ttl: float = DEFAULT_TTL):
+        self.base_url = base_url or get_base_url()
+        self.cache_file = cache_file
+        self.ttl = ttl
+
+        self.models = None
+        self.version = None  # changes whenever the list of models changes
+        self.fetched_at = 0  # wall clock, so it survives a restart via the cache file
+        self.etag = None
+        self.last_modified = None
+        self.derived = {}  # key -> (version, value), values computed from the models
+        self.failed_refreshes = 0
+        self.retry_at = 0  # no refresh before this time (wall clock) after a failure
+
+        self.lock = threading.Lock()
+        self.refresh_lock = threading.Lock()  # one download at a time
+        self.refresh_needed = threading.Event()
+        self.refresher = None
+
+    def get_models(self):
+        """The (unfiltered) list of models, never blocks on the network unless there is no cached list at all."""
+        if self.models is None:
+            with self.lock:
+                if self.models is None:
+                    self.load_cache_file()
+            if self.models is None and time.time() >= self.retry_at:
+                self.refresh()
+
+        self.start_background_refresh()
+        if self.is_stale():
+            self.refresh_needed.set()
+        return self.models if self.models is not None else []
+
+    def get_derived(self, key, build_function):
+        """Memoise build_function(models) until the catalog changes, e.g. for a filtered and scored DataFrame."""
+        self.get_models()
+        with self.lock:  # the models and their version together, a refresh may replace both meanwhile
+            models = self.models if self.models is not None else []
+            version = self.version
+            derived_version, value = self.derived.get(key, (None, None))
+            if derived_version is not None and derived_version == version:
+                return value
+
+        value = build_function(models)
+        with self.lock:
+            self.derived[key] = (version, value)
+        return value
+
+    def get_version(self):
+        return self.version
+
+    def is_stale(self):
+        return time.time() - self.fetched_at > self.ttl
+
+    def refresh(self):
+        """Revalidate the list with OpenRouter, only downloads it again when it has changed."""
+        with self.refresh_lock:
+            headers = {}
+            if self.models is not None:
+                if self.etag:
+                    headers['If-None-Match'] = self.etag
+                if self.last_modified:
+                    headers['If-Modified-Since'] = self.last_modified
+
+            try:
+                response = requests.get(f'{self.base_url}/models', headers=headers, timeout=30)
+                if response.status_code == 304:
+                    self.fetched_at = time.time()
+                    self.save_cache_file()
+                    return False
+                response.raise_for_status()
+                models = response.json()['data']
+            except (requests.exceptions.RequestException, ValueError, KeyError) as e:
+                self.failed_refreshes += 1
+                retry_interval = min(MIN_RETRY_INTERVAL * 2 ** (self.failed_refreshes - 1),
+                                     max(self.ttl, MIN_RETRY_INTERVAL))
+                self.retry_at = time.time() + retry_interval
+                print(f'Could not refresh the model catalog, using the cached one '
+                      f'(retry in {retry_interval:.0f}s): {e}')
+                return False
+            self.failed_refreshes = 0
+            self.retry_at = 0
+
+            version = hashlib.sha1(response.content).hexdigest()[:12]
+            changed = version != self.version
+            with self.lock:
+                self.models = models
+                self.version = version
+                self.fetched_at = time.time()
+                self.etag = response.headers.get('ETag')
+                self.last_modified = response.headers.get('Last-Modified')
+            self.save_cache_file()
+            print(f'Model catalog refreshed: {len(models)} models{"" if changed else " (unchanged)"}')
+            return changed
+
+    def start_background_refresh(self):
+        if self.refresher is not None:
+            return
+        with self.lock:
+            if self.refresher is None:
+                self.refresher = threading.Thread(target=self.refresh_periodically, daemon=True)
+                self.refresher.start()
+
+    def refresh_periodically(self):
+        while True:
+            # wake up when the TTL expires (or a retry is due), or earlier when a caller noticed a stale list
+            now = time.time()
+            self.refresh_needed.wait(timeout=max(self.fetched_at + self.ttl - now, self.retry_at - now, 1))
+            self.refresh_needed.clear()
+            if self.is_stale() and time.time() >= self.retry_at:
+                self.refresh()
+
+    # helper method, expects the lock to be held
+    def load_cache_file(self):
+        if not os.path.exists(self.cache_file):
+            return
+        try:
+            with open(self.cache_file, 'rt', encoding='utf-8') as cache_file:
+                cached = json.load(cache_file)
+        except (OSError, ValueError) as e:
+            print(f'Ignoring the model catalog cache file: {e}')
+            return
+        if cached.get('base_url') != self.base_url:
+            return  # e.g. a cache of the stub server
+
+        self.models = cached['data']
+        self.version = cached['version']
+        self.fetched_at = cached['fetched_at']
+        self.etag = cached.get('etag')
+        self.last_modified = cached.get('last_modified')
+
+    def save_cache_file(self):
+        cache_folder = os.path.dirname(self.cache_file)
+        if cache_folder and not os.path.exists(cache_folder):
+            os.makedirs(cache_folder)
+
+        with self.lock:
+            cached = {'base_url': self.base_url,
+                      'version': self.version,
+                      'fetched_at': self.fetched_at,
+                      'etag': self.etag,
+                      'last_modified': self.last_modified,
+                      'data': self.models}
+        temp_file = f'{self.cache_file}.{threading.get_ident()}.tmp'
+        with open(temp_file, 'wt', encoding='utf-8') as cache_file:
+            json.dump(cached, cache_file)
+        os.replace(temp_file, self.cache_file)  # readers never see a half written file
+
+
+catalogs = {}
+catalogs_lock = threading.Lock()
+
+
+def get_model_catalog(base_url: str = None):
+    """One shared catalog per endpoint and process."""
+    base_url = base_url or get_base_url()
+    with catalogs_lock:
+        if base_url not in catalogs:
+            catalogs[base_url] = ModelCatalog(base_url)
+        return catalogs[base_url]
+
+
+def supports_tools(model: dict):
+    return 'tools' in model.get('supported_parameters', [])
@@ -0,0 +1,152 @@
+import threading
+import time
+
+ROUTED_MODEL = 'router/fastest'  # pass this to OpenRouterClient.set_model to let the router pick the model
+
+DEFAULT_TTFT = 1.0  # seconds, assumed for models without measurements (so they get tried)
+DEFAULT_TOKENS_PER_SECOND = 60
+
+
+class ModelStats:
+    """Moving averages of the latency of one model, from real traffic."""
+    model_name: str
+
+    def __init__(self, model_name: str):
+        self.model_name = model_name
+        self.ttft = None
+        self.tokens_per_second = None
+        self.error_rate = 0
+        self.samples = 0
+        self.errors = 0
+        self.consecutive_errors = 0
+        self.degraded_until = 0
+        self.last_seen = None
+
+    def to_dict(self):
+        return dict(vars(self))
+
+
+class ModelRouter:
+    quality_floor: float
+    max_prompt_price: float
+    max_completion_price: float
+    alpha: float
+    expected_tokens: int
+
+    def __init__(self,
+                 quality_floor: float = None,
+                 max_prompt_price: float = None,
+                 max_completion_price: float = None,
+                 alpha: float = 0.3,
+                 expected_tokens: int = 400,
+                 max_error_rate: float = 0.5,
+                 max_consecutive_errors: int = 2,
+                 cooldown_seconds: float = 300):
+        self.quality_floor = quality_floor  # minimal LM Arena score
+        self.max_prompt_price = max_prompt_price  # per million tokens
+        self.max_completion_price = max_completion_price  # per million tokens
+        self.alpha = alpha  # weight of the newest sample in the moving averages
+        self.expected_tokens = expected_tokens  # answer length used to weigh the ttft against the tokens/sec
+        self.max_error_rate = max_error_rate
+        self.max_consecutive_errors = max_consecutive_errors
+        self.cooldown_seconds = cooldown_seconds  # how long a degraded model is skipped
+
+        self.candidates = {}  # model name -> {'score': ..., 'prompt_price': ..., 'completion_price': ...}
+        self.stats = {}  # model name -> ModelStats, for every model that was used, candidate or not
+        self.lock = threading.Lock()
+
+    def set_candidates(self, candidates: list):
+        """Models to route to: dicts with the model name, LM Arena score and prices per million tokens."""
+        with self.lock:
+            self.candidates = {c['model']: c for c in candidates}
+
+    def observe(self, model_name: str, time_to_first_token: float, tokens_per_second: float = None):
+        """Record a successful request (called by OpenRouterClient when a stream is read completely)."""
+        with self.lock:
+            stats = self.get_stats(model_name)
+            stats.ttft = self.moving_average(stats.ttft, time_to_first_token)
+            if tokens_per_second is not None:
+                stats.tokens_per_second = self.moving_average(stats.tokens_per_second, tokens_per_second)
+            stats.error_rate = self.moving_average(stats.error_rate, 0)
+            stats.samples += 1
+            stats.consecutive_errors = 0
+            stats.last_seen = time.time()
+
+    def observe_error(self, model_name: str):
+        with self.lock:
+            stats = self.get_stats(model_name)
+            stats.error_rate = self.moving_average(stats.error_rate, 1)
+            stats.errors += 1
+            stats.consecutive_errors += 1
+            stats.last_seen = time.time()
+            if (stats.consecutive_errors >= self.max_consecutive_errors
+                    or (stats.samples > 0 and stats.error_rate > self.max_error_rate)):
+                stats.degraded_until = time.time() + self.cooldown_seconds
+                print(f'Model router: {model_name} is degraded, skipped for {self.cooldown_seconds}s')
+
+    def choose(self, exclude: list = None):
+        """The fastest candidate that meets the quality floor and price ceilings, and isn't degraded."""
+        table = self.get_routing_table()
+        for row in table:
+            if row['eligible'] and not row['degraded'] and (exclude is None or row['model'] not in exclude):
+                return row['model']
+
+        # everything is degraded (or excluded): the fastest model that meets the requirements, if any
+        for row in table:
+            if row['eligible'] and (exclude is None or row['model'] not in exclude):
+                return row['model']
+        raise ValueError('No model meets the quality floor and price ceilings of the router')
+
+    def get_routing_table(self):
+        """One row per candidate, the fastest (estimated) model first."""
+        now = time.time()
+        with self.lock:
+            rows = []
+            for model_name, candidate in self.candidates.items():
+                stats = self.stats.get(model_name)
+                ttft = stats.ttft if stats is not None and stats.ttft is not None else DEFAULT_TTFT
+                tokens_per_second = (stats.tokens_per_second if stats is not None and stats.tokens_per_second
+                                     else DEFAULT_TOKENS_PER_SECOND)
+                rows.append({'model': model_name,
+                             'score': candidate.get('score'),
+                             'prompt_price': candidate.get('prompt_price'),
+                             'completion_price': candidate.get('completion_price'),
+                             'ttft': round(ttft, 3),
+                             'tokens_per_second': round(tokens_per_second, 1),
+                             'estimated_time': round(ttft + self.expected_tokens / tokens_per_second, 2),
+                             'samples': stats.samples if stats is not None else 0,
+                             'error_rate': round(stats.error_rate, 3) if stats is not None else 0,
+                             'eligible': self.is_eligible(candidate),
+                             'degraded': stats is not None and stats.degraded_until > now})
+        rows.sort(key=lambda r: r['estimated_time'])
+        return rows
+
+    def is_eligible(self, candidate: dict):
+        score = candidate.get('score')
+        if self.quality_floor is not None and (score is None or score < self.quality_floor):
+            return False
+        if self.max_prompt_price is not None and candidate.get('prompt_price', 0) > self.max_prompt_price:
+            return False
+        if self.max_completion_price is not None and candidate.get('completion_price', 0) > self.max_completion_price:
+            return False
+        return True
+
+    # helper methods, expect the lock to be held
+    def get_stats(self, model_name: str):
+        if model_name not in self.stats:
+            self.stats[model_name] = ModelStats(model_name)
+        return self.stats[model_name]
+
+    def moving_average(self, average, value):
+        if average is None:
+            return value
+        return self.alpha * value + (1 - self.alpha) * average
+
+
+def candidates_from_table(df_models):
+    """Router candidates from the DataFrame of or_pricing.get_models(as_dataframe=True)."""
+    return [{'model': row.full_model_name,
+             'score': row.lm_arena_score if row.lm_arena_score > 0 else None,
+             'prompt_price': row.prompt_price,
+             'completion_price': row.completion_price}
+            for row in df_models.itertuples(index=False)]
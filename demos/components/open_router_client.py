@@ -1,20 +1,36 @@
+import json
 from typing import Iterable
 
 from openai import OpenAI
 
+from demos.components.metrics import MeteredStream, track_llm_request
+from demos.components.model_router import ROUTED_MODEL
+from demos.components.open_router_endpoint import get_base_url
+
+# these providers only cache prompts with explicit cache_control breakpoints,
+# others (OpenAI, DeepSeek, ...) cache identical prefixes automatically
+CACHE_CONTROL_PROVIDERS = ('anthropic/', 'google/gemini')
+CACHE_CONTROL = {'type': 'ephemeral'}
+
 
 class OpenRouterClient(OpenAI):
     model_name: str
     tools_list: list
     temperature: float
+    prompt_caching: bool
+    router: object
 
     def __init__(self,
                  api_key: str,
-                 base_url: str = 'https://openrouter.ai/api/v1',
+                 base_url: str = None,
                  model_name: str = 'openai/gpt-4o-mini',
                  tools_list: list = None,
                  temperature: float = 0,
-                 custom_headers=None):
+                 custom_headers=None,
+                 prompt_caching: bool = True,
+                 router=None):
+        if base_url is None:
+            base_url = get_base_url()  # e.g. a local stub server for load testing
         super().__init__(base_url=base_url,
                          api_key=api_key)
 
@@ -23,21 +39,130 @@ class OpenRouterClient(OpenAI):
                 'HTTP-Referer': 'https://pxl-research.be/',
                 'X-Title': 'PXL Smart ICT'
             }
-        self.model_name = model_name
-        self.tools_list = tools_list
         self.temperature = temperature
         self.extra_headers = custom_headers
+        self.prompt_caching = prompt_caching
+        self.router = router  # learns the latency of every model used, picks the model for ROUTED_MODEL
+        self.auto_route = False
+        self.set_model(model_name)
+
+        # frozen copies, so the (cacheable) prefix of every request is byte-for-byte the same
+        self.tools_list = freeze_json(tools_list)
+        self.marked_tools_list = mark_last_tool(self.tools_list)
+        self.marked_system_messages = {}
+
+    def create_completions_stream(self, message_list: Iterable, stream=True, tool_choice: str = None,
+                                  model_name: str = None):
+        """Pass model_name to use another model for this request only (e.g. one client shared by many models)."""
+        extra_args = {}
+        if tool_choice is not None:
+            extra_args['tool_choice'] = tool_choice  # e.g. 'none' to force a text answer
+        if stream:
+            extra_args['stream_options'] = {'include_usage': True}  # usage arrives in the last chunk
+
+        message_list = list(message_list)  # unchanged, every attempt prepares its own copy for its model
+        failed_models = []
+        while True:
+            if model_name is None:
+                if self.auto_route:
+                    self.model_name = self.router.choose(exclude=failed_models)  # the fastest model right now
+                request_model = self.model_name
+            else:
+                request_model = model_name
 
-    def create_completions_stream(self, message_list: Iterable, stream=True):
-        return self.chat.completions.create(model=self.model_name,
-                                            messages=message_list,
-                                            tools=self.tools_list,
-                                            stream=stream,
-                                            temperature=self.temperature,
-                                            extra_headers=self.extra_headers)
+            request_messages, tools_list = self.prepare_prompt(list(message_list), request_model)
+            try:
+                with track_llm_request(request_model, stream) as started_at:
+                    response = self.chat.completions.create(model=request_model,
+                                                            messages=request_messages,
+                                                            tools=tools_list,
+                                                            stream=stream,
+                                                            temperature=self.temperature,
+                                                            extra_headers=self.extra_headers,
+                                                            extra_body={'usage': {'include': True}},  # adds the cost
+                                                            **extra_args)
+                break
+            except Exception:
+                if self.router is not None:
+                    self.router.observe_error(request_model)
+                failed_models.append(request_model)
+                if model_name is not None or not self.auto_route or len(failed_models) > 2:
+                    raise
+                print(f'Request to {request_model} failed, falling back to another model')
+
+        if stream:
+            return MeteredStream(response, request_model, started_at, observer=self.router)
+        return response
 
     def set_model(self, model_name: str):
-        self.model_name = model_name
+        if model_name == ROUTED_MODEL:
+            if self.router is None:
+                raise ValueError(f'{ROUTED_MODEL} needs an OpenRouterClient with a router')
+            self.auto_route = True
+            self.model_name = self.router.choose()
+        else:
+            self.auto_route = False
+            self.model_name = model_name
+
+    def uses_cache_control(self, model_name: str = None):
+        return self.prompt_caching and (model_name or self.model_name).startswith(CACHE_CONTROL_PROVIDERS)
+
+    def prepare_prompt(self, message_list: list, model_name: str = None):
+        if not self.uses_cache_control(model_name):
+            return message_list, self.tools_list
+
+        # cache breakpoints at the end of the tools and of the system prompt
+        if len(message_list) > 0 and message_list[0].get('role') == 'system':
+            message_list[0] = self.get_marked_system_message(message_list[0])
+        return message_list, self.marked_tools_list
+
+    def get_marked_system_message(self, system_message: dict):
+        content = system_message.get('content')
+        if not isinstance(content, str):
+            return system_message
+
+        marked_message = self.marked_system_messages.get(content)
+        if marked_message is None:
+            marked_message = {
+                'role': 'system',
+                'content': [{'type': 'text', 'text': content, 'cache_control': CACHE_CONTROL}]
+            }
+            if len(self.marked_system_messages) > 16:
+                self.marked_system_messages.clear()
+            self.marked_system_messages[content] = marked_message
+        return marked_message
+
+
+def get_usage_summary(usage):
+    if usage is None:
+        return None
+
+    details = getattr(usage, 'prompt_tokens_details', None)
+    cached_tokens = (getattr(details, 'cached_tokens', None) or 0) if details is not None else 0
+    prompt_tokens = usage.prompt_tokens or 0
+    return {
+        'prompt_tokens': prompt_tokens,
+        'cached_prompt_tokens': cached_tokens,
+        'uncached_prompt_tokens': prompt_tokens - cached_tokens,
+        'completion_tokens': usage.completion_tokens or 0,
+        'cost': getattr(usage, 'cost', None) or 0,  # in credits (USD), only sent by OpenRouter
+    }
+
+
+# helper method
+def freeze_json(json_object):
+    if json_object is None:
+        return None
+    return json.loads(json.dumps(json_object))  # deep copy that no one else holds a reference to
+
+
+# helper method
+def mark_last_tool(tools_list):
+    if not tools_list:
+        return tools_list
+    marked_tools = freeze_json(tools_list)
+    marked_tools[-1]['cache_control'] = CACHE_CONTROL
+    return marked_tools
 
 
 # some models with tool calling (sorted from more to less powerful)
@@ -0,0 +1,8 @@
+import os
+
+# no dependencies: imported by the OpenAI based client and by the apps that only call the REST API
+DEFAULT_BASE_URL = 'https://openrouter.ai/api/v1'
+
+
+def get_base_url():
+    return os.getenv('OPENROUTER_ENDPOINT') or DEFAULT_BASE_URL
@@ -0,0 +1,93 @@
+import json
+import sys
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+sys.path.append('../')
+sys.path.append('../../')
+
+from demos.components.open_router_client import OpenRouterClient, get_usage_summary
+from demos.tool_calling.tool_descriptors import (tools_rag_descriptor,
+                                                 tools_search_descriptor,
+                                                 tools_get_website_contents)
+
+# Checks the prompt caching markers of OpenRouterClient against a local stub, no API key needed.
+# Run this from the root of the repository: python -m demos.components.prompt_caching_check
+
+received_bodies = []
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        received_bodies.append(json.loads(body))
+
+        response = {
+            'id': 'stub', 'object': 'chat.completion', 'created': 0, 'model': received_bodies[-1]['model'],
+            'choices': [{'index': 0, 'finish_reason': 'stop',
+                         'message': {'role': 'assistant', 'content': 'Hello from the stub'}}],
+            'usage': {'prompt_tokens': 1200, 'completion_tokens': 5, 'total_tokens': 1205,
+                      'prompt_tokens_details': {'cached_tokens': 1000}}
+        }
+        response_bytes = json.dumps(response).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(response_bytes)))
+        self.end_headers()
+        self.wfile.write(response_bytes)
+
+    def log_message(self, format, *args):
+        pass  # keep the output readable
+
+
+def prefix_of(body):
+    return json.dumps(body['tools']) + json.dumps(body['messages'][0])
+
+
+def run_check():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    tool_list = list(tools_rag_descriptor)
+    tool_list.append(tools_search_descriptor)
+    tool_list.extend(tools_get_website_contents)
+    or_client = OpenRouterClient(api_key='not-needed',
+                                 base_url=f'http://127.0.0.1:{server.server_port}/api/v1',
+                                 model_name='anthropic/claude-sonnet-4',
+                                 tools_list=tool_list)
+
+    system_instruction = {'role': 'system', 'content': 'Be concise. Be precise. '}
+    message_list = [system_instruction, {'role': 'user', 'content': 'Hi!'}]
+
+    # two turns with a model that needs explicit breakpoints
+    response = or_client.create_completions_stream(message_list, stream=False)
+    message_list.append({'role': 'assistant', 'content': response.choices[0].message.content})
+    message_list.append({'role': 'user', 'content': 'And now?'})
+    response = or_client.create_completions_stream(message_list, stream=False)
+
+    first, second = received_bodies[0], received_bodies[1]
+    assert first['messages'][0]['content'][0]['cache_control'] == {'type': 'ephemeral'}, 'no marker on system prompt'
+    assert first['tools'][-1]['cache_control'] == {'type': 'ephemeral'}, 'no marker on the tools'
+    assert all('cache_control' not in t for t in first['tools'][:-1]), 'only the last tool needs a marker'
+    assert prefix_of(first) == prefix_of(second), 'prefix changed between turns'
+    assert message_list[0] is system_instruction, 'message list of the caller was modified'
+    print('Markers present and prefix stable for anthropic/...')
+
+    usage = get_usage_summary(response.usage)
+    assert usage['cached_prompt_tokens'] == 1000 and usage['uncached_prompt_tokens'] == 200
+    print(f'Usage report: {usage}')
+
+    # automatic caching providers get the prompt as is
+    or_client.set_model('openai/gpt-4.1-mini')
+    or_client.create_completions_stream(message_list, stream=False)
+    third = received_bodies[2]
+    assert third['messages'][0] == system_instruction, 'unexpected marker for openai/...'
+    assert all('cache_control' not in t for t in third['tools']), 'unexpected marker for openai/...'
+    print('No markers for openai/...')
+
+    server.shutdown()
+    print('All prompt caching checks passed.')
+
+
+if __name__ == '__main__':
+    run_check()
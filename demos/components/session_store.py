@@ -0,0 +1,308 @@
+import gzip
+import hashlib
+import itertools
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from demos.components.metrics import SESSION_STORE_BYTES, SESSION_STORE_SESSIONS
+from demos.components.token_counter import hash_message
+
+DEFAULT_SPILL_FOLDER = './cache/sessions'
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024  # over all sessions in memory
+DEFAULT_IDLE_SECONDS = 10 * 60  # sessions without a message for this long are written to disk
+DEFAULT_MAX_SPILL_AGE = 24 * 60 * 60  # spilled sessions that didn't come back for this long are removed
+SPILL_EXTENSION = '.json.gz'
+
+
+class SessionStore:
+    """
+    The message lists of the chat sessions, by session id (e.g. request.session_hash). The recently used sessions
+    stay in memory within max_bytes (their size as JSON), the least recently used ones and the idle ones are
+    written to a compressed file in spill_folder, get() reads them back on the next message. The lock only guards
+    the bookkeeping: the sessions are serialized, written and read outside of it.
+    """
+    spill_folder: str
+    max_bytes: int
+    idle_seconds: float
+
+    def __init__(self,
+                 spill_folder: str = DEFAULT_SPILL_FOLDER,
+                 max_bytes: int = DEFAULT_MAX_BYTES,
+                 idle_seconds: float = DEFAULT_IDLE_SECONDS,
+                 name: str = 'sessions'):
+        self.spill_folder = spill_folder
+        self.max_bytes = max_bytes
+        self.idle_seconds = idle_seconds
+        self.name = name  # the label of the metrics
+        self.lock = threading.Lock()
+        self.sessions = OrderedDict()  # session id -> (message list, size, last used), least recently used first
+        self.memory_bytes = 0  # of the sessions in self.sessions
+        self.measured = {}  # session id -> (message count, hash of the last message, size) of the sessions in memory
+        self.spilling = {}  # session id -> (message list, size, spill number), being written to disk
+        self.spilled = {}  # session id -> (size of its spilled file, spill number)
+        self.spill_numbers = itertools.count()
+        if not os.path.exists(spill_folder):
+            os.makedirs(spill_folder)
+        remove_spilled_sessions(spill_folder)  # the sessions of a previous run don't come back
+
+    def get(self, session_id: str, default=None):
+        """The message list of a session, read back from disk when it was spilled. default when it's unknown."""
+        while True:
+            with self.lock:
+                message_list = self.touch(session_id)
+                if message_list is not None:
+                    return message_list
+                spill = self.spilled.get(session_id)
+                if spill is None:
+                    return default
+
+            try:
+                message_list, measurement = self.read_spill(session_id)
+            except (OSError, EOFError, ValueError) as e:  # e.g. a truncated file
+                message_list, measurement, read_error = None, None, e
+            with self.lock:
+                if self.spilled.get(session_id) is not spill:  # stored, removed or spilled again meanwhile
+                    continue
+                self.forget(session_id)
+                if message_list is None:
+                    print(f'Could not read spilled session {session_id}: {read_error}')
+                    self.update_metrics()
+                    return default
+                self.sessions[session_id] = (message_list, measurement[2], time.monotonic())
+                self.measured[session_id] = measurement
+                self.memory_bytes += measurement[2]
+                to_spill = self.take_over_budget(keep_id=session_id)
+                self.update_metrics()
+            self.spill(to_spill)
+            return message_list
+
+    def put(self, session_id: str, message_list: list):
+        """Store the (changed) message list of a session, e.g. after every answer."""
+        with self.lock:
+            measurement = self.measured.get(session_id)
+        measurement = measure(message_list, measurement)  # only the messages added since the previous put
+        size = measurement[2]
+        with self.lock:
+            self.forget(session_id)
+            self.sessions[session_id] = (message_list, size, time.monotonic())
+            self.measured[session_id] = measurement
+            self.memory_bytes += size
+            to_spill = self.take_over_budget(keep_id=session_id)
+            self.update_metrics()
+        self.spill(to_spill)
+
+    def remove(self, session_id: str):
+        """Forget a session, e.g. when its tab is closed."""
+        with self.lock:
+            self.forget(session_id)
+            self.update_metrics()
+
+    def spill_idle_sessions(self, max_spill_age: float = DEFAULT_MAX_SPILL_AGE):
+        """Write the idle sessions to disk, and remove spilled sessions that never came back. Returns the count."""
+        cutoff = time.monotonic() - self.idle_seconds
+        spilled_count = 0
+        while True:
+            with self.lock:  # one session at a time, the handlers don't wait for the whole sweep
+                if len(self.sessions) == 0:
+                    break
+                session_id, (_, _, last_used) = next(iter(self.sessions.items()))
+                if last_used > cutoff:
+                    break
+                to_spill = [self.take(session_id)]
+                self.update_metrics()
+            if self.spill(to_spill) == 0:
+                break
+            spilled_count += 1
+
+        expired_before = time.time() - max_spill_age
+        with self.lock:
+            spilled = list(self.spilled.items())
+        expired = [(session_id, spill) for session_id, spill in spilled
+                   if get_mtime(self.get_spill_path(session_id)) < expired_before]
+        with self.lock:
+            for session_id, spill in expired:
+                if self.spilled.get(session_id) is spill:  # not read back (and spilled again) meanwhile
+                    self.forget(session_id)
+            self.update_metrics()
+        return spilled_count
+
+    def start_sweeper(self, interval: float = 60):
+        """Spill the idle sessions every interval seconds, from a background thread."""
+        def sweep_periodically():
+            while True:
+                time.sleep(interval)
+                try:
+                    spilled_count = self.spill_idle_sessions()
+                    if spilled_count > 0:
+                        report = self.get_report(limit=0)
+                        print(f'Spilled {spilled_count} idle sessions, in memory: {report["sessions_in_memory"]} '
+                              f'sessions, {report["bytes_in_memory"]} bytes')
+                except OSError as e:
+                    print(f'Session sweep failed: {e}')
+
+        sweeper = threading.Thread(target=sweep_periodically, daemon=True)
+        sweeper.start()
+        return sweeper
+
+    def get_size(self, session_id: str):
+        """Size in bytes (as JSON) of a session in memory, None when it's on disk or unknown."""
+        with self.lock:
+            session = self.sessions.get(session_id)
+        return session[1] if session is not None else None
+
+    def get_report(self, limit: int = 20):
+        """Memory use of the store, and of the limit largest sessions (in memory or on disk)."""
+        now = time.monotonic()
+        with self.lock:
+            sessions = [{'session_id': session_id, 'location': 'memory', 'bytes': size,
+                         'idle_seconds': round(now - last_used, 1)}
+                        for session_id, (_, size, last_used) in self.sessions.items()]
+            sessions += [{'session_id': session_id, 'location': 'disk', 'bytes': size, 'idle_seconds': None}
+                         for session_id, (size, _) in self.spilled.items()]
+            report = {'sessions_in_memory': len(self.sessions),
+                      'bytes_in_memory': self.memory_bytes,
+                      'max_bytes': self.max_bytes,
+                      'sessions_on_disk': len(self.spilled),
+                      'bytes_on_disk': sum(size for size, _ in self.spilled.values())}
+        report['largest_sessions'] = sorted(sessions, key=lambda session: -session['bytes'])[:limit]
+        return report
+
+    # called with the lock held
+    def touch(self, session_id: str):
+        # the message list of a session in memory (or being spilled, it stays in memory then), None otherwise
+        session = self.sessions.get(session_id)
+        if session is None:
+            spilling = self.spilling.pop(session_id, None)
+            if spilling is None:
+                return None
+            session = spilling[:2] + (None,)
+            self.memory_bytes += session[1]
+        self.sessions[session_id] = (session[0], session[1], time.monotonic())
+        self.sessions.move_to_end(session_id)
+        return session[0]
+
+    # called with the lock held
+    def take(self, session_id: str):
+        # moves a session from memory to the sessions being spilled, spill() writes it after the lock is released
+        message_list, size, _ = self.sessions.pop(session_id)
+        self.memory_bytes -= size
+        spilling = (message_list, size, next(self.spill_numbers))
+        self.spilling[session_id] = spilling
+        return session_id, spilling
+
+    # called with the lock held
+    def take_over_budget(self, keep_id: str):
+        # over budget: the least recently used sessions go to disk, never the one just stored or read back
+        to_spill = []
+        for least_recent_id in list(self.sessions):
+            if self.memory_bytes <= self.max_bytes:
+                break
+            if least_recent_id != keep_id:
+                to_spill.append(self.take(least_recent_id))
+        return to_spill
+
+    def spill(self, to_spill: list):
+        # called without the lock: serialize and write every session, then record it as spilled
+        spilled_count = 0
+        for session_id, spilling in to_spill:
+            message_list, size, spill_number = spilling
+            spill_path = self.get_spill_path(session_id)
+            temp_path = f'{spill_path}.{spill_number}.tmp'
+            try:
+                record = gzip.compress(json.dumps(message_list, ensure_ascii=False, default=str).encode('utf-8'))
+                with open(temp_path, 'wb') as spill_file:
+                    spill_file.write(record)
+            except OSError as e:
+                print(f'Could not spill session {session_id}, keeping it in memory: {e}')
+                record = None
+
+            with self.lock:
+                is_current = self.spilling.get(session_id) is spilling
+                if is_current:
+                    del self.spilling[session_id]
+                    if record is not None:
+                        try:
+                            os.replace(temp_path, spill_path)  # a crash never leaves half a session
+                            self.spilled[session_id] = (len(record), spill_number)
+                            self.measured.pop(session_id, None)
+                            spilled_count += 1
+                        except OSError as e:
+                            print(f'Could not spill session {session_id}, keeping it in memory: {e}')
+                            record = None
+                    if record is None:
+                        self.sessions[session_id] = (message_list, size, time.monotonic())
+                        self.memory_bytes += size
+                    self.update_metrics()
+            if not is_current and record is not None:  # stored, read back or removed while it was written
+                try:
+                    os.remove(temp_path)
+                except OSError:
+                    pass
+        return spilled_count
+
+    def read_spill(self, session_id: str):
+        # called without the lock: the message list of a spilled session and its measurement (see measure)
+        with open(self.get_spill_path(session_id), 'rb') as spill_file:
+            content = gzip.decompress(spill_file.read())
+        message_list = json.loads(content)
+        last_hash = hash_message(message_list[-1]) if message_list else None
+        return message_list, (len(message_list), last_hash, len(content))
+
+    # called with the lock held
+    def forget(self, session_id: str):
+        session = self.sessions.pop(session_id, None)
+        if session is not None:
+            self.memory_bytes -= session[1]
+        self.spilling.pop(session_id, None)  # spill() drops what it wrote
+        self.measured.pop(session_id, None)
+        if self.spilled.pop(session_id, None) is not None:
+            try:
+                os.remove(self.get_spill_path(session_id))
+            except OSError:
+                pass
+
+    def get_spill_path(self, session_id: str):
+        # session ids come from the browser, they are never used in a path as they are
+        return os.path.join(self.spill_folder, hashlib.sha1(session_id.encode('utf-8')).hexdigest() + SPILL_EXTENSION)
+
+    def update_metrics(self):
+        SESSION_STORE_BYTES.labels(self.name, 'memory').set(self.memory_bytes)
+        SESSION_STORE_SESSIONS.labels(self.name, 'memory').set(len(self.sessions))
+        SESSION_STORE_SESSIONS.labels(self.name, 'disk').set(len(self.spilled))
+
+
+def measure(message_list: list, measurement: tuple = None):
+    """
+    (message count, hash of the last message, size) of a message list, its size is the length of its JSON.
+    Continues a previous measurement of the same list when it only grew, otherwise measures the whole list.
+    """
+    count, last_hash, size = measurement if measurement is not None else (0, None, 2)  # '[]'
+    if count > len(message_list) or (count > 0 and hash_message(message_list[count - 1]) != last_hash):
+        count, last_hash, size = 0, None, 2  # cleared, replaced or edited
+    if count == len(message_list):
+        return measurement if count > 0 else (0, None, 2)
+
+    for message in message_list[count:]:
+        separator = 2 if count > 0 else 0  # ', ' as in json.dumps
+        size += separator + len(json.dumps(message, ensure_ascii=False, default=str).encode('utf-8'))
+        count += 1
+    return count, hash_message(message_list[-1]), size
+
+
+def remove_spilled_sessions(spill_folder: str):
+    for file_name in os.listdir(spill_folder):
+        if file_name.endswith((SPILL_EXTENSION, '.tmp')):
+            try:
+                os.remove(os.path.join(spill_folder, file_name))
+            except OSError as e:
+                print(f'Could not remove {file_name}: {e}')
+
+
+def get_mtime(path: str):
+    try:
+        return os.path.getmtime(path)
+    except OSError:
+        return 0
@@ -0,0 +1,54 @@
+import time
+
+DEFAULT_FLUSH_INTERVAL = 0.05  # seconds, about 20 UI updates per second at most
+DEFAULT_FLUSH_EVERY = 32  # deltas (roughly tokens), for very fast models
+
+
+class StreamAggregator:
+    """Buffers the text deltas of a streamed completion, so the UI is only updated every so often."""
+    flush_interval: float
+    flush_every: int
+
+    def __init__(self, flush_interval: float = DEFAULT_FLUSH_INTERVAL, flush_every: int = DEFAULT_FLUSH_EVERY):
+        self.flush_interval = flush_interval
+        self.flush_every = flush_every
+        self.text = ''  # text up to the last flush
+        self.pending = []  # deltas since the last flush
+        self.last_flush = None  # None: the first delta is flushed right away
+
+    def add(self, delta: str):
+        """Buffer a delta, returns True when it is time to flush."""
+        if not delta:
+            return False
+        self.pending.append(delta)
+        if self.last_flush is None or len(self.pending) >= self.flush_every:
+            return True
+        return time.monotonic() - self.last_flush >= self.flush_interval
+
+    def flush(self):
+        """Return the complete text so far."""
+        if self.pending:
+            self.text = self.text + ''.join(self.pending)
+            self.pending = []
+        self.last_flush = time.monotonic()
+        return self.text
+
+    def has_pending(self):
+        return len(self.pending) > 0
+
+
+def coalesce_deltas(deltas, flush_interval: float = DEFAULT_FLUSH_INTERVAL, flush_every: int = DEFAULT_FLUSH_EVERY):
+    """Generator turning text deltas into a coalesced stream of partial messages, the last one is the full text."""
+    aggregator = StreamAggregator(flush_interval, flush_every)
+    for delta in deltas:
+        if aggregator.add(delta):
+            yield aggregator.flush()
+    if aggregator.has_pending():
+        yield aggregator.flush()
+
+
+# helper method: the text deltas of an OpenAI compatible completions stream
+def get_text_deltas(response_stream):
+    for chunk in response_stream:
+        if len(chunk.choices) > 0 and chunk.choices[0].delta.content is not None:
+            yield chunk.choices[0].delta.content
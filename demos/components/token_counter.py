@@ -0,0 +1,125 @@
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+
+try:
+    import tiktoken
+except ImportError:  # not every app installs tiktoken, fall back to an estimate
+    tiktoken = None
+
+DEFAULT_ENCODING_MODEL = 'gpt-4'
+TOKENS_PER_MESSAGE = 4  # role and separators, see the OpenAI cookbook
+
+
+@lru_cache(maxsize=None)
+def get_encoder(model_name: str = DEFAULT_ENCODING_MODEL):
+    # loading an encoder is expensive, so every encoder is loaded only once per process
+    if tiktoken is None:
+        return None
+    try:
+        return tiktoken.encoding_for_model(model_name)
+    except KeyError:
+        return tiktoken.get_encoding('o200k_base')
+
+
+class TokenCounter:
+    model_name: str
+    max_cached_messages: int
+
+    def __init__(self, model_name: str = DEFAULT_ENCODING_MODEL, max_cached_messages: int = 20000):
+        self.model_name = model_name
+        self.max_cached_messages = max_cached_messages
+        self.by_hash = OrderedDict()  # hash of the message -> count, no references to the messages themselves
+        self.lock = threading.Lock()
+
+    def count_text(self, text: str):
+        if not text:
+            return 0
+        encoder = get_encoder(self.model_name)
+        if encoder is None:
+            return len(text) // 4
+        return len(encoder.encode(text, disallowed_special=()))
+
+    def count_message(self, message: dict):
+        content = message.get('content')
+        message_hash = hash_message(message)
+        with self.lock:
+            count = self.by_hash.get(message_hash)
+            if count is not None:
+                self.by_hash.move_to_end(message_hash)
+
+        if count is None:
+            count = TOKENS_PER_MESSAGE + self.count_text(content_to_text(content))
+            if message.get('tool_calls'):
+                count += self.count_text(json.dumps(message['tool_calls']))
+
+        with self.lock:
+            self.by_hash[message_hash] = count
+            if len(self.by_hash) > self.max_cached_messages:
+                self.by_hash.popitem(last=False)
+        return count
+
+    def count_messages(self, message_list: list):
+        return sum(self.count_message(m) for m in message_list)
+
+
+class TokenTally:
+    """
+    Running token totals for one growing message list (keep one per conversation, e.g. in a gr.State),
+    only the appended messages are counted. A list that doesn't continue the counted one is counted again.
+    """
+
+    def __init__(self, token_counter: TokenCounter = None):
+        self.token_counter = token_counter  # None: the shared counter, looked up when needed (a State is copied)
+        self.reset()
+
+    def reset(self):
+        self.counted_messages = 0
+        self.last_message = None  # hash of the last counted message
+        self.total = 0
+        self.per_role = {}
+        self.message_counts = []  # the count of every message, in the order of the list
+
+    def update(self, message_list: list):
+        """The total of message_list, O(new messages) when it continues the list of the previous update."""
+        if (len(message_list) < self.counted_messages
+                or (self.counted_messages > 0
+                    and hash_message(message_list[self.counted_messages - 1]) != self.last_message)):
+            self.reset()  # the list was cleared, replaced or edited
+
+        token_counter = self.token_counter if self.token_counter is not None else shared_token_counter
+        for message in message_list[self.counted_messages:]:
+            count = token_counter.count_message(message)
+            role = message.get('role', 'unknown')
+            self.per_role[role] = self.per_role.get(role, 0) + count
+            self.total += count
+            self.message_counts.append(count)
+        if len(message_list) > self.counted_messages:
+            self.last_message = hash_message(message_list[-1])
+        self.counted_messages = len(message_list)
+        return self.total
+
+    def get_count(self, role: str):
+        return self.per_role.get(role, 0)
+
+
+# helper method: multimodal messages have a list of content parts
+def content_to_text(content):
+    if content is None:
+        return ''
+    if isinstance(content, str):
+        return content
+    if isinstance(content, list):
+        return ' '.join(part.get('text', '') for part in content if isinstance(part, dict))
+    return str(content)
+
+
+def hash_message(message: dict):
+    message_string = json.dumps(message, sort_keys=True, default=str)
+    return hashlib.blake2b(message_string.encode('utf-8'), digest_size=16).digest()
+
+
+# one counter (and cache) for the whole process
+shared_token_counter = TokenCounter()
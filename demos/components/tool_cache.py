@@ -0,0 +1,183 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+MINUTE = 60
+HOUR = 60 * MINUTE
+DAY = 24 * HOUR
+
+# time-to-live (in seconds) for tools whose results can safely be reused
+DEFAULT_TOOL_TTLS = {
+    'search_on_google': 6 * HOUR,
+    'get_webpage_content': HOUR,
+    'get_webpage_with_js': HOUR,
+    'lookup_in_documentation': 15 * MINUTE,  # documents can be uploaded at any time
+}
+
+# tools with side effects, these are never cached
+SIDE_EFFECT_TOOLS = {
+    'write_file_contents',
+    'append_file_contents',
+    'create_folders',
+    'delete_file',
+    'delete_folder',
+}
+
+DEFAULT_CACHE_FILE = './cache/tool_cache.sqlite'
+
+
+def make_cache_key(fn_name: str, fn_args: dict):
+    # canonical JSON: sorted keys and no whitespace, so equal arguments give equal keys
+    canonical_args = json.dumps(fn_args, sort_keys=True, separators=(',', ':'), ensure_ascii=False)
+    return hashlib.sha256(f'{fn_name}:{canonical_args}'.encode('utf-8')).hexdigest()
+
+
+def is_cacheable_result(fn_result):
+    # None, an empty result or an {'error': ...} is (likely) a failure, e.g. a store or site that was down
+    if fn_result is None:
+        return False
+    if isinstance(fn_result, (list, dict, str)) and len(fn_result) == 0:
+        return False
+    return not (isinstance(fn_result, dict) and 'error' in fn_result)
+
+
+class ToolCache:
+    tool_ttls: dict
+    excluded_tools: set
+    max_memory_entries: int
+    max_disk_entries: int
+
+    def __init__(self,
+                 tool_ttls: dict = None,
+                 excluded_tools: set = None,
+                 cache_file: str = DEFAULT_CACHE_FILE,
+                 max_memory_entries: int = 256,
+                 max_disk_entries: int = 4096):
+        if tool_ttls is None:
+            tool_ttls = DEFAULT_TOOL_TTLS
+        if excluded_tools is None:
+            excluded_tools = SIDE_EFFECT_TOOLS
+
+        overlap = set(tool_ttls.keys()) & set(excluded_tools)
+        if len(overlap) > 0:
+            raise ValueError(f'Tools with side effects cannot be cached: {sorted(overlap)}')
+
+        self.tool_ttls = dict(tool_ttls)
+        self.excluded_tools = set(excluded_tools)
+        self.max_memory_entries = max_memory_entries
+        self.max_disk_entries = max_disk_entries
+
+        self.memory = OrderedDict()  # key -> (expires_at, json_value), in LRU order
+        self.lock = threading.Lock()
+        self.db = None
+        if cache_file is not None:
+            self.db = open_cache_db(cache_file)
+
+    def is_cacheable(self, fn_name: str):
+        return fn_name in self.tool_ttls and fn_name not in self.excluded_tools
+
+    def call(self, fn_name: str, fn_pointer, fn_args: dict):
+        if not self.is_cacheable(fn_name):
+            return fn_pointer(**fn_args)
+
+        key = make_cache_key(fn_name, fn_args)
+        json_value = self.get(key)
+        if json_value is not None:
+            print(f'\t  (cached result for {fn_name})')
+            return json.loads(json_value)
+
+        fn_result = fn_pointer(**fn_args)
+        if is_cacheable_result(fn_result):  # failed calls are tried again next time
+            self.put(key, fn_name, json.dumps(fn_result))
+        return fn_result
+
+    def get(self, key: str):
+        now = time.time()
+        with self.lock:
+            entry = self.memory.get(key)
+            if entry is not None:
+                expires_at, json_value = entry
+                if expires_at > now:
+                    self.memory.move_to_end(key)
+                    return json_value
+                del self.memory[key]
+
+            if self.db is None:
+                return None
+
+            row = self.db.execute('SELECT expires_at, value FROM tool_cache WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                return None
+            expires_at, json_value = row
+            if expires_at <= now:
+                self.db.execute('DELETE FROM tool_cache WHERE key = ?', (key,))
+                self.db.commit()
+                return None
+
+            self.remember(key, expires_at, json_value)  # promote to memory
+            return json_value
+
+    def put(self, key: str, fn_name: str, json_value: str):
+        now = time.time()
+        expires_at = now + self.tool_ttls[fn_name]
+        with self.lock:
+            self.remember(key, expires_at, json_value)
+
+            if self.db is None:
+                return
+            self.db.execute('INSERT OR REPLACE INTO tool_cache (key, tool, stored_at, expires_at, value) '
+                            'VALUES (?, ?, ?, ?, ?)',
+                            (key, fn_name, now, expires_at, json_value))
+            self.prune_disk(now)
+            self.db.commit()
+
+    def clear(self, fn_name: str = None):
+        with self.lock:
+            if fn_name is None:
+                self.memory.clear()
+                if self.db is not None:
+                    self.db.execute('DELETE FROM tool_cache')
+            else:
+                # memory entries are not labeled per tool, simply start over
+                self.memory.clear()
+                if self.db is not None:
+                    self.db.execute('DELETE FROM tool_cache WHERE tool = ?', (fn_name,))
+            if self.db is not None:
+                self.db.commit()
+
+    # helper method, expects the lock to be held
+    def remember(self, key, expires_at, json_value):
+        self.memory[key] = (expires_at, json_value)
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.max_memory_entries:
+            self.memory.popitem(last=False)  # least recently used
+
+    # helper method, expects the lock to be held
+    def prune_disk(self, now):
+        self.db.execute('DELETE FROM tool_cache WHERE expires_at <= ?', (now,))
+        (entry_count,) = self.db.execute('SELECT COUNT(*) FROM tool_cache').fetchone()
+        if entry_count > self.max_disk_entries:
+            self.db.execute('DELETE FROM tool_cache WHERE key IN '
+                            '(SELECT key FROM tool_cache ORDER BY stored_at ASC LIMIT ?)',
+                            (entry_count - self.max_disk_entries,))
+
+
+def open_cache_db(cache_file):
+    cache_folder = os.path.dirname(cache_file)
+    if cache_folder and not os.path.exists(cache_folder):
+        os.makedirs(cache_folder)
+
+    db = sqlite3.connect(cache_file, check_same_thread=False)  # access is guarded by ToolCache.lock
+    db.execute('CREATE TABLE IF NOT EXISTS tool_cache ('
+               'key TEXT PRIMARY KEY, '
+               'tool TEXT NOT NULL, '
+               'stored_at REAL NOT NULL, '
+               'expires_at REAL NOT NULL, '
+               'value TEXT NOT NULL)')
+    db.execute('CREATE INDEX IF NOT EXISTS idx_tool_cache_stored_at ON tool_cache (stored_at)')
+    db.commit()
+    return db
@@ -0,0 +1,268 @@
+import contextvars
+import json
+import os
+import queue
+import secrets
+import threading
+import time
+import urllib.request
+
+# Tracing is off unless TRACING_EXPORT is set in the environment (or .env file):
+#   TRACING_EXPORT=jsonl  spans are appended to TRACING_FILE (default ./traces/spans.jsonl)
+#   TRACING_EXPORT=otlp   spans are sent to an OpenTelemetry collector (OTLP/HTTP with JSON encoding),
+#                         at OTEL_EXPORTER_OTLP_ENDPOINT (default http://localhost:4318)
+DEFAULT_TRACE_FILE = './traces/spans.jsonl'
+DEFAULT_OTLP_ENDPOINT = 'http://localhost:4318'
+
+STATUS_OK = 'ok'
+STATUS_ERROR = 'error'
+STATUS_CANCELLED = 'cancelled'
+
+# the span of the tool call being executed, for spans deeper down (e.g. in query_store) that have no parent passed in;
+# only set around synchronous code, because context variables don't follow a generator across its yields
+current_span = contextvars.ContextVar('current_span', default=None)
+
+
+class Span:
+    name: str
+    trace_id: str
+    span_id: str
+    parent_id: str
+
+    def __init__(self, tracer, name: str, trace_id: str, parent_id: str = None, attributes: dict = None):
+        self.tracer = tracer
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent_id
+        self.attributes = dict(attributes) if attributes else {}
+        self.status = STATUS_OK
+        self.start_time = time.time()
+        self.end_time = None
+
+    def set_attribute(self, key: str, value):
+        self.attributes[key] = value
+
+    def set_attributes(self, attributes: dict):
+        self.attributes.update(attributes)
+
+    def record_error(self, error: Exception):
+        self.status = STATUS_ERROR
+        self.attributes['error.type'] = type(error).__name__
+        self.attributes['error.message'] = str(error)
+
+    def end(self, status: str = None):
+        if self.end_time is not None:
+            return  # ended already
+        if status is not None:
+            self.status = status
+        self.end_time = time.time()
+        self.tracer.export(self)
+
+    def to_dict(self):
+        return {'trace_id': self.trace_id,
+                'span_id': self.span_id,
+                'parent_id': self.parent_id,
+                'name': self.name,
+                'start': self.start_time,
+                'end': self.end_time,
+                'duration_ms': round((self.end_time - self.start_time) * 1000, 2),
+                'status': self.status,
+                'attributes': self.attributes}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is GeneratorExit:
+            self.end(STATUS_CANCELLED)  # a streaming generator was closed, e.g. the user left the page
+            return False
+        if exc_value is not None:
+            self.record_error(exc_value)
+        self.end()
+        return False
+
+
+class NoOpSpan:
+    """Returned by a disabled tracer, every method does nothing."""
+    span_id = None
+
+    def set_attribute(self, key: str, value):
+        pass
+
+    def set_attributes(self, attributes: dict):
+        pass
+
+    def record_error(self, error: Exception):
+        pass
+
+    def end(self, status: str = None):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+NO_OP_SPAN = NoOpSpan()
+
+
+class Tracer:
+    exporter: object
+
+    def __init__(self, exporter=None):
+        self.exporter = exporter  # None: tracing disabled
+
+    def start_span(self, name: str, parent=None, attributes: dict = None):
+        """Start a span, a child of parent when given (a Span), or of the current tool call span."""
+        if self.exporter is None:
+            return NO_OP_SPAN
+        if parent is None:
+            parent = current_span.get()
+        if parent is None or parent is NO_OP_SPAN:
+            return Span(self, name, secrets.token_hex(16), attributes=attributes)
+        return Span(self, name, parent.trace_id, parent.span_id, attributes)
+
+    def is_enabled(self):
+        return self.exporter is not None
+
+    def export(self, span: Span):
+        self.exporter.export(span)
+
+    def close(self):
+        if self.exporter is not None:
+            self.exporter.close()
+
+
+class JsonlSpanExporter:
+    def __init__(self, trace_file: str = DEFAULT_TRACE_FILE):
+        trace_folder = os.path.dirname(trace_file)
+        if trace_folder and not os.path.exists(trace_folder):
+            os.makedirs(trace_folder)
+        self.trace_file = open(trace_file, 'at', encoding='utf-8')
+        self.lock = threading.Lock()
+
+    def export(self, span: Span):
+        line = json.dumps(span.to_dict(), default=str) + '\n'
+        with self.lock:
+            self.trace_file.write(line)
+            self.trace_file.flush()
+
+    def close(self):
+        with self.lock:
+            self.trace_file.close()
+
+
+class OtlpSpanExporter:
+    """Sends spans in batches from a background thread, so a slow collector doesn't slow down the app."""
+
+    def __init__(self,
+                 endpoint: str = DEFAULT_OTLP_ENDPOINT,
+                 service_name: str = 'pixie',
+                 batch_size: int = 128,
+                 flush_interval: float = 2.0,
+                 max_queue_size: int = 4096):
+        self.traces_url = f'{endpoint.rstrip("/")}/v1/traces'
+        self.service_name = service_name
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.span_queue = queue.Queue(maxsize=max_queue_size)
+        self.dropped_spans = 0
+        self.sender = threading.Thread(target=self.send_batches, daemon=True)
+        self.sender.start()
+
+    def export(self, span: Span):
+        try:
+            self.span_queue.put_nowait(span)
+        except queue.Full:
+            self.dropped_spans += 1  # never block the app for tracing
+
+    def send_batches(self):
+        while True:
+            batch = [self.span_queue.get()]
+            if batch[0] is None:
+                return
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size and time.monotonic() < deadline:
+                try:
+                    span = self.span_queue.get(timeout=max(deadline - time.monotonic(), 0.01))
+                except queue.Empty:
+                    break
+                if span is None:
+                    self.post(batch)
+                    return
+                batch.append(span)
+            self.post(batch)
+
+    def post(self, spans: list):
+        body = json.dumps(to_otlp_json(spans, self.service_name)).encode('utf-8')
+        post_request = urllib.request.Request(self.traces_url, data=body, method='POST',
+                                              headers={'Content-Type': 'application/json'})
+        try:
+            with urllib.request.urlopen(post_request, timeout=5) as response:
+                response.read()
+        except OSError as e:
+            print(f'Could not send {len(spans)} spans to {self.traces_url}: {e}')
+
+    def close(self):
+        self.span_queue.put(None)
+        self.sender.join(timeout=5)
+
+
+def to_otlp_json(spans: list, service_name: str):
+    otlp_spans = []
+    for span in spans:
+        otlp_span = {'traceId': span.trace_id,
+                     'spanId': span.span_id,
+                     'name': span.name,
+                     'kind': 1,  # internal
+                     'startTimeUnixNano': str(int(span.start_time * 1e9)),
+                     'endTimeUnixNano': str(int(span.end_time * 1e9)),
+                     'attributes': [to_otlp_attribute(k, v) for k, v in span.attributes.items() if v is not None],
+                     'status': {'code': 2 if span.status == STATUS_ERROR else 1}}
+        if span.parent_id is not None:
+            otlp_span['parentSpanId'] = span.parent_id
+        otlp_spans.append(otlp_span)
+
+    return {'resourceSpans': [{
+        'resource': {'attributes': [to_otlp_attribute('service.name', service_name)]},
+        'scopeSpans': [{'scope': {'name': 'demos.components.tracing'}, 'spans': otlp_spans}]
+    }]}
+
+
+def to_otlp_attribute(key: str, value):
+    if isinstance(value, bool):
+        return {'key': key, 'value': {'boolValue': value}}
+    if isinstance(value, int):
+        return {'key': key, 'value': {'intValue': str(value)}}
+    if isinstance(value, float):
+        return {'key': key, 'value': {'doubleValue': value}}
+    if isinstance(value, (list, tuple)):
+        return {'key': key, 'value': {'stringValue': ', '.join(str(v) for v in value)}}
+    return {'key': key, 'value': {'stringValue': str(value)}}
+
+
+def make_tracer_from_env():
+    export = os.getenv('TRACING_EXPORT', '').lower()
+    if export == 'jsonl':
+        return Tracer(JsonlSpanExporter(os.getenv('TRACING_FILE', DEFAULT_TRACE_FILE)))
+    if export == 'otlp':
+        return Tracer(OtlpSpanExporter(os.getenv('OTEL_EXPORTER_OTLP_ENDPOINT', DEFAULT_OTLP_ENDPOINT),
+                                       service_name=os.getenv('OTEL_SERVICE_NAME', 'pixie')))
+    return Tracer()
+
+
+tracer_lock = threading.Lock()
+shared_tracer = None
+
+
+def get_tracer():
+    # created on first use, because the apps load their .env file after the imports
+    global shared_tracer
+    if shared_tracer is None:
+        with tracer_lock:
+            if shared_tracer is None:
+                shared_tracer = make_tracer_from_env()
+    return shared_tracer
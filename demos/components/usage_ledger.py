@@ -0,0 +1,143 @@
+import json
+import os
+import threading
+import time
+
+from demos.components.open_router_client import get_usage_summary
+
+DEFAULT_LEDGER_FILE = './usage/usage_ledger.jsonl'
+TOTALS_EXTENSION = '.totals.json'  # snapshot of the totals, next to the ledger
+SNAPSHOT_INTERVAL = 1000  # records between two snapshots (once the totals are loaded)
+USAGE_FIELDS = ['requests', 'prompt_tokens', 'cached_prompt_tokens', 'completion_tokens', 'cost']
+
+
+class UsageLedger:
+    """
+    Append only JSONL file with the usage of every request, and running totals per user, session and model.
+    The totals are only loaded when a report needs them: from a snapshot and the records added after it.
+    """
+    ledger_file: str
+
+    def __init__(self, ledger_file: str = DEFAULT_LEDGER_FILE):
+        self.ledger_file = ledger_file
+        self.totals_file = ledger_file + TOTALS_EXTENSION
+        self.lock = threading.Lock()
+        self.totals = None  # (user, session, model) -> running totals since the ledger was created, see load_totals
+        self.unsaved_records = 0
+
+        ledger_folder = os.path.dirname(ledger_file)
+        if ledger_folder and not os.path.exists(ledger_folder):
+            os.makedirs(ledger_folder)
+
+        self.ledger = open(ledger_file, 'at', encoding='utf-8')  # append only
+
+    def record(self, usage, model: str, user: str = None, session: str = None, cost: float = None):
+        """Store the usage block of one request, returns the stored record."""
+        usage_summary = get_usage_summary(usage)
+        if usage_summary is None:
+            return None
+        if cost is not None:
+            usage_summary['cost'] = cost  # for providers that don't report a cost themselves
+
+        record = {'ts': round(time.time(), 3),
+                  'user': user or 'anonymous',
+                  'session': session or '',
+                  'model': model}
+        record.update(usage_summary)
+        line = json.dumps(record) + '\n'
+        with self.lock:
+            self.ledger.write(line)
+            self.ledger.flush()
+            if self.totals is not None:
+                self.add_to_totals(record)
+                self.unsaved_records += 1
+                if self.unsaved_records >= SNAPSHOT_INTERVAL:
+                    self.save_totals()
+        return record
+
+    def aggregate(self, group_by=('user', 'model'), user: str = None, since: float = None):
+        """Sum the usage per group, e.g. group_by=('model',) for the cost per model."""
+        if since is None:
+            with self.lock:
+                self.load_totals()
+                rows = [dict(zip(('user', 'session', 'model'), key), **values) for key, values in self.totals.items()]
+        else:
+            rows = [r for r in self.read_records() if r['ts'] >= since]  # needs a pass over the ledger
+
+        groups = {}
+        for row in rows:
+            if user is not None and row['user'] != user:
+                continue
+            group_key = tuple(row[g] for g in group_by)
+            group = groups.setdefault(group_key, dict.fromkeys(USAGE_FIELDS, 0))
+            for field in USAGE_FIELDS:
+                group[field] += row.get(field, 1 if field == 'requests' else 0) or 0
+
+        return [dict(zip(group_by, key), **values) for key, values in groups.items()]
+
+    def read_records(self, offset: int = 0, end: int = None):
+        if not os.path.exists(self.ledger_file):
+            return
+        with open(self.ledger_file, 'rb') as ledger:
+            ledger.seek(offset)
+            for line in ledger:
+                offset += len(line)
+                if end is not None and offset > end:
+                    break
+                try:
+                    yield json.loads(line)
+                except (json.JSONDecodeError, UnicodeDecodeError):
+                    continue  # e.g. a partial line after a crash
+
+    # helper method, expects the lock to be held
+    def load_totals(self):
+        if self.totals is not None:
+            return
+        end = os.path.getsize(self.ledger_file)  # the ledger is flushed after every record
+        totals, offset = read_totals_snapshot(self.totals_file, end)
+        self.totals = totals
+        for record in self.read_records(offset, end):
+            self.add_to_totals(record)
+            self.unsaved_records += 1
+        if self.unsaved_records > 0:
+            self.save_totals()
+
+    # helper method, expects the lock to be held
+    def save_totals(self):
+        snapshot = {'offset': os.path.getsize(self.ledger_file),
+                    'totals': [list(key) + [values] for key, values in self.totals.items()]}
+        try:
+            with open(self.totals_file + '.tmp', 'wt', encoding='utf-8') as totals_file:
+                json.dump(snapshot, totals_file)
+            os.replace(self.totals_file + '.tmp', self.totals_file)
+            self.unsaved_records = 0
+        except OSError as e:
+            print(f'Could not save the usage totals: {e}')
+
+    # helper method, expects the lock to be held
+    def add_to_totals(self, record):
+        key = (record['user'], record['session'], record['model'])
+        totals = self.totals.setdefault(key, dict.fromkeys(USAGE_FIELDS, 0))
+        totals['requests'] += 1
+        for field in USAGE_FIELDS[1:]:
+            totals[field] += record.get(field) or 0
+
+    def close(self):
+        with self.lock:
+            if self.totals is not None and self.unsaved_records > 0:
+                self.save_totals()
+            self.ledger.close()
+
+
+def read_totals_snapshot(totals_file: str, ledger_size: int):
+    # the totals and the ledger offset they cover, empty totals from the start when there is no usable snapshot
+    try:
+        with open(totals_file, 'rt', encoding='utf-8') as snapshot_file:
+            snapshot = json.load(snapshot_file)
+        if snapshot['offset'] <= ledger_size:  # else the ledger was replaced or truncated
+            return {tuple(row[:3]): row[3] for row in snapshot['totals']}, snapshot['offset']
+    except FileNotFoundError:
+        pass
+    except (OSError, ValueError, KeyError, TypeError) as e:
+        print(f'Could not read the usage totals, rebuilding them from the ledger: {e}')
+    return {}, 0
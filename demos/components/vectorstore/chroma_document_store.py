@@ -1,4 +1,5 @@
 import sys
+import time
 
 import chromadb
 from tqdm import tqdm
@@ -6,6 +7,8 @@ from tqdm import tqdm
 sys.path.append('../')
 sys.path.append('../../')
 
+from demos.components.metrics import QUERY_STORE_TIME, collection_count_label
+from demos.components.tracing import get_tracer
 from demos.components.vectorstore.vs_utilities import (sanitize_filename,
                                                        doc_to_chunks,
                                                        repack_query_results,
@@ -53,16 +56,23 @@ class ChromaDocumentStore:
         return self.cdb_client.list_collections()
 
     def query_store(self, query: str, amount: int = 5):
+        start_time = time.monotonic()
+        tracer = get_tracer()
         collection_names = self.cdb_client.list_collections()
         all_results = []
         for coll_name in collection_names:
-            collection = self.cdb_client.get_collection(coll_name)
-            result = collection.query(
-                query_texts=[query],
-                n_results=amount,
-            )
-            repacked = repack_query_results(result)
+            with tracer.start_span('query_collection', attributes={'collection': coll_name,
+                                                                   'n_results': amount}) as span:
+                collection = self.cdb_client.get_collection(coll_name)
+                result = collection.query(
+                    query_texts=[query],
+                    n_results=amount,
+                )
+                repacked = repack_query_results(result)
+                span.set_attribute('results', len(repacked))
             all_results = all_results + repacked
 
+        QUERY_STORE_TIME.labels(collection_count_label(len(collection_names))).observe(time.monotonic() - start_time)
+
         # sort results by distance
         return sorted(all_results, key=lambda r: r['distances'])
@@ -1,27 +1,35 @@
 import base64
+import os
+import sys
+from collections import OrderedDict
+from functools import lru_cache
 from typing import Dict, List, Any, Tuple
 
 import pandas as pd
 import requests
-from thefuzz import fuzz
+from rapidfuzz import fuzz, process
+
+sys.path.append('../../')
+
+from demos.components.model_catalog import get_model_catalog
 
 
 def get_image_capable_models() -> List[Dict[str, Any]]:
     """
     Fetches models from OpenRouter API that support both text and image inputs.
     Filters out experimental, free, and expensive models.
+    The model list is shared with the model choice demo, and only downloaded again when it has changed.
     """
-    models_url = 'https://openrouter.ai/api/v1/models'
-    try:
-        response = requests.get(models_url)
-        response.raise_for_status()
-        model_list = response.json()
-    except requests.exceptions.RequestException as e:
-        print(f"Error fetching models from OpenRouter: {e}")
-        return []
+    filtered_models = get_model_catalog().get_derived('image_capable', filter_image_capable_models)
+    return [dict(model) for model in filtered_models]  # copies, callers add their scores to them
+
 
+def filter_image_capable_models(models: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Keeps the models that support both text and image inputs, at a reasonable price.
+    """
     filtered_models = []
-    for model in model_list.get('data', []):
+    for model in models:
         # Skip if model id contains indicators of experimental or free models
         if any(term in model['id'] for term in ['beta', '-exp', ':free']):
             continue
@@ -59,19 +67,10 @@ def get_image_capable_models() -> List[Dict[str, Any]]:
 def load_model_scores(csv_path="./lmarena_vision_250616.csv") -> Dict[str, float]:
     """
     Loads model scores from a CSV file and returns a dictionary mapping
-    model identifiers to their scores.
+    model identifiers to their scores. The file is only read again when it has changed.
     """
     try:
-        df = pd.read_csv(csv_path, sep=';', encoding='utf-8')
-        score_map = {}
-        for _, row in df.iterrows():
-            organization = str(row["Organization"]).lower()
-            model_name = str(row["Model"])
-            score = float(row["Score"])
-            # Construct key as "organization/model"
-            key = f"{organization}/{model_name}"
-            score_map[key] = score
-        return score_map
+        return read_model_scores(csv_path, os.path.getmtime(csv_path))
     except FileNotFoundError:
         print(f"Error: CSV file not found at {csv_path}")
         return {}
@@ -80,6 +79,71 @@ def load_model_scores(csv_path="./lmarena_vision_250616.csv") -> Dict[str, float
         return {}
 
 
+@lru_cache(maxsize=8)
+def read_model_scores(csv_path: str, modification_time: float) -> Dict[str, float]:
+    df = pd.read_csv(csv_path, sep=';', encoding='utf-8', usecols=["Organization", "Model", "Score"])
+    # Construct keys as "organization/model"
+    keys = df["Organization"].astype(str).str.lower() + "/" + df["Model"].astype(str)
+    return dict(zip(keys, df["Score"].astype(float)))
+
+
+class ModelScoreIndex:
+    """
+    Matches OpenRouter model ids to the keys of a score map: an exact lookup on normalised keys first,
+    then a fuzzy match in C (rapidfuzz). Every resolved model id is remembered.
+    """
+
+    def __init__(self, score_map: Dict[str, float]):
+        self.score_map = score_map
+        self.normalised_keys = {}
+        for key in score_map:
+            self.normalised_keys.setdefault(normalise_model_key(key), key)
+        self.keys = list(score_map.keys())
+        self.resolved = {}  # (model id, threshold) -> matching key of the score map, or None
+
+    def find_key(self, model_id: str, fuzzy_match_threshold: int = 80):
+        memo_key = (model_id, fuzzy_match_threshold)
+        if memo_key in self.resolved:
+            return self.resolved[memo_key]
+
+        key = self.normalised_keys.get(normalise_model_key(model_id))
+        if key is None and self.keys:
+            # thefuzz rounds the ratio, hence the half point
+            best_match = process.extractOne(model_id.lower(), self.keys, scorer=fuzz.ratio,
+                                            score_cutoff=fuzzy_match_threshold - 0.5)
+            if best_match is not None:
+                key = best_match[0]
+
+        self.resolved[memo_key] = key
+        return key
+
+    def get_score(self, model_id: str, fuzzy_match_threshold: int = 80):
+        key = self.find_key(model_id, fuzzy_match_threshold)
+        return self.score_map[key] if key is not None else None
+
+
+score_indexes = OrderedDict()  # id of the score map -> (score map, index)
+
+
+def get_score_index(score_map: Dict[str, float]) -> ModelScoreIndex:
+    """
+    One index per score map, the (cached) maps of load_model_scores get the same index on every call.
+    """
+    entry = score_indexes.get(id(score_map))
+    if entry is not None and entry[0] is score_map:  # the map itself is kept, so its id can't be reused
+        return entry[1]
+
+    index = ModelScoreIndex(score_map)
+    score_indexes[id(score_map)] = (score_map, index)
+    while len(score_indexes) > 8:
+        score_indexes.popitem(last=False)
+    return index
+
+
+def normalise_model_key(model_key: str) -> str:
+    return model_key.strip().lower().replace("_", "-").replace(" ", "-")
+
+
 def sort_models_by_score(model_objects: List[Dict[str, Any]],
                          score_map: Dict[str, float],
                          fuzzy_match_threshold: int = 80
@@ -88,31 +152,14 @@ def sort_models_by_score(model_objects: List[Dict[str, Any]],
     Sorts models by performance score and returns the sorted list and count of matched models.
     Uses fuzzy matching when exact model ID matches aren't found in the score map.
     """
+    score_index = get_score_index(score_map)
     scored_models = []
     matched_count = 0
 
     for model in model_objects:
-        model_id = model['id']
-        # Try direct match first
-        score = score_map.get(model_id.lower(), None)
-
-        # If no direct match, try fuzzy matching
+        score = score_index.get_score(model['id'], fuzzy_match_threshold)
         if score is None:
-            best_match = None
-            best_score = 0
-
-            for csv_key in score_map.keys():
-                match_score = fuzz.ratio(model_id.lower(), csv_key)
-                if match_score > best_score:
-                    best_score = match_score
-                    best_match = csv_key
-
-            # Use fuzzy match if it's good enough
-            if best_match and best_score >= fuzzy_match_threshold:
-                score = score_map[best_match]
-                matched_count += 1
-            else:
-                score = float('-inf')
+            score = float('-inf')
         else:
             matched_count += 1
 
@@ -0,0 +1,151 @@
+import argparse
+import random
+import statistics
+import threading
+import time
+
+from gradio_client import Client
+
+# Simulated users for the Gradio apps, every user has its own session (and state) in the app.
+# Start the app with OPENROUTER_ENDPOINT pointing at stub_server.py to test without API costs.
+
+DEFAULT_PROMPTS = ['What are the opening hours?',
+                   'Can you summarize the main points of the documentation?',
+                   'How do I reset my password?',
+                   'What is the difference between the two options you mentioned?',
+                   'Thanks, can you give an example?']
+
+# how a user turn is sent to the app, see the event handlers at the bottom of every app
+APP_STYLES = {
+    'blocks': 'append_user, then append_bot (tool calling, model choice and FAQ tool)',
+    'chat_interface': 'the /chat endpoint of a gr.ChatInterface (basic chat)',
+}
+
+
+class TurnResult:
+    user_nr: int
+    turn_nr: int
+    time_to_first_update: float
+    total_time: float
+    update_count: int
+    error: str
+
+    def __init__(self, user_nr: int, turn_nr: int):
+        self.user_nr = user_nr
+        self.turn_nr = turn_nr
+        self.time_to_first_update = None
+        self.total_time = None
+        self.update_count = 0
+        self.error = None
+
+
+def run_blocks_turn(client: Client, chat_history: list, prompt: str, result: TurnResult):
+    start = time.monotonic()
+    _, chat_history = client.predict(prompt, chat_history, api_name='/append_user')
+    job = client.submit(chat_history, api_name='/append_bot')
+    for update in job:
+        if result.time_to_first_update is None:
+            result.time_to_first_update = time.monotonic() - start
+        result.update_count += 1
+        chat_history = update[0] if isinstance(update, (list, tuple)) else update
+    result.total_time = time.monotonic() - start
+    return chat_history
+
+
+def run_chat_interface_turn(client: Client, chat_history: list, prompt: str, result: TurnResult):
+    start = time.monotonic()
+    job = client.submit(prompt, api_name='/chat')
+    for _ in job:
+        if result.time_to_first_update is None:
+            result.time_to_first_update = time.monotonic() - start
+        result.update_count += 1
+    result.total_time = time.monotonic() - start
+    return chat_history
+
+
+def simulate_user(user_nr: int, app_url: str, app_style: str, turns: int, think_time: float, auth, results: list):
+    run_turn = run_blocks_turn if app_style == 'blocks' else run_chat_interface_turn
+    try:
+        client = Client(app_url, auth=auth, verbose=False)
+    except Exception as e:
+        result = TurnResult(user_nr, 0)
+        result.error = f'{type(e).__name__}: {e}'
+        results.append(result)
+        return
+
+    chat_history = []
+    for turn_nr in range(turns):
+        result = TurnResult(user_nr, turn_nr)
+        try:
+            chat_history = run_turn(client, chat_history, random.choice(DEFAULT_PROMPTS), result)
+        except Exception as e:
+            result.error = f'{type(e).__name__}: {e}'
+        results.append(result)  # list.append is thread-safe
+        time.sleep(random.uniform(0, 2 * think_time))
+
+
+def percentiles(values: list):
+    if len(values) == 0:
+        return {}
+    if len(values) == 1:
+        return {p: values[0] for p in (50, 90, 95, 99)}
+    cut_points = statistics.quantiles(values, n=100, method='inclusive')
+    return {p: cut_points[p - 1] for p in (50, 90, 95, 99)}
+
+
+def print_report(results: list, wall_time: float):
+    completed = [r for r in results if r.error is None and r.total_time is not None]
+    failed = [r for r in results if r.error is not None]
+    print(f'\n{len(results)} turns in {wall_time:.1f}s: {len(completed)} completed, {len(failed)} failed '
+          f'({len(completed) / wall_time:.2f} turns/s)')
+
+    for label, values in [('first update', [r.time_to_first_update for r in completed
+                                            if r.time_to_first_update is not None]),
+                          ('total', [r.total_time for r in completed])]:
+        p = percentiles(values)
+        if p:
+            print(f'\t{label:>12}: p50 {p[50]:.2f}s, p90 {p[90]:.2f}s, p95 {p[95]:.2f}s, p99 {p[99]:.2f}s, '
+                  f'max {max(values):.2f}s')
+    if completed:
+        print(f'\t{"updates":>12}: {statistics.mean(r.update_count for r in completed):.1f} per turn on average')
+
+    errors = {}
+    for r in failed:
+        errors[r.error] = errors.get(r.error, 0) + 1
+    for error, count in sorted(errors.items(), key=lambda e: -e[1])[:5]:
+        print(f'\t{count}x {error}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Drive a Gradio chat app with concurrent simulated users')
+    parser.add_argument('app_url', help='e.g. http://127.0.0.1:7023/')
+    parser.add_argument('--style', choices=list(APP_STYLES), default='blocks')
+    parser.add_argument('--users', type=int, default=10, help='number of concurrent users')
+    parser.add_argument('--turns', type=int, default=3, help='number of questions per user')
+    parser.add_argument('--think-time', type=float, default=1.0, help='average pause between turns (seconds)')
+    parser.add_argument('--ramp-up', type=float, default=5.0, help='seconds to start all users')
+    parser.add_argument('--auth', help='username:password, for apps with a login')
+    args = parser.parse_args()
+
+    auth = tuple(args.auth.split(':', 1)) if args.auth else None
+    results = []
+    threads = []
+    print(f'Starting {args.users} users with {args.turns} turns each against {args.app_url} '
+          f'({APP_STYLES[args.style]})')
+
+    start = time.monotonic()
+    for user_nr in range(args.users):
+        thread = threading.Thread(target=simulate_user,
+                                  args=(user_nr, args.app_url, args.style, args.turns, args.think_time, auth, results),
+                                  daemon=True)
+        thread.start()
+        threads.append(thread)
+        time.sleep(args.ramp_up / max(args.users, 1))
+    for thread in threads:
+        thread.join()
+
+    print_report(results, time.monotonic() - start)
+
+
+if __name__ == '__main__':
+    main()
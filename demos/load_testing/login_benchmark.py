@@ -0,0 +1,123 @@
+import argparse
+import io
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import redirect_stdout
+
+import bcrypt
+
+sys.path.append('../../')
+
+from demos.components import fn_auth
+
+# Login throughput of fn_auth.auth_method under concurrent logins, compared with the previous implementation
+# (read and scan the users file, bcrypt on the request thread). Like in Gradio, the logins and the event handlers
+# share one pool of request threads: a probe measures how long a quick handler waits during the login storm.
+
+REQUEST_THREADS = 40  # the size of Gradio's (anyio) thread pool
+PROBE_INTERVAL = 0.05  # seconds between two probe handlers
+
+
+def percentiles(values: list):
+    # as in load_generator.py, without its gradio_client dependency
+    if len(values) < 2:
+        return {p: values[0] if values else 0.0 for p in (50, 95)}
+    cut_points = statistics.quantiles(values, n=100, method='inclusive')
+    return {p: cut_points[p - 1] for p in (50, 95)}
+
+
+def auth_method_previous(username, password, users_file=fn_auth.DEFAULT_PASSWD_FILE):
+    # the previous implementation, for reference
+    encoded_username = fn_auth.encode_64(username)
+    log_file = open(users_file, 'r')
+    users_list = log_file.read().splitlines()
+    log_file.close()
+    for user in users_list:
+        if user.startswith(encoded_username):
+            stored_password = user.split(f'{encoded_username}|')[1]
+            return fn_auth.bc_check_string(password, stored_password)
+    return False
+
+
+def write_users_file(users_file, user_count, rounds):
+    # every user gets the same hash: the cost of a check only depends on the rounds
+    hashed_password = bcrypt.hashpw(b'password', bcrypt.gensalt(rounds)).decode(fn_auth.default_encoding)
+    with open(users_file, 'w') as user_lines:
+        for user_nr in range(user_count):
+            user_lines.write(f'{fn_auth.encode_64(f"user{user_nr}")}|{hashed_password}\n')
+
+
+def run_storm(label, auth_method, users_file, user_count, logins, concurrency):
+    request_threads = ThreadPoolExecutor(max_workers=REQUEST_THREADS)
+    login_times = []
+    accepted = [0]
+    count_lock = threading.Lock()
+
+    def login(login_nr):
+        start = time.perf_counter()
+        if auth_method(f'user{(login_nr * 7919) % user_count}', 'password', users_file):
+            with count_lock:
+                accepted[0] += 1
+        login_times.append(time.perf_counter() - start)
+
+    probe_waits = []
+    storm_over = threading.Event()
+
+    def probe():
+        # a quick event handler, e.g. append_user: only the wait for a request thread counts
+        while not storm_over.is_set():
+            submitted = time.perf_counter()
+            request_threads.submit(lambda: probe_waits.append(time.perf_counter() - submitted)).result()
+            time.sleep(PROBE_INTERVAL)
+
+    prober = threading.Thread(target=probe, daemon=True)
+    prober.start()
+    start = time.perf_counter()
+    refused_before = fn_auth.login_stats['refused']
+    with ThreadPoolExecutor(max_workers=concurrency) as clients, redirect_stdout(io.StringIO()):
+        # the browsers, every one waits for its login
+        list(clients.map(lambda login_nr: request_threads.submit(login, login_nr).result(), range(logins)))
+    refused = fn_auth.login_stats['refused'] - refused_before
+    wall_time = time.perf_counter() - start
+    storm_over.set()
+    prober.join()
+    request_threads.shutdown()
+
+    p = percentiles(login_times)
+    probe_p = percentiles(probe_waits)
+    print(f'{label:>10}: {accepted[0] / wall_time:7.1f} logins/s, {accepted[0]}/{logins} accepted '
+          f'({refused} refused to try again), '
+          f'login p50 {p[50] * 1000:7.1f} ms, p95 {p[95] * 1000:7.1f} ms | '
+          f'handler wait p50 {probe_p[50] * 1000:7.1f} ms, max {max(probe_waits) * 1000:7.1f} ms '
+          f'({len(probe_waits)} probes)')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the login throughput of fn_auth under concurrency')
+    parser.add_argument('--users', type=int, default=1000, help='number of users in the users file')
+    parser.add_argument('--logins', type=int, default=200, help='number of logins per run')
+    parser.add_argument('--concurrency', type=int, default=100, help='number of simultaneous logins')
+    parser.add_argument('--rounds', type=int, default=10, help='bcrypt cost of the stored hashes (gensalt: 12)')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as folder:
+        users_file = os.path.join(folder, '.passwd')
+        write_users_file(users_file, args.users, args.rounds)
+        print(f'{args.logins} logins, {args.concurrency} at once, {args.users} users, bcrypt cost {args.rounds}, '
+              f'{REQUEST_THREADS} request threads, {fn_auth.AUTH_WORKERS} bcrypt workers')
+
+        start = time.perf_counter()
+        fn_auth.bc_check_string('password', fn_auth.get_credential_index(users_file).get_hash('user0'))
+        print(f'{"one check":>10}: {(time.perf_counter() - start) * 1000:.1f} ms')
+
+        run_storm('previous', auth_method_previous, users_file, args.users, args.logins, args.concurrency)
+        run_storm('indexed', fn_auth.auth_method, users_file, args.users, args.logins, args.concurrency)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,317 @@
+import argparse
+import json
+import random
+import threading
+import time
+import uuid
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+# A local stand-in for the OpenRouter API, to load test the apps without API keys (or costs).
+# Point the apps at it with OPENROUTER_ENDPOINT=http://127.0.0.1:8088/api/v1 in their .env file.
+
+STUB_WORDS = ('lorem ipsum dolor sit amet consectetur adipiscing elit sed do eiusmod tempor incididunt ut labore '
+              'et dolore magna aliqua').split()
+
+STUB_PROVIDERS = ['openai', 'anthropic', 'google', 'meta-llama', 'mistralai', 'qwen', 'deepseek', 'x-ai']
+
+
+class StubConfig:
+    ttft: float
+    token_delay: float
+    completion_tokens: int
+    error_rate: float
+    rate_limit_rate: float
+    tool_script: list
+    model_count: int
+
+    def __init__(self,
+                 ttft: float = 0.5,
+                 token_delay: float = 0.02,
+                 completion_tokens: int = 150,
+                 error_rate: float = 0,
+                 rate_limit_rate: float = 0,
+                 tool_script: list = None,
+                 model_count: int = 300):
+        self.ttft = ttft  # seconds before the first token
+        self.token_delay = token_delay  # seconds between tokens
+        self.completion_tokens = completion_tokens
+        self.error_rate = error_rate  # fraction of requests answered with a 500 error
+        self.rate_limit_rate = rate_limit_rate  # fraction of requests answered with a 429 error
+        self.tool_script = tool_script if tool_script is not None else []  # tool calls per round, see below
+        self.model_count = model_count
+        self.models = make_model_catalog(model_count)
+        self.models_by_id = {m['id']: m for m in self.models}
+        self.models_etag = f'"{uuid.uuid4().hex}"'
+
+        self.lock = threading.Lock()
+        self.request_count = 0
+        self.error_count = 0
+
+    def count_request(self, is_error: bool):
+        with self.lock:
+            self.request_count += 1
+            if is_error:
+                self.error_count += 1
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    config: StubConfig = None  # set by make_server
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if not url.path.rstrip('/').endswith('/models'):
+            self.send_json(404, {'error': {'code': 404, 'message': f'Unknown path {url.path}'}})
+            return
+
+        if self.headers.get('If-None-Match') == self.config.models_etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+
+        models = self.config.models
+        supported_parameters = parse_qs(url.query).get('supported_parameters')
+        if supported_parameters:
+            models = [m for m in models if supported_parameters[0] in m['supported_parameters']]
+        self.send_json(200, {'data': models}, {'ETag': self.config.models_etag})
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        if not url.path.rstrip('/').endswith('/chat/completions'):
+            self.send_json(404, {'error': {'code': 404, 'message': f'Unknown path {url.path}'}})
+            return
+
+        body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+
+        # simulated failures
+        dice = random.random()
+        if dice < self.config.rate_limit_rate:
+            self.config.count_request(is_error=True)
+            self.send_json(429, {'error': {'code': 429, 'message': 'Rate limit exceeded (stub)'}})
+            return
+        if dice < self.config.rate_limit_rate + self.config.error_rate:
+            self.config.count_request(is_error=True)
+            self.send_json(500, {'error': {'code': 500, 'message': 'Internal server error (stub)'}})
+            return
+        self.config.count_request(is_error=False)
+
+        tool_calls = get_scripted_tool_calls(body, self.config.tool_script)
+        usage = make_usage(body, self.config, 0 if tool_calls else self.config.completion_tokens)
+        if body.get('stream'):
+            self.stream_completion(body, tool_calls, usage)
+        else:
+            self.send_completion(body, tool_calls, usage)
+
+    def send_completion(self, body, tool_calls, usage):
+        time.sleep(self.config.ttft + usage['completion_tokens'] * self.config.token_delay)
+        message = {'role': 'assistant', 'content': None}
+        if tool_calls:
+            message['tool_calls'] = tool_calls
+        else:
+            message['content'] = ''.join(make_tokens(self.config.completion_tokens))
+
+        response = make_chunk(body['model'], 'chat.completion')
+        response['choices'] = [{'index': 0,
+                                'finish_reason': 'tool_calls' if tool_calls else 'stop',
+                                'message': message}]
+        response['usage'] = usage
+        self.send_json(200, response)
+
+    def stream_completion(self, body, tool_calls, usage):
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.end_headers()
+
+        model = body['model']
+        try:
+            time.sleep(self.config.ttft)
+            self.send_event(make_delta_chunk(model, {'role': 'assistant', 'content': ''}))
+
+            if tool_calls:
+                for index, tool_call in enumerate(tool_calls):
+                    # like the real thing: first the name, then the arguments
+                    self.send_event(make_delta_chunk(model, {'tool_calls': [
+                        {'index': index, 'id': tool_call['id'], 'type': 'function',
+                         'function': {'name': tool_call['function']['name'], 'arguments': ''}}]}))
+                    time.sleep(self.config.token_delay)
+                    self.send_event(make_delta_chunk(model, {'tool_calls': [
+                        {'index': index, 'function': {'arguments': tool_call['function']['arguments']}}]}))
+                finish_reason = 'tool_calls'
+            else:
+                for i, token in enumerate(make_tokens(self.config.completion_tokens)):
+                    if i > 0:
+                        time.sleep(self.config.token_delay)
+                    self.send_event(make_delta_chunk(model, {'content': token}))
+                finish_reason = 'stop'
+
+            last_chunk = make_delta_chunk(model, {})
+            last_chunk['choices'][0]['finish_reason'] = finish_reason
+            self.send_event(last_chunk)
+
+            if body.get('stream_options', {}).get('include_usage'):
+                usage_chunk = make_chunk(model, 'chat.completion.chunk')
+                usage_chunk['choices'] = []
+                usage_chunk['usage'] = usage
+                self.send_event(usage_chunk)
+
+            self.wfile.write(b'data: [DONE]\n\n')
+            self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # the client stopped reading, e.g. a cancelled request
+
+    def send_event(self, chunk: dict):
+        self.wfile.write(f'data: {json.dumps(chunk)}\n\n'.encode('utf-8'))
+        self.wfile.flush()
+
+    def send_json(self, status: int, content: dict, headers: dict = None):
+        content_bytes = json.dumps(content).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(content_bytes)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(content_bytes)
+
+    def log_message(self, format, *args):
+        pass  # one line per request is too much output under load
+
+
+def make_server(config: StubConfig, host: str = '127.0.0.1', port: int = 8088):
+    handler = type('ConfiguredStubHandler', (StubHandler,), {'config': config})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+def start_in_background(config: StubConfig = None, host: str = '127.0.0.1', port: int = 0):
+    """Start a stub server in a daemon thread, returns the server and its base url."""
+    server = make_server(config if config is not None else StubConfig(), host, port)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f'http://{host}:{server.server_port}/api/v1'
+
+
+# The tool script is a list of rounds, every round a list of {"name": ..., "arguments": {...}}.
+# Round n of a user turn is answered with the tool calls of tool_script[n] (if the request offers these tools),
+# after the last scripted round (or with tool_choice "none") the stub answers with text.
+# The ids of the tool calls of one response share a prefix: a client that appends one assistant message
+# per tool call (like AgentRun.run_tools) still counts as one round.
+def get_scripted_tool_calls(body: dict, tool_script: list):
+    if not tool_script or not body.get('tools') or body.get('tool_choice') == 'none':
+        return []
+
+    rounds = set()
+    for message in reversed(body['messages']):
+        if message.get('role') == 'user':
+            break
+        if message.get('role') == 'assistant' and message.get('tool_calls'):
+            rounds.add(get_round_id(message['tool_calls'][0].get('id', '')))
+    round_nr = len(rounds)
+    if round_nr >= len(tool_script):
+        return []
+
+    tool_names = {t.get('function', {}).get('name') for t in body['tools']}
+    round_id = uuid.uuid4().hex[:16]
+    return [{'id': f'call_{round_id}_{call_nr}',
+             'type': 'function',
+             'function': {'name': call['name'], 'arguments': json.dumps(call.get('arguments', {}))}}
+            for call_nr, call in enumerate(tool_script[round_nr]) if call['name'] in tool_names]
+
+
+def get_round_id(tool_call_id: str):
+    # call_<round id>_<call nr> for the tool calls of the stub, other ids are a round on their own
+    prefix, _, call_nr = tool_call_id.rpartition('_')
+    return prefix if prefix.startswith('call_') and call_nr.isdigit() else tool_call_id
+
+
+def make_usage(body: dict, config: StubConfig, completion_tokens: int):
+    prompt_tokens = len(json.dumps(body.get('messages', []))) // 4 + len(json.dumps(body.get('tools', []))) // 4
+    if completion_tokens == 0:
+        completion_tokens = 20  # tool calls
+    pricing = config.models_by_id.get(body.get('model'), {}).get('pricing', {'prompt': '0', 'completion': '0'})
+    cost = prompt_tokens * float(pricing['prompt']) + completion_tokens * float(pricing['completion'])
+    return {'prompt_tokens': prompt_tokens,
+            'completion_tokens': completion_tokens,
+            'total_tokens': prompt_tokens + completion_tokens,
+            'prompt_tokens_details': {'cached_tokens': 0},
+            'cost': cost}
+
+
+def make_tokens(count: int):
+    return [f'{STUB_WORDS[i % len(STUB_WORDS)]} ' for i in range(count)]
+
+
+def make_chunk(model: str, object_type: str):
+    return {'id': f'gen-{uuid.uuid4().hex}', 'object': object_type, 'created': int(time.time()), 'model': model,
+            'provider': 'Stub'}
+
+
+def make_delta_chunk(model: str, delta: dict):
+    chunk = make_chunk(model, 'chat.completion.chunk')
+    chunk['choices'] = [{'index': 0, 'delta': delta, 'finish_reason': None}]
+    return chunk
+
+
+def make_model_catalog(model_count: int):
+    # deterministic, so repeated runs see the same catalog
+    rng = random.Random(42)
+    models = []
+    for i in range(model_count):
+        provider = STUB_PROVIDERS[i % len(STUB_PROVIDERS)]
+        prompt_price = rng.choice([0.1, 0.15, 0.4, 0.8, 1, 2.5, 3, 5, 15]) / 1000000
+        supported_parameters = ['max_tokens', 'temperature', 'stream']
+        if rng.random() < 0.7:
+            supported_parameters.extend(['tools', 'tool_choice'])
+        models.append({'id': f'{provider}/stub-model-{i}',
+                       'name': f'Stub model {i}',
+                       'created': 1700000000 + i * 3600,
+                       'context_length': rng.choice([8192, 32768, 128000, 200000, 1000000]),
+                       'architecture': {'input_modalities': ['text', 'image'] if i % 3 == 0 else ['text'],
+                                        'output_modalities': ['text']},
+                       'pricing': {'prompt': f'{prompt_price:.10f}',
+                                   'completion': f'{prompt_price * 4:.10f}',
+                                   'image': '0', 'request': '0'},
+                       'top_provider': {'context_length': None, 'max_completion_tokens': rng.choice([4096, 16384, None]),
+                                        'is_moderated': False},
+                       'supported_parameters': supported_parameters})
+    return models
+
+
+def main():
+    parser = argparse.ArgumentParser(description='OpenRouter compatible stub server for load testing')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8088)
+    parser.add_argument('--ttft', type=float, default=0.5, help='seconds before the first token')
+    parser.add_argument('--token-delay', type=float, default=0.02, help='seconds between tokens')
+    parser.add_argument('--completion-tokens', type=int, default=150, help='length of every text answer')
+    parser.add_argument('--error-rate', type=float, default=0, help='fraction of requests failing with a 500')
+    parser.add_argument('--rate-limit-rate', type=float, default=0, help='fraction of requests failing with a 429')
+    parser.add_argument('--tool-script', help='JSON file with the scripted tool calls, see tool_script_example.json')
+    parser.add_argument('--models', type=int, default=300, help='number of models in the catalog')
+    args = parser.parse_args()
+
+    tool_script = None
+    if args.tool_script:
+        with open(args.tool_script, 'rt', encoding='utf-8') as script_file:
+            tool_script = json.load(script_file)
+
+    config = StubConfig(ttft=args.ttft,
+                        token_delay=args.token_delay,
+                        completion_tokens=args.completion_tokens,
+                        error_rate=args.error_rate,
+                        rate_limit_rate=args.rate_limit_rate,
+                        tool_script=tool_script,
+                        model_count=args.models)
+    server = make_server(config, args.host, args.port)
+    print(f'Stub server listening on http://{args.host}:{args.port}/api/v1 '
+          f'(ttft {args.ttft}s, {args.token_delay}s per token, {args.error_rate + args.rate_limit_rate:.0%} errors)')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    print(f'{config.request_count} requests served, {config.error_count} errors')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+import os
+import sys
+import time
+
+from dotenv import load_dotenv
+from rapidfuzz import fuzz
+
+sys.path.append('../../')
+
+from demos.components.model_catalog import get_model_catalog
+from demos.image_analysis.utils import load_model_scores, get_score_index, ModelScoreIndex
+from demos.model_choice.or_pricing import MODEL_SCORES_CSV
+
+# Compares the indexed score matching with the previous approach (fuzz.ratio against every key of the CSV),
+# on the full OpenRouter catalog. Set OPENROUTER_ENDPOINT to the stub server to run it offline.
+
+FUZZY_MATCH_THRESHOLD = 96
+REPETITIONS = 5
+
+
+def match_scores_pairwise(model_ids, score_map, fuzzy_match_threshold):
+    # the previous implementation, for reference
+    resolved = {}
+    for model_id in model_ids:
+        score = score_map.get(model_id.lower(), None)
+        if score is None:
+            best_match = None
+            best_score = 0
+            for csv_key in score_map.keys():
+                match_score = round(fuzz.ratio(model_id.lower(), csv_key))
+                if match_score > best_score:
+                    best_score = match_score
+                    best_match = csv_key
+            if best_match and best_score >= fuzzy_match_threshold:
+                score = score_map[best_match]
+        resolved[model_id] = score
+    return resolved
+
+
+def match_scores_indexed(model_ids, score_index, fuzzy_match_threshold):
+    return {model_id: score_index.get_score(model_id, fuzzy_match_threshold) for model_id in model_ids}
+
+
+def time_it(label, function, repetitions=REPETITIONS):
+    timings = []
+    result = None
+    for _ in range(repetitions):
+        start = time.perf_counter()
+        result = function()
+        timings.append(time.perf_counter() - start)
+    print(f'{label:>36}: best {min(timings) * 1000:8.2f} ms, first {timings[0] * 1000:8.2f} ms')
+    return result
+
+
+def run_benchmark(csv_path=MODEL_SCORES_CSV):
+    if not os.path.exists(csv_path):
+        print(f'Score file not found: {csv_path}')
+        return
+
+    model_ids = [m['id'] for m in get_model_catalog().get_models()]
+    print(f'{len(model_ids)} models in the catalog')
+
+    score_map = time_it('load CSV (cached after the first call)', lambda: load_model_scores(csv_path))
+    print(f'{len(score_map)} scores in {os.path.basename(csv_path)}\n')
+
+    reference = time_it('pairwise fuzz.ratio (previous)',
+                        lambda: match_scores_pairwise(model_ids, score_map, FUZZY_MATCH_THRESHOLD), repetitions=1)
+    time_it('index, cold (build + match)',
+            lambda: match_scores_indexed(model_ids, ModelScoreIndex(score_map), FUZZY_MATCH_THRESHOLD))
+    indexed = time_it('index, memoised (page reloads)',
+                      lambda: match_scores_indexed(model_ids, get_score_index(score_map), FUZZY_MATCH_THRESHOLD))
+
+    matched = len([s for s in indexed.values() if s is not None])
+    differences = [m for m in model_ids if indexed[m] != reference[m]]
+    print(f'\n{matched} models matched a score, {len(differences)} differ from the previous approach')
+    for model_id in differences[:10]:
+        print(f'\t{model_id}: {reference[model_id]} -> {indexed[model_id]} (matched on the normalised id)')
+
+
+if __name__ == '__main__':
+    load_dotenv()
+    run_benchmark(sys.argv[1] if len(sys.argv) > 1 else MODEL_SCORES_CSV)
@@ -1,14 +1,21 @@
-import copy
 import os
-import random
 import sys
 
 import gradio as gr
+import numpy as np
+import pandas as pd
 from dotenv import load_dotenv
 
 sys.path.append('../../')
 
+from demos.components.metrics import metrics_app_kwargs
+from demos.components.model_catalog import get_model_catalog
+from demos.components.model_router import ModelRouter, ROUTED_MODEL, candidates_from_table
 from demos.components.open_router_client import OpenRouterClient
+from demos.components.stream_aggregator import StreamAggregator
+from demos.components.usage_ledger import UsageLedger
+from demos.model_choice.model_comparison import (MAX_COMPARED_MODELS, compare_models, export_results,
+                                                  results_to_dataframe)
 from demos.model_choice.or_pricing import get_models
 
 load_dotenv()
@@ -25,84 +32,84 @@ system_instruction = {
 different_colors = ['#e6194b', '#3cb44b', '#ffe119', '#4363d8', '#f58231', '#911eb4', '#46f0f0', '#f032e6', '#bcf60c',
                     '#fabebe', '#008080', '#e6beff', '#9a6324', '#fffac8', '#aaffc3', '#808000', '#ffd8b1', '#808080']
 providers = {}
+usage_ledger = UsageLedger()
+# learns the latency of every model from the traffic of this app, used for the 'fastest model' option
+model_router = ModelRouter(quality_floor=1300, max_prompt_price=3, max_completion_price=15)
+comparison_client = None  # one client (and connection pool) for every model of every comparison
 
 
 # blocks UI method
 def on_load_ui():
+    # the table and the CSS of its cells are only rebuilt when the model catalog changes,
+    # every page load gets its own Styler: rendering one changes its state, so it can't be shared
+    data_models, format_dict, column_styles = get_model_catalog().get_derived('model_choice_table', build_table)
+    style_models = (data_models.style
+                    .format(format_dict)
+                    .apply(lambda column: column_styles[column.name], subset=list(column_styles))
+                    )
+    return data_models, style_models
+
+
+# helper method
+def build_table(models):
     data_models = get_models(tools_only=False, as_dataframe=True)
+    model_router.set_candidates(candidates_from_table(data_models))
 
     # set precision of price values
     price_columns = data_models.filter(like='price').columns
     format_dict = {col: "{:.3f}".format for col in price_columns}
     format_dict.update({col: "{:.0f}".format for col in ['max_completion_tokens']})
 
-    style_models = (data_models.style
-                    .format(format_dict)
-                    .map(colorize_quantiles, df=data_models, col='completion_price', subset=['completion_price'])
-                    .map(colorize_quantiles, df=data_models, col='prompt_price', subset=['prompt_price'])
-                    .map(colorize_contexts, subset=['context_length'])
-                    .map(colorize_providers, subset=['provider'])
-                    .map(colorize_scores, df=data_models, col='lm_arena_score', subset=['lm_arena_score'])
-                    )
-
-    return data_models, style_models
+    # the CSS of every cell is computed once, per column
+    column_styles = {'completion_price': colorize_quantiles(data_models['completion_price']),
+                     'prompt_price': colorize_quantiles(data_models['prompt_price']),
+                     'context_length': colorize_contexts(data_models['context_length']),
+                     'provider': colorize_providers(data_models['provider']),
+                     'lm_arena_score': colorize_scores(data_models['lm_arena_score'])}
+    return data_models, format_dict, column_styles
 
 
 # helper method
-def colorize_quantiles(value, df, col):
-    if value < df[col].quantile(0.3):
-        return 'color:green;'
-    if value >= df[col].quantile(0.9):
-        return 'color:red;'
-    if value > df[col].quantile(0.6):
-        return 'color:orange;'
-    return ''
+def colorize_quantiles(values):
+    low, mid, high = values.quantile([0.3, 0.6, 0.9])
+    return pd.Series(np.select([values < low, values >= high, values > mid],
+                               ['color:green;', 'color:red;', 'color:orange;'], default=''),
+                     index=values.index)
 
 
-def colorize_contexts(context_size):
-    if context_size > 64000:
-        return 'color:green;'
-    if context_size < 10000:
-        return 'color:red;'
-    if context_size < 20000:
-        return 'color:orange;'
-    return ''
+def colorize_contexts(context_sizes):
+    return pd.Series(np.select([context_sizes > 64000, context_sizes < 10000, context_sizes < 20000],
+                               ['color:green;', 'color:red;', 'color:orange;'], default=''),
+                     index=context_sizes.index)
 
 
-def colorize_providers(full_model_name):
-    provider_name = full_model_name.split('/')[0]
+def colorize_providers(provider_names):
+    for provider_name in provider_names.unique():
+        if provider_name not in providers:
+            # re-use the colors when we run out
+            providers[provider_name] = different_colors[len(providers) % len(different_colors)]
+    return 'color:' + provider_names.map(providers) + ';'
 
-    available_colors = copy.deepcopy(different_colors)
-    if provider_name not in providers.keys():
-        # select a random color
-        color = random.choice(available_colors)
-        providers[provider_name] = color
-        available_colors.remove(color)
 
-        if len(available_colors) < 1:
-            # start re-using these colors when we run out
-            available_colors = copy.deepcopy(different_colors)
+def colorize_scores(values):
+    """Colorizes scores based on quantiles."""
+    # "N/A" and -1 are models without a score
+    numeric_values = pd.to_numeric(values, errors='coerce').fillna(-1).astype(float)
+    no_score = (numeric_values == -1) | np.isinf(numeric_values)
+    low, mid, high = values.quantile([0.35, 0.65, 0.95])
+    return pd.Series(np.select([no_score, numeric_values >= high, numeric_values < low, numeric_values < mid],
+                               ['color:grey;', 'color:green;', 'color:red;', 'color:orange;'], default=''),
+                     index=values.index)
 
-    return 'color:' + providers[provider_name] + ';'
 
+# blocks UI method
+def on_fastest_model_clicked():
+    return 'Fastest model (quality score >= 1300, chosen per request)', ROUTED_MODEL
 
-def colorize_scores(value, df, col):
-    """Colorizes scores based on quantiles."""
-    # Convert value to float if it's a string "N/A"
-    if isinstance(value, str) and value == "N/A":
-        numeric_value = float('-inf')
-    else:
-        numeric_value = float(value)  # Ensure it's a float for comparison
-
-    if numeric_value == -1 or numeric_value == float('-inf'):  # Models with no score or -inf from fuzzy matching
-        return 'color:grey;'
-    if numeric_value >= df[col].quantile(0.95):
-        return 'color:green;'
-    if numeric_value < df[col].quantile(0.35):
-        return 'color:red;'
-    if numeric_value < df[col].quantile(0.65):
-        return 'color:orange;'
-    return ''
+
+# blocks UI method
+def on_routing_table_requested():
+    return pd.DataFrame(model_router.get_routing_table())
 
 
 # blocks UI method
@@ -132,8 +139,46 @@ def append_user(user_message, chat_history, message_list):
 
 
 # blocks UI method
-def append_bot(chat_history, message_list, model_name):
-    yield from complete_with_llm(chat_history, message_list, model_name)
+def append_bot(chat_history, message_list, model_name, request: gr.Request):
+    yield from complete_with_llm(chat_history, message_list, model_name, request.session_hash)
+
+
+# blocks UI method
+def on_compare_tab_loaded():
+    model_names = [model['id'] for model in get_model_catalog().get_models()]
+    return gr.Dropdown(choices=sorted(model_names))
+
+
+# blocks UI method
+def on_compare_clicked(model_names, prompt, request: gr.Request):
+    if not model_names or not prompt:
+        raise gr.Error('Select at least one model and enter a prompt')
+
+    message_list = [system_instruction, {'role': 'user', 'content': prompt}]
+    on_usage = lambda usage, model_name: usage_ledger.record(usage, model=model_name, session=request.session_hash)
+
+    df_results = None
+    for results in compare_models(get_comparison_client(), model_names, message_list, on_usage=on_usage):
+        df_results = results_to_dataframe(results)
+        yield get_answer_panels(results) + [df_results, gr.DownloadButton(interactive=False)]
+
+    yield get_answer_panels(results) + [df_results,
+                                        gr.DownloadButton(value=export_results(df_results, prompt), interactive=True)]
+
+
+# helper method
+def get_answer_panels(results):
+    panels = [f'#### {result.model_name}\n\n{result.error or result.text}' for result in results]
+    return panels + [''] * (MAX_COMPARED_MODELS - len(panels))
+
+
+# helper method
+def get_comparison_client():
+    global comparison_client
+    if comparison_client is None:
+        # the model is passed per request, the router learns from the comparisons as well
+        comparison_client = OpenRouterClient(api_key=os.getenv('OPENROUTER_API_KEY'), router=model_router)
+    return comparison_client
 
 
 # blocks UI method
@@ -142,24 +187,32 @@ def on_clear_clicked():
     return [None, [system_instruction]]
 
 
-def complete_with_llm(chat_history, message_list, model_name):
+def complete_with_llm(chat_history, message_list, model_name, session=None):
     or_client = OpenRouterClient(model_name=model_name,
-                                 api_key=os.getenv('OPENROUTER_API_KEY'))
+                                 api_key=os.getenv('OPENROUTER_API_KEY'),
+                                 router=model_router)
     response_stream = or_client.create_completions_stream(message_list=message_list)
+    if model_name == ROUTED_MODEL:
+        print(f'Routed to {or_client.model_name}')
 
-    partial_message = ''
+    aggregator = StreamAggregator()
 
     chat_history.append({'role': 'assistant', 'content': ''})  # append empty response
 
     for chunk in response_stream:  # stream the response
+        if chunk.usage is not None:  # the last chunk, when the response is complete
+            usage_ledger.record(chunk.usage, model=or_client.model_name, session=session)
+
         if len(chunk.choices) > 0:
             # LLM text reponses
-            if chunk.choices[0].delta.content is not None:
-                partial_message = partial_message + chunk.choices[0].delta.content
-                chat_history[-1]['content'] = partial_message
+            if chunk.choices[0].delta.content is not None and aggregator.add(chunk.choices[0].delta.content):
+                chat_history[-1]['content'] = aggregator.flush()
                 yield chat_history, message_list
 
     response_stream.close()
+    if aggregator.has_pending():  # always show the final text
+        chat_history[-1]['content'] = aggregator.flush()
+        yield chat_history, message_list
 
     # handle text responses
     if chat_history[-1]['content'] is not None:
@@ -179,36 +232,60 @@ with (gr.Blocks(fill_height=True, title='OpenRouter Model Choice', css=custom_cs
     df_models = gr.State(None)
 
     # ui
-    cb_live = gr.Chatbot(label='Chat',
-                         type='messages',
-                         scale=1,
-                         show_copy_button=True)
-
-    with gr.Group() as gr_live:
-        with gr.Row():
-            tb_user = gr.Textbox(show_label=False,
-                                 info='Enter your prompt here.',
-                                 placeholder='Enter prompt here...',
-                                 scale=1)
-
-            btn_send = gr.Button('', scale=0, min_width=64, elem_classes='blue',
-                                 icon='../../assets/icons/send.png')
-            btn_clear = gr.Button('', scale=0, min_width=64, elem_classes='danger',
-                                  icon='../../assets/icons/disposal.png')
-
-        lbl_model = gr.Textbox(label='Currently selected model:',
-                               value=selected_model.value,
-                               interactive=False,
-                               elem_classes='bold')
-        with gr.Row():
-            with gr.Accordion(label='Available models', open=False):
-                dfr_models = gr.DataFrame(df_models.value,
-                                          type="pandas",
-                                          show_search='search',
-                                          interactive=False,
-                                          headers=['Full Model Name', 'LM Arena Score', 'Prompt Price',
-                                                   'Completion Price', 'Context Length', 'Max Completion Tokens',
-                                                   'Provider'])
+    with gr.Tabs():
+        with gr.Tab('Chat'):
+            cb_live = gr.Chatbot(label='Chat',
+                                 type='messages',
+                                 scale=1,
+                                 show_copy_button=True)
+
+            with gr.Group() as gr_live:
+                with gr.Row():
+                    tb_user = gr.Textbox(show_label=False,
+                                         info='Enter your prompt here.',
+                                         placeholder='Enter prompt here...',
+                                         scale=1)
+
+                    btn_send = gr.Button('', scale=0, min_width=64, elem_classes='blue',
+                                         icon='../../assets/icons/send.png')
+                    btn_clear = gr.Button('', scale=0, min_width=64, elem_classes='danger',
+                                          icon='../../assets/icons/disposal.png')
+
+                with gr.Row():
+                    lbl_model = gr.Textbox(label='Currently selected model:',
+                                           value=selected_model.value,
+                                           interactive=False,
+                                           elem_classes='bold',
+                                           scale=10)
+                    btn_fastest = gr.Button('Fastest model', scale=1)
+                with gr.Row():
+                    with gr.Accordion(label='Available models', open=False):
+                        dfr_models = gr.DataFrame(df_models.value,
+                                                  type="pandas",
+                                                  show_search='search',
+                                                  interactive=False,
+                                                  headers=['Full Model Name', 'LM Arena Score', 'Prompt Price',
+                                                           'Completion Price', 'Context Length', 'Max Completion Tokens',
+                                                           'Provider'])
+                with gr.Row():
+                    with gr.Accordion(label='Routing table (fastest model first)', open=False):
+                        dfr_routing = gr.DataFrame(type="pandas", interactive=False)
+                        btn_routing = gr.Button('Refresh')
+
+        with gr.Tab('Compare models'):
+            with gr.Row():
+                dd_compare = gr.Dropdown(label=f'Models to compare (at most {MAX_COMPARED_MODELS})',
+                                         multiselect=True,
+                                         max_choices=MAX_COMPARED_MODELS,
+                                         scale=10)
+                btn_compare = gr.Button('Compare', scale=1, elem_classes='blue')
+            tb_compare = gr.Textbox(show_label=False,
+                                    placeholder='Enter the prompt for every model here...',
+                                    lines=3)
+            with gr.Row(equal_height=True):
+                md_answers = [gr.Markdown(show_copy_button=True) for _ in range(MAX_COMPARED_MODELS)]
+            dfr_results = gr.DataFrame(type="pandas", interactive=False)
+            btn_export = gr.DownloadButton('Export results (CSV)', interactive=False)
 
     # event handlers
     tb_user.submit(append_user,
@@ -238,6 +315,25 @@ with (gr.Blocks(fill_height=True, title='OpenRouter Model Choice', css=custom_cs
                       inputs=[],
                       outputs=[lbl_model, selected_model])
 
+    btn_fastest.click(on_fastest_model_clicked,
+                      None,
+                      [lbl_model, selected_model],
+                      queue=False)
+
+    btn_routing.click(on_routing_table_requested,
+                      None,
+                      [dfr_routing],
+                      queue=False)
+
+    llm_client_ui.load(fn=on_compare_tab_loaded,
+                       inputs=None,
+                       outputs=[dd_compare])
+
+    btn_compare.click(on_compare_clicked,
+                      [dd_compare, tb_compare],
+                      md_answers + [dfr_results, btn_export])
+
 llm_client_ui.queue().launch(auth=None,
                              server_name='0.0.0.0',
-                             server_port=7022)
+                             server_port=7022,
+                             app_kwargs=metrics_app_kwargs())  # Prometheus metrics on /metrics
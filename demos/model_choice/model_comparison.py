@@ -0,0 +1,130 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
+from demos.components.open_router_client import OpenRouterClient
+from demos.components.stream_aggregator import StreamAggregator
+
+MAX_COMPARED_MODELS = 4
+REFRESH_INTERVAL = 0.1  # seconds between two UI updates while the models are streaming
+COMPARISON_FOLDER = './comparisons/'
+
+# one worker per model of a comparison, shared by all sessions of the app
+comparison_pool = ThreadPoolExecutor(max_workers=4 * MAX_COMPARED_MODELS, thread_name_prefix='compare')
+
+
+class ComparisonResult:
+    """The streamed answer and the latency of one model in a comparison."""
+    model_name: str
+
+    def __init__(self, model_name: str):
+        self.model_name = model_name
+        self.status = 'waiting'
+        self.text = ''
+        self.ttft = None
+        self.total_time = None
+        self.tokens_per_second = None
+        self.prompt_tokens = None
+        self.completion_tokens = None
+        self.cost = None
+        self.error = None
+
+    def to_row(self):
+        return {'model': self.model_name,
+                'status': self.status,
+                'ttft': round(self.ttft, 3) if self.ttft is not None else None,
+                'total_time': round(self.total_time, 3) if self.total_time is not None else None,
+                'tokens_per_second': round(self.tokens_per_second, 1) if self.tokens_per_second is not None else None,
+                'prompt_tokens': self.prompt_tokens,
+                'completion_tokens': self.completion_tokens,
+                'cost': self.cost,
+                'error': self.error}
+
+
+def compare_models(or_client: OpenRouterClient,
+                   model_names: list,
+                   message_list: list,
+                   on_usage=None,
+                   refresh_interval: float = REFRESH_INTERVAL):
+    """
+    Send the same messages to every model at once, through one (pooled) client.
+    Yields the list of ComparisonResults every refresh_interval, until every model has finished.
+    on_usage(usage, model_name) is called with the usage of every completed answer, e.g. for a usage ledger.
+    """
+    results = [ComparisonResult(model_name) for model_name in model_names[:MAX_COMPARED_MODELS]]
+    stop_event = threading.Event()
+    futures = [comparison_pool.submit(stream_answer, or_client, result, message_list, stop_event, on_usage)
+               for result in results]
+
+    try:
+        while not all(future.done() for future in futures):
+            time.sleep(refresh_interval)
+            yield results
+        yield results
+    finally:
+        stop_event.set()  # e.g. the user left the page: stop reading the remaining streams
+
+
+def stream_answer(or_client: OpenRouterClient, result: ComparisonResult, message_list: list,
+                  stop_event: threading.Event, on_usage=None):
+    started_at = time.monotonic()
+    first_token_at = None
+    aggregator = StreamAggregator(flush_interval=REFRESH_INTERVAL)
+    result.status = 'streaming'
+    try:
+        response_stream = or_client.create_completions_stream(message_list=message_list,
+                                                              model_name=result.model_name)
+        try:
+            for chunk in response_stream:
+                if stop_event.is_set():
+                    result.status = 'cancelled'
+                    return
+
+                if chunk.usage is not None:  # the last chunk, when the response is complete
+                    result.prompt_tokens = chunk.usage.prompt_tokens
+                    result.completion_tokens = chunk.usage.completion_tokens
+                    result.cost = getattr(chunk.usage, 'cost', None)
+                    if on_usage is not None:
+                        on_usage(chunk.usage, result.model_name)
+
+                if len(chunk.choices) > 0 and chunk.choices[0].delta.content:
+                    if first_token_at is None:
+                        first_token_at = time.monotonic()
+                        result.ttft = first_token_at - started_at
+                    if aggregator.add(chunk.choices[0].delta.content):
+                        result.text = aggregator.flush()
+        finally:
+            response_stream.close()
+    except Exception as e:
+        result.status = 'error'
+        result.error = f'{type(e).__name__}: {e}'
+        return
+
+    finished_at = time.monotonic()
+    result.text = aggregator.flush()
+    result.total_time = finished_at - started_at
+    if first_token_at is not None and result.completion_tokens and finished_at > first_token_at:
+        result.tokens_per_second = result.completion_tokens / (finished_at - first_token_at)
+    result.status = 'done'
+
+
+def results_to_dataframe(results: list):
+    return pd.DataFrame([result.to_row() for result in results],
+                        columns=['model', 'status', 'ttft', 'total_time', 'tokens_per_second',
+                                 'prompt_tokens', 'completion_tokens', 'cost', 'error'])
+
+
+def export_results(df_results: pd.DataFrame, prompt: str, comparison_folder: str = COMPARISON_FOLDER):
+    """Write the results table of a comparison to a CSV file, returns its path."""
+    if not os.path.exists(comparison_folder):
+        os.makedirs(comparison_folder)
+
+    df_export = df_results.copy()
+    df_export.insert(0, 'prompt', prompt)
+    df_export.insert(0, 'timestamp', time.strftime('%Y-%m-%d %H:%M:%S'))
+    csv_path = os.path.join(comparison_folder, f'comparison_{time.strftime("%Y%m%d_%H%M%S")}.csv')
+    df_export.to_csv(csv_path, index=False)
+    return csv_path
@@ -1,27 +1,36 @@
-import json
 import os
 
 import pandas as pd
-import requests
 
+from demos.components.model_catalog import get_model_catalog, supports_tools
 from demos.image_analysis.utils import load_model_scores, sort_models_by_score
 
 # Define the path to the CSV file
 MODEL_SCORES_CSV = os.path.join(os.path.dirname(__file__), 'lmarena_text_200825.csv')
 
 
-def get_models(tools_only=True, names_only=True, as_dataframe=False):
-    models_url = 'https://openrouter.ai/api/v1/models'
-    if tools_only:
-        models_url += '?supported_parameters=tools'
+def get_models(tools_only=True, names_only=True, as_dataframe=False, base_url=None):
+    # the catalog is downloaded (and scored) only when it changes, page loads get the result from memory
+    catalog = get_model_catalog(base_url)
+    sorted_models, df_models = catalog.get_derived(('or_pricing', tools_only),
+                                                   lambda models: build_model_table(models, tools_only))
+
+    if names_only and not as_dataframe:
+        names = []
+        for model in sorted_models:
+            names.append(model['id'])
+        return no_duplicates(names)
+
+    return df_models
 
-    response = requests.get(models_url)
 
-    model_list = json.loads(response.text)
-    print(f'{len(model_list['data'])} models are available.')
+def build_model_table(models, tools_only=True):
+    if tools_only:
+        models = [m for m in models if supports_tools(m)]
+    print(f'{len(models)} models are available.')
 
     # no experimental
-    filtered_data = [m for m in model_list['data']
+    filtered_data = [dict(m) for m in models  # copies, the catalog is shared
                      if 'beta' not in m['id']
                      and '-exp' not in m['id']
                      and ':free' not in m['id']]
@@ -46,12 +55,6 @@ def get_models(tools_only=True, names_only=True, as_dataframe=False):
     sorted_models, matched_count = sort_models_by_score(filtered_data, model_scores_map, fuzzy_match_threshold=96)
     print(f"Matched {matched_count} models with scores from CSV.")
 
-    if names_only and not as_dataframe:
-        names = []
-        for model in sorted_models:
-            names.append(model['id'])
-        return no_duplicates(names)
-
     md_data = []
     for model in sorted_models:
         ppm_p = float(model['pricing']['prompt']) * 1000000
@@ -77,14 +80,12 @@ def get_models(tools_only=True, names_only=True, as_dataframe=False):
     # Ensure lm_arena_score is numeric, coercing errors to NaN, then fill NaN with -1
     df_models['lm_arena_score'] = pd.to_numeric(df_models['lm_arena_score'], errors='coerce').fillna(-1).astype(int)
 
-    df_models.style.background_gradient()
-
     pd.set_option('display.width', 200)
     pd.set_option('display.precision', 3)
 
-    df_models.to_csv('or_pricing.csv')
+    df_models.to_csv('or_pricing.csv')  # only written when the catalog changes
 
-    return df_models
+    return sorted_models, df_models
 
 
 def no_duplicates(list_with_duplicates):
@@ -1,4 +1,3 @@
-import json
 import os
 import re
 
@@ -6,7 +5,10 @@ from dotenv import load_dotenv
 from slack_bolt import App
 from slack_bolt.adapter.socket_mode import SocketModeHandler
 
+from demos.components.agent_loop import AgentLoop
 from demos.components.open_router_client import OpenRouterClient, GPT_4O_MINI_1807
+from demos.components.tool_cache import ToolCache
+from demos.components.usage_ledger import UsageLedger
 from demos.tool_calling.tool_descriptors import (tools_rag_descriptor,
                                                  tools_search_descriptor,
                                                  tools_get_website_contents)
@@ -26,6 +28,14 @@ tool_list.extend(tools_get_website_contents)
 or_client = OpenRouterClient(model_name=GPT_4O_MINI_1807,
                              tools_list=tool_list,
                              api_key=os.getenv('OPENROUTER_API_KEY'))
+tool_cache = ToolCache()
+usage_ledger = UsageLedger()
+agent_loop = AgentLoop(or_client,
+                       tool_namespace=globals(),
+                       tool_cache=tool_cache,
+                       usage_ledger=usage_ledger,
+                       deadline_seconds=60,
+                       max_tool_rounds=3)
 
 system_instruction = {
     'role': 'system',
@@ -52,60 +62,25 @@ def handle_command(ack, say, command):
         {'role': 'user', 'content': command['text']}
     ]
 
-    response = complete_with_llm(history_openai_format)
+    response = complete_with_llm(history_openai_format, command.get('user_name'), command.get('channel_id'))
     if response:
         say(f'{response}')  # respond to the command
     else:
         say('Sorry, I can\'t help you with that...')  # respond to the command
 
 
-def complete_with_llm(message_list):
-    response = or_client.create_completions_stream(message_list=message_list, stream=False)
+def complete_with_llm(message_list, user=None, session=None):
+    agent_run = agent_loop.start(message_list, user=user, session=session)
 
-    message = response.choices[0].message
-    if message.content is not None and message.content:
-        slack_markup = convert_markdown_to_slack_markup(message.content)
+    response_text = ''
+    for round_nr, partial_message in agent_run.run():
+        response_text = partial_message  # only the last (complete) message is sent to Slack
+
+    print(agent_run.get_summary())
+    if response_text:
+        slack_markup = convert_markdown_to_slack_markup(response_text)
         return f'{slack_markup}'
-    if message.tool_calls is not None:
-        return handle_tool_calls(message.tool_calls, message_list)
-    else:
-        print(response)
-        return f'Failed to get a response...'
-
-
-def handle_tool_calls(tool_calls, message_list):
-    # handle tool requests
-    if len(tool_calls) > 0:
-        print(f'Processing {len(tool_calls)} tool calls')
-        for call in tool_calls:
-            fn_pointer = globals()[call.function.name]
-            fn_args = json.loads(call.function.arguments)
-            tool_call_obj = {
-                'role': 'assistant',
-                'content': None,
-                'tool_calls': [
-                    {
-                        'id': call.id,
-                        'type': 'function',
-                        'function': {
-                            'name': call.function.name,
-                            'arguments': call.function.arguments
-                        }
-                    }
-                ]
-            }
-            message_list.append(tool_call_obj)
-
-            if fn_pointer is not None:
-                fn_result = fn_pointer(**fn_args)
-                tool_resp = {'role': 'tool',
-                             'name': call.function.name,
-                             'tool_call_id': call.id,
-                             'content': json.dumps(fn_result)}
-                message_list.append(tool_resp)
-
-        # recursively call completion message to give the LLM a chance to process results
-        return complete_with_llm(message_list)
+    return f'Failed to get a response...'
 
 
 def convert_markdown_to_slack_markup(text):
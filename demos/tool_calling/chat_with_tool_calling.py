@@ -1,10 +1,14 @@
-import json
 import os
 
 import gradio as gr
 from dotenv import load_dotenv
 
+from demos.components.agent_loop import AgentLoop
+from demos.components.conversation_context import ConversationCompactor, make_llm_summarizer
+from demos.components.metrics import metrics_app_kwargs
 from demos.components.open_router_client import OpenRouterClient, GPT_41_MINI
+from demos.components.tool_cache import ToolCache
+from demos.components.usage_ledger import UsageLedger
 from demos.tool_calling.descriptors_fileio import tools_fileio_descriptor
 from demos.tool_calling.tool_descriptors import (tools_weather_descriptor,
                                                  tools_rag_descriptor,
@@ -42,6 +46,24 @@ or_client = OpenRouterClient(model_name=GPT_41_MINI,
                              tools_list=tool_list,
                              api_key=os.getenv('OPENROUTER_API_KEY'))
 
+# search, surf and RAG results are reused, the file I/O tools are never cached
+tool_cache = ToolCache()
+usage_ledger = UsageLedger()
+
+# long conversations: old tool outputs are replaced by stubs, old turns are summarized
+compactor = ConversationCompactor(max_tokens=24000,
+                                  keep_last_turns=4,
+                                  summarizer=make_llm_summarizer(or_client))
+# limits for a single user turn, the LLM gets one more round to answer when these run out
+agent_loop = AgentLoop(or_client,
+                       tool_namespace=globals(),
+                       tool_cache=tool_cache,
+                       compactor=compactor,
+                       usage_ledger=usage_ledger,
+                       deadline_seconds=120,
+                       max_tool_rounds=5,
+                       max_prompt_tokens=200000)
+
 system_instruction = {
     'role': 'system',
     'content': 'Be concise. Be precise. Always think step by step. '
@@ -61,76 +83,23 @@ def append_user(user_message, chat_history, message_list):
 
 
 # blocks UI method
-def append_bot(chat_history, message_list):
-    yield from complete_with_llm(chat_history, message_list)
-
-
-def complete_with_llm(chat_history, message_list):
-    response_stream = or_client.create_completions_stream(message_list=message_list)
-
-    partial_message = ''
-    tool_calls = []
-    chat_history.append({'role': 'assistant', 'content': ''})  # append empty response?
-
-    for chunk in response_stream:  # stream the response
-        if len(chunk.choices) > 0:
-            # LLM text reponses
-            if chunk.choices[0].delta.content is not None:
-                partial_message = partial_message + chunk.choices[0].delta.content
-                chat_history[-1]['content'] = partial_message
-                yield chat_history, message_list
-
-            # LLM tool call requests
-            if chunk.choices[0].delta.tool_calls is not None:
-                for tool_call_chunk in chunk.choices[0].delta.tool_calls:
-                    if tool_call_chunk.index >= len(tool_calls):
-                        tool_calls.insert(tool_call_chunk.index, tool_call_chunk)
-                    else:
-                        if tool_call_chunk.function is not None:
-                            if tool_calls[tool_call_chunk.index].function is None:
-                                tool_calls[tool_call_chunk.index].function = tool_call_chunk.function
-                            else:
-                                tool_calls[
-                                    tool_call_chunk.index].function.arguments += tool_call_chunk.function.arguments
-
-    response_stream.close()
-
-    # handle text responses
-    if chat_history[-1]['content'] is not None:
-        message_list.append(chat_history[-1])
-
-    # handle tool requests
-    if len(tool_calls) > 0:
-        print(f'Processing {len(tool_calls)} tool calls')
-        for call in tool_calls:
-            print(f'\t- {call.function.name}')
-            fn_pointer = globals()[call.function.name]
-            fn_args = json.loads(call.function.arguments)
-            tool_call_obj = {
-                'role': 'assistant',
-                'content': None,
-                'tool_calls': [
-                    {
-                        'id': call.id,
-                        'type': 'function',
-                        'function': {
-                            'name': call.function.name,
-                            'arguments': call.function.arguments
-                        }
-                    }
-                ]
-            }
-            message_list.append(tool_call_obj)
-
-            if fn_pointer is not None:
-                fn_result = fn_pointer(**fn_args)
-                tool_resp = {'role': 'tool',
-                             'name': call.function.name,
-                             'tool_call_id': call.id,
-                             'content': json.dumps(fn_result)}
-                message_list.append(tool_resp)
-        # recursively call completion message to give the LLM a chance to process results
-        yield from complete_with_llm(chat_history, message_list)
+def append_bot(chat_history, message_list, request: gr.Request):
+    yield from complete_with_llm(chat_history, message_list, request.username, request.session_hash)
+
+
+def complete_with_llm(chat_history, message_list, user=None, session=None):
+    agent_run = agent_loop.start(message_list, user=user, session=session)
+
+    current_round = None
+    for round_nr, partial_message in agent_run.run():  # stream the response(s)
+        if round_nr != current_round:
+            chat_history.append({'role': 'assistant', 'content': ''})  # new response for every round
+            current_round = round_nr
+        chat_history[-1]['content'] = partial_message
+        yield chat_history, message_list
+
+    print(agent_run.get_summary())
+    yield chat_history, message_list
 
 
 def on_clear_clicked():
@@ -174,4 +143,5 @@ with (gr.Blocks(fill_height=True, title='Tool Calling', css=custom_css) as llm_c
                     [cb_live, messages],
                     queue=False)
 
-llm_client_ui.launch(auth=None, server_name='0.0.0.0', server_port=7023)
+llm_client_ui.launch(auth=None, server_name='0.0.0.0', server_port=7023,
+                     app_kwargs=metrics_app_kwargs())  # Prometheus metrics on /metrics
@@ -21,8 +21,8 @@ def search_on_google(query: str):
 
     try:
         json_response = response.json()
-        return json_response
+        return json_response  # the API reports failures as {'error': ...}, those are not cached
     except JSONDecodeError:
         print('WARNING: cannot decode search response')
 
-    return response.text
+    return {'error': f'Search failed with status {response.status_code}: {response.text[:500]}'}
@@ -15,6 +15,8 @@ def get_webpage_content(url: str):
     print(f"Fetching webpage: '{url}'")
 
     response = requests.get(url)
+    if not response.ok:  # an error page is not the content, and is not cached
+        return {'error': f'Fetching {url} failed with status {response.status_code}'}
     markdown_text = markdownify(response.text)
 
     return markdown_text
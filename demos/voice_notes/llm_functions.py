@@ -1,8 +1,13 @@
 import os
+import sys
 
 from dotenv import load_dotenv
 from openai import OpenAI
 
+sys.path.append('../../')
+
+from demos.components.stream_aggregator import coalesce_deltas, get_text_deltas
+
 load_dotenv()
 
 if not os.getenv('OPENROUTER_ENDPOINT') or not os.getenv('OPENROUTER_API_KEY'):
@@ -38,8 +43,5 @@ def summarize_message(message):
                                                      },
                                                      stream=True)
 
-    partial_message = ''
-    for chunk in response_stream:  # stream the response
-        if len(chunk.choices) > 0 and chunk.choices[0].delta.content is not None:
-            partial_message = partial_message + chunk.choices[0].delta.content
-            yield partial_message
+    # stream the response, coalesced to a few updates per second
+    yield from coalesce_deltas(get_text_deltas(response_stream))
@@ -1,7 +1,5 @@
-import json
 import os
 
-import tiktoken
 from dotenv import load_dotenv
 from openai import OpenAI
 
@@ -13,6 +11,7 @@ load_dotenv(dotenv_path=get_abs_path('assets/.env'))
 class OpenLLM:
     client = None
     history = None
+    total_cost = 0
 
     # constructor
     def __init__(self):
@@ -41,9 +40,14 @@ class OpenLLM:
                                                                   "HTTP-Referer": "https://pxl-research.be/",
                                                                   "X-Title": "PXL Smart ICT"
                                                               },
+                                                              stream_options={"include_usage": True},
+                                                              extra_body={"usage": {"include": True}},
                                                               stream=True)
         partial_message = ""
+        usage = None
         for chunk in response_stream:  # stream the response
+            if chunk.usage is not None:  # the last chunk, with the exact token counts and cost
+                usage = chunk.usage
             if len(chunk.choices) > 0 and chunk.choices[0].delta.content is not None:
                 partial_message = partial_message + chunk.choices[0].delta.content
                 yield partial_message
@@ -51,13 +55,13 @@ class OpenLLM:
         # append to history
         self.history.append({"role": "assistant", "content": partial_message})
 
-        # cost estimate
-        rate = 1667000  # in tokens per dollar
-        tokeniser = tiktoken.encoding_for_model("gpt-4")
-        hist_string = json.dumps(self.history)
-        hist_len = len(tokeniser.encode(hist_string))
-        cost_in_dollar_cents = round(hist_len / rate * 1000, ndigits=2)
-        print(f"Cost estimate: {cost_in_dollar_cents} cents for history of {hist_len} tokens")
+        # cost, as reported by OpenRouter
+        if usage is not None:
+            cost = getattr(usage, "cost", None) or 0
+            self.total_cost += cost
+            print(f"Cost: {round(cost * 100, 4)} cents for {usage.prompt_tokens} prompt tokens "
+                  f"and {usage.completion_tokens} completion tokens "
+                  f"(total: {round(self.total_cost * 100, 4)} cents)")
 
     def get_history(self):
         return self.history
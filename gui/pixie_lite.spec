@@ -6,7 +6,7 @@ a = Analysis(
     pathex=['../.venv/lib/python3.12/site-packages/'],
     binaries=[],
     datas=[('assets/.env', 'assets/'), ('assets/header.html', 'assets/.'), ('assets/README.md', 'assets/'), ('assets/chat.png', 'assets/')],
-    hiddenimports=['tiktoken_ext.openai_public', 'tiktoken_ext'],
+    hiddenimports=[],
     hookspath=[],
     hooksconfig={},
     runtime_hooks=[],